@@ -13,6 +13,9 @@
 // @grant        GM_xmlhttpRequest
 // @grant        GM_registerMenuCommand
 // @connect      amazonaws.com
+// @connect      on.aws
+// @connect      localhost
+// @connect      127.0.0.1
 // @license      GPL-3.0-or-later
 // ==/UserScript==
 
@@ -53,6 +56,10 @@
     const LOGO_DATA_URI = 'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAADIAAAAyCAYAAAAeP4ixAAAAAXNSR0IArs4c6QAAAARnQU1BAACxjwv8YQUAAAAJcEhZcwAADsEAAA7BAbiRa+0AAAAYdEVYdFNvZnR3YXJlAFBhaW50Lk5FVCA1LjEuOBtp6qgAAAC2ZVhJZklJKgAIAAAABQAaAQUAAQAAAEoAAAAbAQUAAQAAAFIAAAAoAQMAAQAAAAIAAAAxAQIAEAAAAFoAAABphwQAAQAAAGoAAAAAAAAA2XYBAOgDAADZdgEA6AMAAFBhaW50Lk5FVCA1LjEuOAADAACQBwAEAAAAMDIzMAGgAwABAAAAAQAAAAWgBAABAAAAlAAAAAAAAAACAAEAAgAEAAAAUjk4AAIABwAEAAAAMDEwMAAAAADlfWmFYlGVvgAADM1JREFUaEOFmn2MZ1V5xz/Pub+Xmd3Z2R13LOsIMyugqWBroywgGgkBWkmlaZq4/mFIqomWxhihtIIBE5NCGghvNqlJ27T9R11namJTTapUwDSpdgGtLUFpxYVdcFkXdphZ5u03v989T/84zzn3nPubpc/u/d17z8tznu/zdl7uCG9AK1+6+pBuvXaZUF/jt1dVxAECaNZK06s0JeldrV6zetBWYwERRASQ1F8BOpOinsddf9dTM7f9+MnEokUN74xW73/Xe/3m+p0ov69+KIiAOLCB7H+iCK0RIVB6K4oVjcBTxwjCWsRyVdR7UAURVfw/SX/q3jfd8ezRhl+gMSCv3fcbd8lw/S583VfvUdNWo9IGRQEme9H00yLVplhA8jYiQRFmvRK7ggZA6nrQn3pw/x1P35Y3KYCs3HPhQyC3INZJAU9wj4J2AhMMV2hcFd9UF9KVFpWxMZLe7EUzM6pzqJOHZ+88dmts4uLDyv3veQDklqCV0EmshUgUMpU2UmnUmKI+qFM06LRQuIVFvEJheIstI6tokqK/COIcOBeecbcsP3j5A6keYOXed17BcPgfQl0OL4DaQNFCkaLKYtxmKrZubf9Ijcbd0IA0TQqyXg1wB6KCdz2007ty9nP/fTRYZHP1dkZbqPpicE3aKiRKJBqFshgySpotKIkDGccQJ01djJsSj9VHTwnokXoDtl67HUBW//KDh/zyC0dVaxFXgWsyiFpAJv9sCUsCkpEGE5mOkSSSPY1ZI/0UZe22wSLNPcRvjaqo7j5whfNrZy7D14K4wMQHwSPDnUAEARUp0o6BiFjsKvq1QdNSROwj5ppWFh+iJVJMKqC16NbKZQ7qazTOD0qawPBN0Je0UxmpPNYqGpRgaRM0CNcMlXcLj7E+pzELNkDC/CaI+msco9cVV6VAAhmXv3jPR2o/N46EjhDdDpcfILoNOmramaecK+228QQyZeUZTRzUm+pUKpu1d0KfgwiVZUy0EIsx1jXwL6O8inLarlWUDZSt0DBav929KClJ2yBSD0Feu3t+Ea0OBxdoGiWGO3Jumyw0UoD6JPqWjzJxwx3QmWjaigNVth/9MvziQbSaj6oxHm2eJaXaJKONKYJ6v+RCfJiSWhbJ39+IcsOpHyL7L2Ji/hJ6cxfRm7s4XG+5kN7cRbh98zBsUmneOx+ubZ1xUTS5JwiWqtrd2m8N5QtDgdLX7Fm0Bq1xKIJHqBH14EN5jNXcCDFE83F3tFEUtRBQ4xIlcP1/mWTl0rIEmHDGRBCcXTEFhF/rIXHFEDtnVWPr6Fie30s0ri1yUnC8a/wpxU5Pbf8TQjykV8FFOJIrK3DQ1lxUgM0oljTi2ZOt7TKLZJTJNs4yJzFOTUkzF5QAnQgiFTjLkEaNvQKV6moK8zYFZ3txrXyW6oS4lmqzLQWE1sjKOSZS02JVhWzvJIBrN9pphFggxqNYjYchzbUimAAh/hvnCGTZP58H8iQk3u+k10AiiAMnLmwixhZroWcqbbEJnmyyxeRSxkhTWD6UFLNNBiEITwDgRiC1R9WHNi1BxHKmipTbZ6NMH9YhVbXShj1bf0u/mCobH1fMrcpxEqX0qRLyXb0MmydgHdjexHuP94rHABmJr2EDGDyP+FWwrUJkl9O4Uq2dWI8oazBuxkITzoLGS/IyBf8KOvsh3HX/QPXhv8P91g145woB4+Uuvorqd7+CXL+EHvgDpH45l7MtTnqQvMBWyU29WNYqVKHZjBJmAs4BBjKmwxWqS9/P7us+Qe/dvw1SpTW5ht0BHmXi7YfYffXH6F36gbAx0jrxSVSEp+2PzCXHco/J5oC4uygri9fWBJUvpQGqWdzKv7K9eDODk/9LF+jEI57ISMOy3gOD088zOvJHyKkj0DkfbIS2ZcxzGgupyZGs0ZjFKc2SOowp6VgmUrJo5JIoOKKIIr2DuNXHGHz9E2y++IzZMhrcgl8cg18+y/bXPoWe/hbafVtYwjhBXK7umAjCnKNjY0dF2puGeSr1DYqItaFF2BzlDBp+hrs5XOu8DVn7AYMjh9l47snUVFFwjuHxnzD8yh/Cq99DuwejBEGRMsD5M7j6JOKXTR5B2yuHOC5RjmC6tBHJAYdbE6qqttnKOkYLRgyCIqpItYDbPMbgq1ey+fTj1qdieOxHbH/1Y+jZo/jefAAhArqFjI5DbwbdeyXM/g7MvA/YCnpTtUMRnxvBSE2TIMt3zy+Krw7nTcJiLusSH0cnYATSPw9cF4kbMnOx1ENBh6fx9SadG79NNT3D6JufRDd+Cv0L7IxKENaQfVfQue5OqgMXQ3cCRfF+xOD7R9Affgbtzeecm3nHFKgI6nXJJbVaXQDRCJSsMDyBLtyMv/x+1P8KV79kfm3LhWglVfAecbO4aj+jb3+Y4ZH3o4PjSP+CVnrfht4U0utRr5yiPvMiUnXoTu3HnX8JjKIQbQoymr+gBA+N3tWASAAi2dZ0coaJG26mf9MTMP9xGB0PbqHDZgDrqAJUu6i6c0hnDunsLzSJAjIDp5bY/PtDbH7r82x+4ya2j/4jDnD1II1eUi5Yc3TlkvJzv4jCxCKA3gXIz/6C0ZP/TP/th9h105fpfvTfkUvuRLt9ZHAcGZyA4YtQryJ+gNMRIoJzDpERwgZSn8INTiAbx2F0Al34NN3DjzH1yW/Qu/Y+/C9/Es6Lz54KU5EpOVKUU+OLvcvyPQcXRd3hEFDRIgUEawkiHvUvUV2/yO6rPkKF4H3NcPkkoxM/pX7hx+jL/wVnn0W2/wf8FlIBFVAdgOrXkMkLYPZdMPebuIPvpjpwId3eJL4esPbNe5Bun6kbP8fG1/4M/fmX0M68BXwuS0CmCCqgtS7J8t0LBsQs0QaSYkDAWRSNXkDecx+7rv44vT2zAAwB72t0ax2/tY5srSP1IHitq6DbR3uT0OlDbxLf6SIiVOLQ108zePRvGT15F+6qh+i+84MMFz+E1H1UKpsCCIfkFgdJQgH1uiTLf76wKCqHk6nyuwGIWQbTgojgh7+A2RvpfuCz9N5xOTKxJ7i9/TpbNuShrUBNSKleQLfWGP38CUaP3Y+++h2YOIh03xQUN/gVSKfpG8Fk+iZaxPul6vZrpj+CyqVppDhyApHdU85RxO2H9WcZPf031MeO4+sOMrkb6U8grkPVAhFZglK//grDn/2Q7e88zOjfPgubz0FvPgjn16A+i0iv7CvNIt5KmgFUn5EzXzx/UXCHi2GD9Swzt8WxBqLhKMz7ML9sA9PvwC38HtXCe+m8eQGZ2od0+qgfoRtn8SunGL34NP7YI+jp74f46c6FMxAxW9quMXyuHB9bo1V8yIwavsssyZkvzi2Kdg4HHE0qPjeIQCEA8zlHQbdg9AriQbpAF9TtBX0dao/Eha7bB0wl9yg8wUjiV4EdRAgrjZAAAhC/5ETDAjsnMc3sSPn6y/w1SCQgk0hvHibnobcAMo/oNMJbkc4C9A6G8mpvOISIZx9RieUwpaISmcXiP8PqYkVqFpff56Dgx/FIv6xr4snMqrZ907ijjjawFUFzajS+0bBPecny+WDRa2xlgXPOyeSbg21jerVGO1EyRKwvNJANJoTnHdoFrOG40/x3LBaSyNJkqTGlEZTuRHC9PasO139MJCy5IsAxigB0zM7ZFx3TsrVv6m3QnboStTpeDlEXYfAIKA0XG0oF6HcdHfkXOv11Z8ElhQLNtGjzwWbMbyVsiYWwJYudkyZzF2lYROwB/xsFds7LGFsfAKn667LnvKfczJ88cVz6U4+kbyQFF9uH5DExBiIKEQ5kcm0m4ZMMDaCYXlL7OPHG+CqECc9Jh0kJgu/t+e7MZx5/3gHI1Ow9UvUHMQgRE8S+mycQkeKZkcQ0Gfk2QkTLNFZoQLW0YWESt7shCYRz4mwSNASNhygOlju6fSsx/03/8fd+JJN778ZVoVsyYTiWSAqKl609kjvEi3CP3RXKJGCFJZiyc3BxZ1eWMCIpiB+Ffc/U3EPTf/qfJ0LPjM4+cOlDDLZuYTTA23651F0OIHQVaSs4WjGmzRalEaMr5VUNs+AFmUvbSb74OnhBb/LhPZ9/bvxPOACmb3vmVtlz3hdw3YHUNaKj8JHGjmrCBBS1lflzbplsZRoDMpQ2FJpGn4vv1sLiTcT+XMNc13nF+RGu6gxk+q1fyEFEnmO09tfXH6rPnPy0Dl69FnHngxK+/HZsRrZhi5xqgvkmy6kJ3BjGANvAod4EdxLn51BrfcTSgtPhS9KberTet/BX0596ZOzvtnYEEunMvb++V0Zb75NqasHv2nut6FDBobYSjb4etBvOrvBBxcVsrCQQ8RguxJ7ZQgSoEhgFRMQ5qVbc2guPyK6ZtarX+cGum59azcQr6P8AO/ZK2GJWWSwAAAAASUVORK5CYII=';
     let useAWSBackend = API_GATEWAY_URL !== '' && API_KEY !== '';
     const STORAGE_KEY = 'aws_saved_estimates';
+    const BACKEND_PAGE_SIZE = 500;
+    const BACKEND_BATCH_SIZE = 100;
+    const BACKEND_LIST_FIELDS = 'name,url,timestamp,annualCost,ownerName,annualCostCents,timestampMs'; // All the table and CSV export use
+    let linksCache = null; // { links: Map of estimateId -> estimate, syncToken, etag } kept in step with the backend
     let sortState = { column: 'timestamp', direction: 'desc' };
 
 
@@ -246,15 +253,61 @@
     // DATA HANDLING LOGIC
     // =========================================================================
     const dataHandler = {
-        getLinks: () => new Promise((resolve, reject) => {
-            if (useAWSBackend) {
-                GM_xmlhttpRequest({
-                    method: 'GET', url: API_GATEWAY_URL, headers: { 'x-api-key': API_KEY },
-                    onload: (res) => (res.status >= 200 && res.status < 300) ? resolve(JSON.parse(res.responseText)) : reject(res),
-                    onerror: (err) => { console.error('AWS Backend Error (GET):', err); alert('Error: Could not fetch links.'); reject(err); }
-                });
-            } else { resolve(GM_getValue(STORAGE_KEY, [])); }
+        getLinksPage: (query, cursor, etag) => new Promise((resolve, reject) => {
+            let url = `${API_GATEWAY_URL}?limit=${BACKEND_PAGE_SIZE}&fields=${BACKEND_LIST_FIELDS}${query}`;
+            if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+            const headers = { 'x-api-key': API_KEY };
+            if (etag) headers['If-None-Match'] = etag;
+            GM_xmlhttpRequest({
+                method: 'GET', url: url, headers: headers,
+                onload: (res) => {
+                    if (res.status === 304) { resolve({ notModified: true }); }
+                    else if (res.status >= 200 && res.status < 300) {
+                        const etagMatch = /^etag:\s*(.+)$/im.exec(res.responseHeaders || '');
+                        resolve({ page: JSON.parse(res.responseText), etag: etagMatch ? etagMatch[1].trim() : null });
+                    }
+                    else { reject(res); }
+                },
+                onerror: (err) => { console.error('AWS Backend Error (GET):', err); alert('Error: Could not fetch links.'); reject(err); }
+            });
         }),
+        // Walks the paginated list so each request stays bounded in size; only the first page is revalidated
+        fetchAllPages: async (query, etag) => {
+            const first = await dataHandler.getLinksPage(query, null, etag);
+            if (first.notModified) return first;
+            const items = [...first.page.items];
+            let cursor = first.page.nextCursor;
+            while (cursor) {
+                const next = await dataHandler.getLinksPage(query, cursor);
+                items.push(...next.page.items);
+                cursor = next.page.nextCursor;
+            }
+            return { items: items, syncToken: first.page.syncToken, etag: first.etag };
+        },
+        getLinks: async () => {
+            if (!useAWSBackend) return GM_getValue(STORAGE_KEY, []);
+            if (linksCache) {
+                // Delta sync: only estimates changed since the last sync come back, deletions as tombstones
+                try {
+                    const delta = await dataHandler.fetchAllPages(`&since=${linksCache.syncToken}`, linksCache.etag);
+                    if (!delta.notModified && delta.items.length > 0) {
+                        delta.items.forEach(item => item.deleted ? linksCache.links.delete(item.estimateId) : linksCache.links.set(item.estimateId, item));
+                        linksCache.syncToken = delta.syncToken;
+                        linksCache.etag = null;
+                    } else if (!delta.notModified) {
+                        // Nothing changed: keep the same since so the next check can be answered with a 304
+                        linksCache.etag = delta.etag;
+                    }
+                    return Array.from(linksCache.links.values());
+                } catch (res) {
+                    if (!res || res.status !== 410) throw res;
+                    linksCache = null; // Fell behind the tombstone retention window; relist everything
+                }
+            }
+            const full = await dataHandler.fetchAllPages('');
+            linksCache = { links: new Map(full.items.map(item => [item.estimateId, item])), syncToken: full.syncToken, etag: null };
+            return full.items;
+        },
         saveLink: (newLink) => new Promise(async (resolve, reject) => {
             if (useAWSBackend) {
                 GM_xmlhttpRequest({
@@ -270,27 +323,31 @@
                 resolve();
             }
         }),
-        deleteLink: (id) => new Promise(async (resolve, reject) => {
-            if (useAWSBackend) {
-                GM_xmlhttpRequest({
-                    method: 'DELETE', url: `${API_GATEWAY_URL}/${id}`, headers: { 'x-api-key': API_KEY },
-                    onload: (res) => {
-                        if (res.status >= 200 && res.status < 300) { resolve(); }
-                        else {
-                            let errorMsg = 'Could not delete link.';
-                            try { errorMsg = JSON.parse(res.responseText).error || errorMsg; } catch(e){}
-                            alert('Error: ' + errorMsg); reject(res);
-                        }
-                    },
-                    onerror: (err) => { console.error('AWS Backend Error (DELETE):', err); alert('Error: Could not delete link from backend.'); reject(err); }
-                });
-            } else {
+        batchDeletePage: (ids) => new Promise((resolve, reject) => {
+            GM_xmlhttpRequest({
+                method: 'POST', url: `${API_GATEWAY_URL}:batchDelete`, headers: { 'Content-Type': 'application/json', 'x-api-key': API_KEY },
+                data: JSON.stringify({ ids: ids }),
+                onload: (res) => (res.status >= 200 && res.status < 300) ? resolve(JSON.parse(res.responseText).results) : reject(res),
+                onerror: (err) => { console.error('AWS Backend Error (batch DELETE):', err); reject(err); }
+            });
+        }),
+        // Resolves with the per-item results that did not succeed
+        deleteLinks: async (ids) => {
+            if (!useAWSBackend) {
+                const idSet = new Set(ids);
                 let links = await GM_getValue(STORAGE_KEY, []);
-                links = links.filter(link => link.id !== id);
+                links = links.filter(link => !idSet.has(link.id));
                 await GM_setValue(STORAGE_KEY, links);
-                resolve();
+                return [];
             }
-        }),
+            // One request per BACKEND_BATCH_SIZE ids instead of one per row
+            const failures = [];
+            for (let i = 0; i < ids.length; i += BACKEND_BATCH_SIZE) {
+                const results = await dataHandler.batchDeletePage(ids.slice(i, i + BACKEND_BATCH_SIZE));
+                failures.push(...results.filter(result => result.status !== 204));
+            }
+            return failures;
+        },
     };
 
     // =========================================================================
@@ -454,22 +511,23 @@
             noLinksMsg.style.display = links.length > 0 ? 'none' : 'block';
 
             if (links.length > 0) {
-                links.sort((a, b) => {
-                    const key = sortState.column;
-                    let valA = a[key] || '';
-                    let valB = b[key] || '';
-
+                // Sort keys are computed once per row, not per comparison. The backend stores numeric
+                // annualCostCents and timestampMs; only local-only links need their strings parsed.
+                const key = sortState.column;
+                const sortKeys = new Map(links.map(link => {
+                    let value;
                     if (key === 'annualCost') {
-                        valA = parseFloat(valA.replace(/[^\d.-]/g, '')) || 0;
-                        valB = parseFloat(valB.replace(/[^\d.-]/g, '')) || 0;
+                        value = link.annualCostCents ?? Math.round((parseFloat(String(link.annualCost || '').replace(/[^\d.-]/g, '')) || 0) * 100);
                     } else if (key === 'timestamp') {
-                        valA = new Date(valA).getTime() || 0;
-                        valB = new Date(valB).getTime() || 0;
+                        value = link.timestampMs ?? (new Date(link.timestamp).getTime() || 0);
                     } else {
-                        valA = valA.toLowerCase();
-                        valB = valB.toLowerCase();
+                        value = String(link[key] || '').toLowerCase();
                     }
-
+                    return [link, value];
+                }));
+                links.sort((a, b) => {
+                    const valA = sortKeys.get(a);
+                    const valB = sortKeys.get(b);
                     if (valA < valB) return sortState.direction === 'asc' ? -1 : 1;
                     if (valA > valB) return sortState.direction === 'asc' ? 1 : -1;
                     return 0;
@@ -566,8 +624,13 @@
         if (selectedIds.length === 0) return;
         if (window.confirm(`Are you sure you want to delete ${selectedIds.length} estimate(s)?`)) {
             try {
-                await Promise.all(selectedIds.map(id => dataHandler.deleteLink(id)));
-                showPopupNotification(`✅ ${selectedIds.length} estimate(s) deleted.`);
+                const failures = await dataHandler.deleteLinks(selectedIds);
+                if (failures.length > 0) {
+                    console.error('CalcLinkSaver: Some deletes failed:', failures);
+                    showPopupNotification(`⚠️ ${selectedIds.length - failures.length} deleted, ${failures.length} failed.`);
+                } else {
+                    showPopupNotification(`✅ ${selectedIds.length} estimate(s) deleted.`);
+                }
                 await renderLinksTable();
             } catch { showPopupNotification('❌ Delete operation failed.'); }
         }
@@ -1,9 +1,37 @@
 # filename: add_user.py
 # description: A script to simplify adding new users to the CalcLinkSaver backend.
+#
+# Usage:
+#   python3 add_user.py                                         # add one user interactively
+#   python3 add_user.py --bulk team.csv --output credentials.csv  # add everyone listed in team.csv
+#
+# Bulk mode reads display names from a CSV (a 'displayName' or 'name' column, or the first column)
+# or a JSON list (of names, or of objects with 'displayName'). The user IDs given out and the progress
+# are journaled next to the output file, so re-running with the same --output after a failure resumes
+# where it stopped and reuses any users and API keys already created.
+#
+# Deployments fronted by a REST API get API Gateway keys on the deployment's usage plan. Those
+# fronted by an HTTP API or a Function URL (API_FRONTEND in deploy_backend_multiuser.py) check
+# keys in the function, so their keys are generated here and only a hash of each is stored.
+#
+# Deployments found in the account are cached on disk for DISCOVERY_CACHE_TTL_SECONDS, so repeat
+# runs start without listing every API and table again; --refresh searches anew.
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import uuid
 import re
+from botocore.exceptions import ClientError
 
 # ======================================================================================
 # SCRIPT CONFIGURATION
@@ -12,12 +40,28 @@ import re
 # that start with this name.
 BASE_NAME = "CalcLinkSaverMultiUser"
 
+# Bulk mode: concurrent API key creations (API Gateway's management API throttles at a few
+# requests per second), and retries with exponential backoff when throttled
+BULK_WORKERS = 4
+MAX_ATTEMPTS = 8
+THROTTLING_ERRORS = ('TooManyRequestsException', 'ThrottlingException', 'ProvisionedThroughputExceededException')
+BATCH_WRITE_CHUNK_SIZE = 25
+
+# Deployments found by find_deployments(), per account and region; --refresh ignores the cache
+DISCOVERY_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'calclinksaver', 'deployments.json')
+DISCOVERY_CACHE_TTL_SECONDS = 3600
+# Concurrent Function URL lookups, one per users table without an API in front
+DISCOVERY_WORKERS = 8
+
 try:
     # Initialize boto3 clients
     session = boto3.Session()
     AWS_REGION = session.region_name
     apigateway_client = boto3.client('apigateway')
+    apigatewayv2_client = boto3.client('apigatewayv2')
     dynamodb_client = boto3.client('dynamodb')
+    lambda_client = boto3.client('lambda')
+    sts_client = boto3.client('sts')
     if not AWS_REGION:
         raise Exception("AWS Region not found. Please ensure your environment is configured with AWS credentials.")
 except Exception as e:
@@ -28,56 +72,135 @@ except Exception as e:
 # HELPER FUNCTIONS TO FIND AND SELECT DEPLOYMENTS
 # ======================================================================================
 
-def find_deployments():
-    """Finds all complete deployments and their associated resources."""
-    print(f"🔎 Searching for all deployments starting with '{BASE_NAME}'...")
+def suffix_of(name):
+    """The deployment suffix of a resource name, e.g. 'abcdef' from 'CalcLinkSaverMultiUserAPI-abcdef'."""
+    parts = name.split('-')
+    return parts[-1] if len(parts) > 1 else None
+
+def list_all(client, operation, result_key):
+    """Follows a listing's pagination to the end; single pages miss resources in busy accounts."""
+    return [item for page in client.get_paginator(operation).paginate() for item in page.get(result_key, [])]
+
+def find_function_url(suffix):
+    """The Function URL of a deployment without an API Gateway in front, or None."""
+    function_name = f"{BASE_NAME}Function-{suffix}"
+    try:
+        url_configs = with_retry(lambda_client.list_function_url_configs, FunctionName=function_name)
+    except lambda_client.exceptions.ResourceNotFoundException:
+        return None
+    return next(iter(url_configs.get('FunctionUrlConfigs', [])), None)
+
+def discover_deployments():
+    """Lists the account's APIs, tables and usage plans concurrently and assembles the complete deployments."""
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        rest_apis = pool.submit(list_all, apigateway_client, 'get_rest_apis', 'items')
+        http_apis = pool.submit(list_all, apigatewayv2_client, 'get_apis', 'Items')
+        table_names = pool.submit(list_all, dynamodb_client, 'list_tables', 'TableNames')
+        usage_plans = pool.submit(list_all, apigateway_client, 'get_usage_plans', 'items')
+        rest_apis, http_apis, table_names, usage_plans = (future.result() for future in (rest_apis, http_apis, table_names, usage_plans))
+
+    # 1. Group the APIs by suffix
     deployments = {}
+    for item in rest_apis:
+        suffix = suffix_of(item['name'])
+        if item['name'].startswith(BASE_NAME) and suffix:
+            deployments[suffix] = {
+                'api_name': item['name'],
+                'api_id': item['id'],
+                'api_url': f"https://{item['id']}.execute-api.{AWS_REGION}.amazonaws.com/prod/estimates",
+                'suffix': suffix,
+                'key_hash': False
+            }
+    # HTTP APIs have no usage plans; the function checks their keys itself
+    for item in http_apis:
+        suffix = suffix_of(item['Name'])
+        if item['Name'].startswith(BASE_NAME) and item.get('ProtocolType') == 'HTTP' and suffix:
+            deployments[suffix] = {
+                'api_name': item['Name'],
+                'api_id': item['ApiId'],
+                'api_url': f"{item['ApiEndpoint']}/estimates",
+                'suffix': suffix,
+                'key_hash': True
+            }
+
+    # 2. Match the user tables to deployments by suffix
+    users_tables = {suffix_of(table_name): table_name for table_name in table_names
+                    if table_name.startswith(BASE_NAME) and 'Users' in table_name and suffix_of(table_name)}
+    for suffix, deployment in deployments.items():
+        if suffix in users_tables:
+            deployment['users_table_name'] = users_tables[suffix]
+    # No API Gateway in front: the function may have a Function URL instead
+    orphans = [suffix for suffix in users_tables if suffix not in deployments]
+    with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as pool:
+        for suffix, url_config in zip(orphans, pool.map(find_function_url, orphans)):
+            if url_config:
+                deployments[suffix] = {
+                    'api_name': f"{BASE_NAME}Function-{suffix}",
+                    'api_id': None,
+                    'api_url': f"{url_config['FunctionUrl'].rstrip('/')}/estimates",
+                    'suffix': suffix,
+                    'key_hash': True,
+                    'users_table_name': users_tables[suffix]
+                }
 
+    # 3. Match the usage plans to deployments by API ID
+    plans_by_api_id = {stage.get('apiId'): item for item in usage_plans for stage in item.get('apiStages', [])}
+    for deployment in deployments.values():
+        plan = plans_by_api_id.get(deployment['api_id']) if deployment['api_id'] else None
+        if plan:
+            deployment['usage_plan_id'] = plan['id']
+            deployment['usage_plan_name'] = plan['name']
+
+    # 4. Filter out any incomplete deployments
+    return [deployment for deployment in deployments.values()
+            if 'users_table_name' in deployment and ('usage_plan_id' in deployment or deployment['key_hash'])]
+
+def read_discovery_cache(cache_key):
+    """Returns the cached {'savedAt', 'deployments'} entry if it is younger than the TTL, else None."""
     try:
-        # 1. Find all APIs and group them by suffix
-        api_response = apigateway_client.get_rest_apis()
-        for item in api_response.get('items', []):
-            if item['name'].startswith(BASE_NAME):
-                # Extract suffix (e.g., 'abcdef' from 'CalcLinkSaverMultiUserAPI-abcdef')
-                parts = item['name'].split('-')
-                if len(parts) > 1:
-                    suffix = parts[-1]
-                    api_id = item['id']
-                    invoke_url = f"https://{api_id}.execute-api.{AWS_REGION}.amazonaws.com/prod/estimates"
-                    deployments[suffix] = {
-                        'api_name': item['name'],
-                        'api_id': api_id,
-                        'api_url': invoke_url,
-                        'suffix': suffix
-                    }
-
-        # 2. Find all user tables and match them to deployments
-        table_response = dynamodb_client.list_tables()
-        for table_name in table_response.get('TableNames', []):
-            if table_name.startswith(BASE_NAME) and 'Users' in table_name:
-                parts = table_name.split('-')
-                if len(parts) > 1:
-                    suffix = parts[-1]
-                    if suffix in deployments:
-                        deployments[suffix]['users_table_name'] = table_name
-
-        # 3. Find usage plans and match them to deployments
-        plan_response = apigateway_client.get_usage_plans()
-        for item in plan_response.get('items', []):
-            for stage in item.get('apiStages', []):
-                for suffix, deployment_info in deployments.items():
-                    if stage.get('apiId') == deployment_info['api_id']:
-                        deployment_info['usage_plan_id'] = item['id']
-                        deployment_info['usage_plan_name'] = item['name']
-
-        # 4. Filter out any incomplete deployments
-        complete_deployments = {s: d for s, d in deployments.items() if 'users_table_name' in d and 'usage_plan_id' in d}
-        
-        return list(complete_deployments.values())
+        with open(DISCOVERY_CACHE_PATH, encoding='utf-8') as f:
+            entry = json.load(f).get(cache_key)
+    except (OSError, ValueError):
+        return None
+    if not entry or time.time() - entry['savedAt'] > DISCOVERY_CACHE_TTL_SECONDS:
+        return None
+    return entry
+
+def write_discovery_cache(cache_key, deployments):
+    """Stores the deployments under cache_key, keeping other accounts' and regions' entries."""
+    try:
+        with open(DISCOVERY_CACHE_PATH, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[cache_key] = {'savedAt': time.time(), 'deployments': deployments}
+    try:
+        os.makedirs(os.path.dirname(DISCOVERY_CACHE_PATH), exist_ok=True)
+        temporary_path = f"{DISCOVERY_CACHE_PATH}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temporary_path, DISCOVERY_CACHE_PATH)
+    except OSError as e:
+        print(f"  ⚠️  Could not cache the deployments in {DISCOVERY_CACHE_PATH}: {e}")
 
+def find_deployments(refresh=False):
+    """Finds all complete deployments and their associated resources, from the cache when it is fresh."""
+    try:
+        cache_key = f"{sts_client.get_caller_identity()['Account']}/{AWS_REGION}"
+        cached = None if refresh else read_discovery_cache(cache_key)
+        if cached:
+            print(f"🔎 Using the deployments found {(time.time() - cached['savedAt']) / 60:.0f} minute(s) ago "
+                  f"(--refresh to search again).")
+            return cached['deployments']
+        print(f"🔎 Searching for all deployments starting with '{BASE_NAME}'...")
+        deployments = discover_deployments()
     except Exception as e:
         print(f"  ❌ Error searching for deployments: {e}")
         return []
+    # Nothing found is not cached, so a deployment made a moment later shows up on the next run
+    if deployments:
+        write_discovery_cache(cache_key, deployments)
+    return deployments
 
 def select_deployment(deployments):
     """Prompts the user to select a deployment if more than one is found."""
@@ -104,25 +227,278 @@ def select_deployment(deployments):
             print("Invalid input. Please enter a number.")
 
 
+# ======================================================================================
+# BULK PROVISIONING
+# ======================================================================================
+
+def generate_api_key():
+    """A key for a deployment that checks keys in the function; returns (apiKeyId to store, key to hand out)."""
+    api_key = secrets.token_urlsafe(30)
+    # Must match hash_api_key() in estimates_api.py, which looks the key up; not imported from there so this
+    # script runs without the API modules
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest(), api_key
+
+def make_user_id(display_name, unique_hash):
+    """Builds a user ID from the display name, e.g. "Jane Doe" -> "jane.doe.1a2b"."""
+    # The short hash prevents collisions with common names
+    slug = re.sub(r'\s+', '.', display_name.lower())
+    return f"{slug}.{unique_hash}"
+
+def with_retry(call, **kwargs):
+    """Calls an AWS API, backing off exponentially (with full jitter) while it is throttled."""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return call(**kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in THROTTLING_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, min(20.0, 0.5 * (2 ** attempt))))
+
+def read_display_names(path):
+    """Reads display names from a CSV or JSON file, skipping blank entries."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.json'):
+            entries = json.load(f)
+            names = [entry if isinstance(entry, str) else entry.get('displayName') or entry.get('name') for entry in entries]
+        else:
+            rows = list(csv.reader(f))
+            header = [cell.strip() for cell in rows[0]] if rows else []
+            column = next((header.index(name) for name in ('displayName', 'name') if name in header), None)
+            if column is None:
+                column, rows = 0, rows # No header row: every row is a user
+            else:
+                rows = rows[1:]
+            names = [row[column] if len(row) > column else '' for row in rows]
+    return [name.strip() for name in names if name and name.strip()]
+
+def plan_users(display_names, journal):
+    """Gives every listed user a user ID, reusing the ones the journal planned so a re-run maps to the same users and keys.
+
+    The nth listing of a display name keeps the ID it was first given, whatever the input file is called.
+    """
+    planned = journal.planned_users()
+    taken = set(planned.values())
+    occurrences = {}
+    users = []
+    new_users = []
+    for display_name in display_names:
+        occurrences[display_name] = occurrences.get(display_name, 0) + 1
+        user_id = planned.get((display_name, occurrences[display_name]))
+        if not user_id:
+            user_id = make_user_id(display_name, uuid.uuid4().hex[:4])
+            while user_id in taken:
+                user_id = make_user_id(display_name, uuid.uuid4().hex[:4])
+            new_users.append({'userId': user_id, 'displayName': display_name, 'occurrence': occurrences[display_name]})
+        taken.add(user_id)
+        users.append({'displayName': display_name, 'userId': user_id})
+    # Journaled before any key is created, so a key is always found again under the same user
+    journal.record_all(new_users)
+    return users
+
+def open_private(path, mode):
+    """Opens a file that only the current user can read; it holds API keys."""
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if mode == 'a' else os.O_TRUNC)
+    return os.fdopen(os.open(path, flags, 0o600), mode, newline='' if mode == 'w' else None, encoding='utf-8')
+
+class Journal:
+    """Append-only JSON-lines record of the steps finished for each user, replayed on start-up."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {} # userId -> merged fields (displayName, occurrence, apiKeyId, apiKeyValue, planned, stored)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # A line cut short by a crash; that step is simply redone
+                    self.state.setdefault(entry['userId'], {}).update(entry)
+
+    def get(self, user_id):
+        with self.lock:
+            return dict(self.state.get(user_id, {}))
+
+    def planned_users(self):
+        """(displayName, occurrence) -> userId for every user planned so far."""
+        with self.lock:
+            return {(state['displayName'], state['occurrence']): user_id
+                    for user_id, state in self.state.items() if 'occurrence' in state}
+
+    def record(self, user_id, **fields):
+        self.record_all([dict(fields, userId=user_id)])
+
+    def record_all(self, entries):
+        """Appends the entries (each with a userId) with a single fsync."""
+        if not entries:
+            return
+        with self.lock:
+            for entry in entries:
+                self.state.setdefault(entry['userId'], {}).update(entry)
+            with open_private(self.path, 'a') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+                f.flush()
+                os.fsync(f.fileno())
+
+def find_api_key(key_name):
+    """Finds a key created by an earlier run that stopped before journaling it."""
+    response = with_retry(apigateway_client.get_api_keys, nameQuery=key_name, includeValues=True)
+    return next((key for key in response.get('items', []) if key['name'] == key_name), None)
+
+def provision_key(user, deployment, journal):
+    """Creates (or recovers) the user's API key and associates it with the usage plan."""
+    user_id = user['userId']
+    if deployment['key_hash']:
+        if 'apiKeyId' not in journal.get(user_id):
+            api_key_id, api_key = generate_api_key()
+            journal.record(user_id, displayName=user['displayName'], apiKeyId=api_key_id, apiKeyValue=api_key, planned=True)
+        return
+    usage_plan_id = deployment['usage_plan_id']
+    if 'apiKeyId' not in journal.get(user_id):
+        key_name = f"user-{user_id}-key"
+        key = find_api_key(key_name) or with_retry(
+            apigateway_client.create_api_key,
+            name=key_name,
+            description=f"API Key for {user['displayName']}",
+            enabled=True
+        )
+        journal.record(user_id, displayName=user['displayName'], apiKeyId=key['id'], apiKeyValue=key['value'])
+    state = journal.get(user_id)
+    if not state.get('planned'):
+        try:
+            with_retry(apigateway_client.create_usage_plan_key, usagePlanId=usage_plan_id,
+                       keyId=state['apiKeyId'], keyType='API_KEY')
+        except apigateway_client.exceptions.ConflictException:
+            pass # Associated by an earlier run
+        journal.record(user_id, planned=True)
+
+def store_users(users, users_table_name, journal):
+    """Writes the user records with BatchWriteItem, 25 at a time, retrying unprocessed items."""
+    for start in range(0, len(users), BATCH_WRITE_CHUNK_SIZE):
+        pending = {}
+        for user in users[start:start + BATCH_WRITE_CHUNK_SIZE]:
+            state = journal.get(user['userId'])
+            pending[state['apiKeyId']] = (user, {'PutRequest': {'Item': {
+                'apiKeyId': {'S': state['apiKeyId']},
+                'userId': {'S': user['userId']},
+                'displayName': {'S': user['displayName']}
+            }}})
+        for attempt in range(MAX_ATTEMPTS):
+            response = with_retry(dynamodb_client.batch_write_item,
+                                  RequestItems={users_table_name: [request for _, request in pending.values()]})
+            unprocessed = {request['PutRequest']['Item']['apiKeyId']['S']
+                           for request in response.get('UnprocessedItems', {}).get(users_table_name, [])}
+            for api_key_id in list(pending):
+                if api_key_id not in unprocessed:
+                    journal.record(pending.pop(api_key_id)[0]['userId'], stored=True)
+            if not pending:
+                break
+            time.sleep(random.uniform(0, min(20.0, 0.5 * (2 ** attempt))))
+
+def write_credentials(path, api_url, users, journal):
+    """Writes every finished user's credentials (CSV, or JSON for a .json path); returns the count."""
+    rows = []
+    for user in users:
+        state = journal.get(user['userId'])
+        if state.get('stored'):
+            rows.append({'displayName': user['displayName'], 'userId': user['userId'],
+                         'apiUrl': api_url, 'apiKey': state['apiKeyValue']})
+    temporary_path = f"{path}.tmp"
+    with open_private(temporary_path, 'w') as f:
+        if path.lower().endswith('.json'):
+            json.dump(rows, f, indent=2)
+        else:
+            writer = csv.DictWriter(f, fieldnames=['displayName', 'userId', 'apiUrl', 'apiKey'])
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(temporary_path, path)
+    return len(rows)
+
+def provision_bulk(input_path, output_path, deployment, workers):
+    """Adds every user listed in input_path; returns True when all of them are done."""
+    journal = Journal(f"{output_path}.journal")
+    users = plan_users(read_display_names(input_path), journal)
+    pending = [user for user in users if not journal.get(user['userId']).get('stored')]
+    print(f"📋  {len(users)} user(s) listed, {len(users) - len(pending)} already added, {len(pending)} to go.")
+
+    print_lock = threading.Lock()
+    failures = []
+    def provision(user):
+        try:
+            provision_key(user, deployment, journal)
+            with print_lock:
+                print(f"  ✅ API Key ready for {user['displayName']} ({user['userId']}).")
+        except Exception as e:
+            failures.append(user)
+            with print_lock:
+                print(f"  ❌ {user['displayName']}: {e}")
+
+    print(f"\n⚙️  Creating API Keys with {workers} worker(s)...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(provision, pending))
+
+    ready = [user for user in pending if journal.get(user['userId']).get('planned')]
+    if ready:
+        print(f"\n⚙️  Adding {len(ready)} user record(s) to DynamoDB...")
+        store_users(ready, deployment['users_table_name'], journal)
+
+    written = write_credentials(output_path, deployment['api_url'], users, journal)
+    print(f"\n🔑  Credentials for {written} user(s) written to {output_path}")
+    if written < len(users):
+        print(f"⚠️  {len(users) - written} user(s) are not finished. Re-run the same command to resume;")
+        print("    API Keys that were already created are reused, not duplicated.")
+        return False
+    return True
+
+
 # ======================================================================================
 # MAIN EXECUTION
 # ======================================================================================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add users to a CalcLinkSaver deployment.")
+    parser.add_argument('--bulk', metavar='FILE', help="CSV or JSON file of display names to add without prompting")
+    parser.add_argument('--output', metavar='FILE',
+                        help="Where bulk mode writes the credentials (CSV, or JSON for a .json name); required with --bulk")
+    parser.add_argument('--suffix', help="Deployment suffix to use when several deployments exist")
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS, help=f"Concurrent key creations (default: {BULK_WORKERS})")
+    parser.add_argument('--refresh', action='store_true', help="Search the account for deployments instead of using the cache")
+    args = parser.parse_args()
+    if args.bulk and not args.output:
+        parser.error("--output is required with --bulk")
+
     print("==============================================")
     print("== CalcLinkSaver User Addition Utility ==")
     print("==============================================\n")
 
     # 1. Find and select the target deployment
-    all_deployments = find_deployments()
+    all_deployments = find_deployments(args.refresh)
+    if args.suffix and not args.refresh and not any(deployment['suffix'] == args.suffix for deployment in all_deployments):
+        # Deployed since the cache was written
+        all_deployments = find_deployments(refresh=True)
+    if args.suffix:
+        all_deployments = [deployment for deployment in all_deployments if deployment['suffix'] == args.suffix]
+    if args.bulk and len(all_deployments) > 1:
+        print("\n❌ Several deployments found; choose one with --suffix.")
+        exit(1)
     selected_deployment = select_deployment(all_deployments)
 
     if not selected_deployment:
         exit(1)
 
+    if args.bulk:
+        print(f"\n✅ Using deployment '{selected_deployment['api_name']}'")
+        print("----------------------------------------------\n")
+        try:
+            exit(0 if provision_bulk(args.bulk, args.output, selected_deployment, args.workers) else 1)
+        except (OSError, ValueError) as e:
+            print(f"❌ Could not read or write the user files: {e}")
+            exit(1)
+
     # Extract resource IDs from the selected deployment
     api_url = selected_deployment['api_url']
-    usage_plan_id = selected_deployment['usage_plan_id']
+    usage_plan_id = selected_deployment.get('usage_plan_id')
     users_table_name = selected_deployment['users_table_name']
         
     print(f"\n✅ Using deployment '{selected_deployment['api_name']}'")
@@ -135,36 +511,37 @@ if __name__ == "__main__":
         exit(1)
 
     # 3. Generate a unique user ID from the display name
-    # Example: "Jane Doe" -> "jane.doe"
-    user_id = re.sub(r'\s+', '.', display_name.lower())
-    
-    # Append a short unique hash to prevent collisions with common names
-    unique_hash = uuid.uuid4().hex[:4]
-    user_id = f"{user_id}.{unique_hash}"
+    # Example: "Jane Doe" -> "jane.doe.1a2b"
+    user_id = make_user_id(display_name, uuid.uuid4().hex[:4])
 
     print(f"  - Generated unique User ID: {user_id}")
     
     try:
-        # 4. Create the API Key
-        print("\n⚙️  Creating new API Key...")
-        key_name = f"user-{user_id}-key"
-        key_response = apigateway_client.create_api_key(
-            name=key_name,
-            description=f"API Key for {display_name}",
-            enabled=True,
-        )
-        api_key_value = key_response['value']
-        api_key_id = key_response['id']
-        print(f"  ✅ API Key '{key_name}' created.")
-
-        # 5. Associate the key with the Usage Plan
-        print("⚙️  Associating Key with Usage Plan...")
-        apigateway_client.create_usage_plan_key(
-            usagePlanId=usage_plan_id,
-            keyId=api_key_id,
-            keyType='API_KEY'
-        )
-        print("  ✅ Key associated with plan.")
+        if selected_deployment['key_hash']:
+            # 4-5. The function checks the key, so it is generated here and only its hash is stored
+            api_key_id, api_key_value = generate_api_key()
+            print("\n  ✅ API Key generated.")
+        else:
+            # 4. Create the API Key
+            print("\n⚙️  Creating new API Key...")
+            key_name = f"user-{user_id}-key"
+            key_response = apigateway_client.create_api_key(
+                name=key_name,
+                description=f"API Key for {display_name}",
+                enabled=True,
+            )
+            api_key_value = key_response['value']
+            api_key_id = key_response['id']
+            print(f"  ✅ API Key '{key_name}' created.")
+
+            # 5. Associate the key with the Usage Plan
+            print("⚙️  Associating Key with Usage Plan...")
+            apigateway_client.create_usage_plan_key(
+                usagePlanId=usage_plan_id,
+                keyId=api_key_id,
+                keyType='API_KEY'
+            )
+            print("  ✅ Key associated with plan.")
 
         # 6. Add the user record to DynamoDB
         print("⚙️  Adding user record to DynamoDB...")
@@ -192,6 +569,7 @@ if __name__ == "__main__":
         print("🔥 AN ERROR OCCURRED 🔥")
         print(f"Error details: {e}")
         print("Please check the error messages. You may need to clean up partial resources from the AWS console.")
+        print("If the deployment was changed or removed recently, run again with --refresh.")
         print("="*50)
 
 
@@ -0,0 +1,414 @@
+# filename: benchmark_handler.py
+# description: Load-test and latency benchmark for the /estimates handler. Seeds a local store with
+#              estimates spread across many owners, drives a mixed GET/POST/DELETE workload from a
+#              thread pool and prints a JSON report (throughput, latency percentiles and, for the
+#              in-memory DynamoDB stand-in, calls and capacity units per route).
+#
+# Examples:
+#   python3 benchmark_handler.py                                # 1k/10k/100k estimates, in-memory DynamoDB
+#   python3 benchmark_handler.py --sizes 10000 --threads 16 --output bench.json
+#   python3 benchmark_handler.py --store sqlite                 # the local_server.py store instead
+#   python3 benchmark_handler.py --event-format 2.0             # as an HTTP API or Function URL delivers requests
+#
+# --event-format 2.0 replays each request as the version 2.0 event an HTTP API (or a Function URL)
+# would send, carrying the raw x-api-key header, so the handler's event conversion and key-hash
+# user lookup are included in the latencies. Gateway time itself is not modelled by either format.
+#
+# The dynamodb store runs the real dynamodb_store.py, so boto3 must be importable (no AWS access is made).
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import request_metrics
+from estimates_api import build_item, estimate_key, handle, hash_api_key, now_ms
+
+# ======================================================================================
+# SCRIPT CONFIGURATION
+# ======================================================================================
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_OWNERS = 50
+DEFAULT_THREADS = 8
+DEFAULT_REQUESTS = 2000
+# Relative weight of each route in the workload
+DEFAULT_MIX = {
+    'list_page': 30,   # GET /estimates?limit=100&fields=... (the userscript's first page)
+    'list_owner': 15,  # GET /estimates?owner=me&limit=100
+    'list_delta': 15,  # GET /estimates?since=<one minute ago>
+    'list_sorted': 10, # GET /estimates?sort=cost&order=desc&minCost=...&limit=100 (server-side sort and filter)
+    'stats': 5,        # GET /estimates/stats (per-owner counts and totals)
+    'save': 25,        # POST /estimates
+    'delete': 12,      # DELETE /estimates/{id}
+    'batch_delete': 3  # POST /estimates:batchDelete with BATCH_DELETE_SIZE ids
+}
+# Status codes that count as success for each route
+EXPECTED_STATUSES = {
+    'list_page': {200},
+    'list_owner': {200},
+    'list_delta': {200},
+    'list_sorted': {200},
+    'stats': {200},
+    'save': {201},
+    'delete': {204},
+    'batch_delete': {200}
+}
+LIST_FIELDS = 'name,url,timestamp,annualCost,ownerName'
+BATCH_DELETE_SIZE = 10
+# Seeded estimates were last modified between these many milliseconds ago
+SEED_MIN_AGE_MS = 10 * 60 * 1000
+SEED_MAX_AGE_MS = 30 * 24 * 3600 * 1000
+
+ESTIMATES_TABLE_NAME = "BenchmarkEstimates"
+USERS_TABLE_NAME = "BenchmarkUsers"
+# Mirrors the table that deploy_backend_multiuser.py creates
+ESTIMATES_TABLE_SCHEMA = {
+    'KeySchema': [{'AttributeName': 'estimateId', 'KeyType': 'HASH'}],
+    'GlobalSecondaryIndexes': [
+        {'IndexName': 'OwnerTimestampIndex', 'KeySchema': [
+            {'AttributeName': 'ownerId', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ]},
+        {'IndexName': 'LastModifiedIndex', 'KeySchema': [
+            {'AttributeName': 'syncBucket', 'KeyType': 'HASH'},
+            {'AttributeName': 'lastModified', 'KeyType': 'RANGE'}
+        ]},
+        {'IndexName': 'CostIndex', 'KeySchema': [
+            {'AttributeName': 'syncBucket', 'KeyType': 'HASH'},
+            {'AttributeName': 'annualCostCents', 'KeyType': 'RANGE'}
+        ]},
+        {'IndexName': 'NameIndex', 'KeySchema': [
+            {'AttributeName': 'syncBucket', 'KeyType': 'HASH'},
+            {'AttributeName': 'nameLower', 'KeyType': 'RANGE'}
+        ]},
+        {'IndexName': 'TimestampIndex', 'KeySchema': [
+            {'AttributeName': 'syncBucket', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestampMs', 'KeyType': 'RANGE'}
+        ]}
+    ]
+}
+
+def log(message):
+    """Progress goes to stderr so stdout carries only the JSON report."""
+    print(message, file=sys.stderr)
+
+def make_estimate(rng, estimate_id):
+    """A frontend-shaped estimate payload."""
+    return {
+        'id': estimate_id,
+        'name': f"Estimate {estimate_id}",
+        'url': f"https://calculator.aws/#/estimate?id={uuid.UUID(int=rng.getrandbits(128)).hex}",
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(time.time() - rng.randrange(365 * 24 * 3600))),
+        'annualCost': round(rng.uniform(10, 250000), 2)
+    }
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))]
+
+# ======================================================================================
+# STORES
+# ======================================================================================
+
+def create_memory_store(owners, unprocessed_rate, seed):
+    """The real DynamoDBStore on top of the in-memory stand-in. Returns (store, users, database)."""
+    from dynamodb_store import DynamoDBStore
+    from inmemory_dynamodb import InMemoryDynamoDB
+    database = InMemoryDynamoDB(unprocessed_rate=unprocessed_rate, seed=seed)
+    database.create_table(TableName=ESTIMATES_TABLE_NAME, **ESTIMATES_TABLE_SCHEMA)
+    users_table = database.create_table(TableName=USERS_TABLE_NAME, KeySchema=[{'AttributeName': 'apiKeyId', 'KeyType': 'HASH'}])
+    users = []
+    for index in range(owners):
+        # A REST API resolves the key to its apiKeyId; 2.0 events are looked up by the key's hash
+        user = {'apiKeyId': f"benchmark-key-{index}", 'userId': f"benchmark-user-{index}", 'displayName': f"Benchmark User {index}"}
+        users_table.put_item(Item=user)
+        users_table.put_item(Item=dict(user, apiKeyId=hash_api_key(user['apiKeyId'])))
+        users.append(dict(user, apiKey=user['apiKeyId']))
+    return DynamoDBStore(ESTIMATES_TABLE_NAME, USERS_TABLE_NAME, client=database.client()), users, database
+
+def create_sqlite_store(owners, threads, directory):
+    """The local_server.py store on a fresh database file. Returns (store, users, None)."""
+    from local_server import SQLiteStore
+    store = SQLiteStore(os.path.join(directory, f"benchmark-{uuid.uuid4().hex}.db"), pool_size=threads)
+    users = []
+    for index in range(owners):
+        display_name = f"Benchmark User {index}"
+        user_id, api_key = store.add_user(display_name)
+        users.append({'apiKeyId': hash_api_key(api_key), 'apiKey': api_key, 'userId': user_id, 'displayName': display_name})
+    return store, users, None
+
+def seed_estimates(store, users, size, rng):
+    """Writes `size` estimates round-robin across the users; returns {userId: [estimateId, ...]}."""
+    owned = {user['userId']: [] for user in users}
+    chunk = []
+    for index in range(size):
+        user = users[index % len(users)]
+        estimate_id = f"seed-{index:07d}"
+        item = build_item(make_estimate(rng, estimate_id), user['userId'], user['displayName'])
+        # Backdate seeded changes so delta syncs only see what the workload itself writes
+        item['lastModified'] = now_ms() - rng.randrange(SEED_MIN_AGE_MS, SEED_MAX_AGE_MS)
+        chunk.append(item)
+        owned[user['userId']].append(item['estimateId']) # Estimates with a url are stored under estimate_key()
+        if len(chunk) == 1000:
+            store.put_items(chunk)
+            chunk = []
+    if chunk:
+        store.put_items(chunk)
+    store.bump_collection_version()
+    for estimate_ids in owned.values():
+        rng.shuffle(estimate_ids)
+    return owned
+
+# ======================================================================================
+# WORKLOAD
+# ======================================================================================
+
+class Workload:
+    """Turns route names into proxy events for a random user, tracking which estimates each user still owns."""
+
+    def __init__(self, users, owned, accept_encoding, event_format):
+        self.users = users
+        self.owned = owned
+        self.owned_lock = threading.Lock()
+        self.accept_encoding = accept_encoding
+        self.event_format = event_format
+
+    def take_owned(self, user, count, rng):
+        """Hands out up to `count` of a user's estimates for deletion, switching to another user once theirs run out."""
+        with self.owned_lock:
+            if not self.owned[user['userId']]:
+                candidates = [candidate for candidate in self.users if self.owned[candidate['userId']]]
+                user = rng.choice(candidates) if candidates else user
+            estimate_ids = self.owned[user['userId']]
+            taken = estimate_ids[-count:]
+            del estimate_ids[-count:]
+        return user, taken
+
+    def event(self, route, rng):
+        user = rng.choice(self.users)
+        method, path, query, body, path_parameters = 'GET', '/estimates', None, None, None
+        if route == 'list_page':
+            query = {'limit': '100', 'fields': LIST_FIELDS}
+        elif route == 'list_owner':
+            query = {'owner': 'me', 'limit': '100'}
+        elif route == 'list_delta':
+            query = {'since': str(now_ms() - 60 * 1000)}
+        elif route == 'list_sorted':
+            query = {'sort': 'cost', 'order': 'desc', 'minCost': str(rng.randrange(0, 200000)), 'limit': '100',
+                     'fields': LIST_FIELDS}
+        elif route == 'stats':
+            path = '/estimates/stats'
+        elif route == 'save':
+            estimate_id = f"bench-{uuid.UUID(int=rng.getrandbits(128)).hex}"
+            method, body = 'POST', make_estimate(rng, estimate_id)
+        elif route == 'delete':
+            user, estimate_ids = self.take_owned(user, 1, rng)
+            estimate_ids = estimate_ids or ['missing']
+            method, path, path_parameters = 'DELETE', f"/estimates/{estimate_ids[0]}", {'id': estimate_ids[0]}
+        elif route == 'batch_delete':
+            user, estimate_ids = self.take_owned(user, BATCH_DELETE_SIZE, rng)
+            estimate_ids = estimate_ids or ['missing']
+            method, path, body = 'POST', '/estimates:batchDelete', {'ids': estimate_ids}
+        headers = {'Accept-Encoding': self.accept_encoding} if self.accept_encoding else {}
+        body = json.dumps(body) if body is not None else None
+        if self.event_format == '2.0':
+            return user, http_api_event(method, path, headers, query, body, user['apiKey'])
+        return user, {
+            'httpMethod': method,
+            'path': path,
+            'headers': headers,
+            'queryStringParameters': query,
+            'pathParameters': path_parameters,
+            'body': body,
+            'requestContext': {'identity': {'apiKeyId': user['apiKeyId']}}
+        }
+
+    def completed(self, route, user, event, status_code):
+        """Saved estimates become delete candidates only once the save has succeeded."""
+        if route == 'save' and status_code == 201:
+            body = json.loads(event['body'])
+            # Saves with a url are stored under their link's key, not the id the client sent
+            estimate_id = estimate_key(user['userId'], body['url']) if body.get('url') else body['id']
+            with self.owned_lock:
+                self.owned[user['userId']].insert(0, estimate_id)
+
+def http_api_event(method, path, headers, query, body, api_key):
+    """The version 2.0 event an HTTP API's $default route (or a Function URL) delivers for a request."""
+    return {
+        'version': '2.0',
+        'routeKey': '$default',
+        'rawPath': path,
+        'rawQueryString': urlencode(query or {}),
+        'headers': dict({name.lower(): value for name, value in headers.items()}, **{'x-api-key': api_key}),
+        'queryStringParameters': query,
+        'requestContext': {
+            'http': {'method': method, 'path': path},
+            'requestId': uuid.uuid4().hex,
+            'stage': '$default'
+        },
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def run_workload(store, database, workload, mix, requests, threads, seed):
+    """Runs `requests` requests from `threads` workers; returns (samples, wall_seconds)."""
+    routes = list(mix)
+    schedule = random.Random(seed).choices(routes, weights=[mix[route] for route in routes], k=requests)
+    samples = []
+
+    def run(task):
+        index, route = task
+        rng = random.Random(seed * 1000003 + index)
+        user, event = workload.event(route, rng)
+        if database is not None:
+            with database.capture() as usage:
+                started = time.perf_counter()
+                response = handle(event, store)
+                elapsed = time.perf_counter() - started
+        else:
+            usage = None
+            started = time.perf_counter()
+            response = handle(event, store)
+            elapsed = time.perf_counter() - started
+        workload.completed(route, user, event, response['statusCode'])
+        samples.append((route, response['statusCode'], elapsed, usage))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(run, enumerate(schedule)))
+    return samples, time.perf_counter() - started
+
+def summarize(samples, wall_seconds):
+    """Aggregates samples into per-route throughput, latency percentiles and DynamoDB usage."""
+    routes = {}
+    for route in sorted({sample[0] for sample in samples}):
+        route_samples = [sample for sample in samples if sample[0] == route]
+        latencies = sorted(sample[2] * 1000 for sample in route_samples)
+        summary = {
+            'requests': len(route_samples),
+            'errors': sum(1 for sample in route_samples if sample[1] not in EXPECTED_STATUSES[route]),
+            'throughput_rps': round(len(route_samples) / wall_seconds, 2),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'p50': round(percentile(latencies, 0.50), 3),
+                'p95': round(percentile(latencies, 0.95), 3),
+                'p99': round(percentile(latencies, 0.99), 3),
+                'max': round(latencies[-1], 3)
+            }
+        }
+        usages = [sample[3] for sample in route_samples if sample[3] is not None]
+        if usages:
+            calls, read_units, write_units = {}, 0.0, 0.0
+            for usage in usages:
+                for operation, totals in usage.items():
+                    calls[operation] = calls.get(operation, 0) + totals['calls']
+                    read_units += totals['read_units']
+                    write_units += totals['write_units']
+            summary['dynamodb'] = {
+                'calls_per_request': {operation: round(count / len(usages), 3) for operation, count in sorted(calls.items())},
+                'read_units_per_request': round(read_units / len(usages), 3),
+                'write_units_per_request': round(write_units / len(usages), 3)
+            }
+        routes[route] = summary
+    return routes
+
+def benchmark(args, size, mix, directory):
+    rng = random.Random(args.seed)
+    log(f"🌱  Seeding {size} estimates across {args.owners} owners ({args.store})...")
+    started = time.perf_counter()
+    if args.store == 'sqlite':
+        store, users, database = create_sqlite_store(args.owners, args.threads, directory)
+    else:
+        store, users, database = create_memory_store(args.owners, args.unprocessed_rate, args.seed)
+    owned = seed_estimates(store, users, size, rng)
+    seed_seconds = time.perf_counter() - started
+
+    log(f"🏁  Running {args.requests} requests on {args.threads} threads...")
+    workload = Workload(users, owned, args.accept_encoding, args.event_format)
+    samples, wall_seconds = run_workload(store, database, workload, mix, args.requests, args.threads, args.seed)
+    errors = sum(1 for sample in samples if sample[1] not in EXPECTED_STATUSES[sample[0]])
+    log(f"  ✅ {len(samples) / wall_seconds:.1f} requests/s, {errors} errors")
+    return {
+        'store': args.store,
+        'estimates': size,
+        'seed_seconds': round(seed_seconds, 3),
+        'wall_seconds': round(wall_seconds, 3),
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / wall_seconds, 2),
+        'routes': summarize(samples, wall_seconds)
+    }
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        route, _, weight = part.partition('=')
+        route = route.strip()
+        if route not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown route '{route}'. Routes: {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[route] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Weight for '{route}' must be a number.")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("At least one route needs a positive weight.")
+    return mix
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CalcLinkSaver handler against a local store.")
+    parser.add_argument('--store', choices=['memory', 'sqlite'], default='memory',
+                        help="memory: dynamodb_store.py on the in-memory DynamoDB stand-in; sqlite: local_server.py's store")
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')], default=DEFAULT_SIZES,
+                        help="Comma-separated estimate counts to seed, one run each (default: 1000,10000,100000)")
+    parser.add_argument('--owners', type=int, default=DEFAULT_OWNERS)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help="Requests per run")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="Route weights, e.g. list_page=50,save=50 (routes: %s)" % ', '.join(DEFAULT_MIX))
+    parser.add_argument('--event-format', choices=['1.0', '2.0'], default='1.0',
+                        help="Proxy event payload version: 1.0 as a REST API sends, 2.0 as an HTTP API or Function URL sends")
+    parser.add_argument('--accept-encoding', default=None, help="Accept-Encoding sent with every request, e.g. gzip")
+    parser.add_argument('--unprocessed-rate', type=float, default=0.0,
+                        help="Fraction of batch entries the stand-in reports as unprocessed (memory store only)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    # Metrics are still collected per request, but their log lines would interleave with the report
+    request_metrics.set_sink(None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        runs = [benchmark(args, size, args.mix, directory) for size in args.sizes]
+    report = {
+        'benchmark': 'handler',
+        'python': platform.python_version(),
+        'config': {
+            'store': args.store,
+            'owners': args.owners,
+            'threads': args.threads,
+            'requests': args.requests,
+            'mix': args.mix,
+            'event_format': args.event_format,
+            'accept_encoding': args.accept_encoding,
+            'unprocessed_rate': args.unprocessed_rate,
+            'seed': args.seed
+        },
+        'runs': runs
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"📄  Report written to {args.output}")
+    else:
+        print(output)
@@ -1,29 +1,132 @@
 # filename: deploy_backend_multiuser.py
+#
+# Usage:
+#   python3 deploy_backend_multiuser.py                   # deploy a new stack with a random suffix
+#   python3 deploy_backend_multiuser.py --update abc123   # bring the abc123 stack up to date
 
+import argparse
+import base64
 import boto3
+import hashlib
 import json
+import os
 import time
 import zipfile
 import io
 import random
 import string
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # ======================================================================================
 # SCRIPT CONFIGURATION
 # ======================================================================================
-# Generate a unique suffix to prevent resource name collisions
-UNIQUE_SUFFIX = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
 BASE_NAME = "CalcLinkSaverMultiUser"
-
-# Define resource names
-ESTIMATES_TABLE_NAME = f"{BASE_NAME}Estimates-{UNIQUE_SUFFIX}"
-USERS_TABLE_NAME = f"{BASE_NAME}Users-{UNIQUE_SUFFIX}"
-ROLE_NAME = f"{BASE_NAME}LambdaRole-{UNIQUE_SUFFIX}"
-POLICY_NAME = f"{BASE_NAME}DynamoDBPolicy-{UNIQUE_SUFFIX}"
-FUNCTION_NAME = f"{BASE_NAME}Function-{UNIQUE_SUFFIX}"
-API_NAME = f"{BASE_NAME}API-{UNIQUE_SUFFIX}"
+OWNER_INDEX_NAME = "OwnerTimestampIndex"
+LAST_MODIFIED_INDEX_NAME = "LastModifiedIndex"
+COST_INDEX_NAME = "CostIndex"
+NAME_INDEX_NAME = "NameIndex"
+TIMESTAMP_INDEX_NAME = "TimestampIndex"
+# Sparse indexes behind GET /estimates?sort=...: index name -> (derived attribute, type). Each costs
+# an extra write per save.
+SORT_INDEXES = {
+    COST_INDEX_NAME: ('annualCostCents', 'N'),
+    NAME_INDEX_NAME: ('nameLower', 'S'),
+    TIMESTAMP_INDEX_NAME: ('timestampMs', 'N')
+}
+# Every index on the estimates table: index name -> (hash key, range key), each (attribute, type).
+# --update adds any that an older deployment lacks.
+ESTIMATE_INDEXES = {
+    # Lets GET /estimates?owner=... Query one owner's estimates, newest first
+    OWNER_INDEX_NAME: (('ownerId', 'S'), ('timestamp', 'S')),
+    # Lets GET /estimates?since=... Query everything changed after a point in time
+    LAST_MODIFIED_INDEX_NAME: (('syncBucket', 'S'), ('lastModified', 'N')),
+    **{index_name: (('syncBucket', 'S'), sort_key) for index_name, sort_key in SORT_INDEXES.items()}
+}
 API_STAGE_NAME = "prod"
 
+# Table migrations (see migrate.py). While MIGRATION_TARGET_TABLE names a table, the deployment
+# creates it with create_estimates_table()'s current schema and the function mirrors every write
+# into it, passed through MIGRATION_TRANSFORM: a name from MIGRATION_TRANSFORMS in dynamodb_store.py,
+# or 'module:function' for a module next to this script, which is then packaged with the function.
+# Once migrate.py has finished, cut over by setting ESTIMATES_TABLE_NAME in name_resources() to the target and
+# MIGRATION_TARGET_TABLE back to None, then running --update again.
+MIGRATION_TARGET_TABLE = None
+MIGRATION_TRANSFORM = 'copy'
+
+# What fronts the function:
+#   'rest' - a REST API (payload 1.0) whose usage plan checks API keys and enforces a monthly quota
+#   'http' - an HTTP API (payload 2.0); less per-request latency and cost, throttled but without a quota
+#   'url'  - a Lambda Function URL; no gateway hop and no charge for it, but also no throttling
+# With 'http' and 'url' the function checks the x-api-key header itself (see normalize_event in
+# estimates_api.py), so keys come from add_user.py rather than API Gateway. Changing this on an
+# existing deployment creates the new front end and leaves the old one in place.
+API_FRONTEND = 'rest'
+# A Function URL is public and unthrottled, so 'url' also needs this set to True. While it is
+# False, --update deletes any Function URL an earlier run created.
+FUNCTION_URL_ENABLED = False
+# Steady-state requests per second and burst allowed by the REST usage plan or the HTTP API stage
+API_RATE_LIMIT = 10
+API_BURST_LIMIT = 5
+API_MONTHLY_QUOTA = 5000
+
+# How long a warm Lambda container caches API key -> user lookups. Removing a user
+# from the Users table takes effect after at most this many seconds.
+USER_CACHE_TTL_SECONDS = 300
+# How long it remembers that a key matched no user, so repeated bad keys don't each cost a read.
+# A user added by add_user.py may be refused for this long if they tried their key beforehand.
+USER_NEGATIVE_CACHE_TTL_SECONDS = 30
+
+# Responses at least this many bytes are gzip/deflate compressed for clients that accept it
+COMPRESSION_MIN_BYTES = 1024
+
+# How long deleted estimates remain visible as tombstones to GET /estimates?since=...
+TOMBSTONE_TTL_SECONDS = 30 * 24 * 3600
+
+# Parallel Scan segments used by GET /estimates/export, and how long export files are kept
+EXPORT_SEGMENTS = 4
+EXPORT_RETENTION_DAYS = 1
+
+# Every request logs one CloudWatch Embedded Metric Format line (latency, phase timings, consumed
+# capacity) under this namespace. Server-Timing adds the phase breakdown to each response's headers.
+METRICS_NAMESPACE = BASE_NAME
+SERVER_TIMING_ENABLED = False
+
+# Lambda runtime settings. Lambda allocates CPU in proportion to memory, so LAMBDA_MEMORY_MB also
+# sets how quickly a cold start initializes; measure_cold_start.py compares sizes on a live function.
+LAMBDA_RUNTIME = 'python3.13'
+LAMBDA_ARCHITECTURE = 'arm64'
+LAMBDA_MEMORY_MB = 512
+
+# Optional warm pool, to take cold starts off the first request after idle periods:
+#   None          - on-demand only (no extra cost)
+#   'provisioned' - keeps PROVISIONED_CONCURRENCY environments initialized; billed while idle
+#   'snapstart'   - restores new environments from a snapshot taken after init
+# Either one publishes a version and routes API Gateway through the LAMBDA_ALIAS_NAME alias.
+WARM_POOL = None
+PROVISIONED_CONCURRENCY = 1
+LAMBDA_ALIAS_NAME = 'live'
+
+# Caps how many environments the function runs at once, and so what a flood of requests can cost
+# when nothing in front of it throttles (a Function URL). Requests beyond it get 429s. None leaves
+# the function on the account's shared pool. Lambda keeps 100 of the account's concurrency
+# unreserved, so accounts with the default low limit may not be able to reserve any.
+RESERVED_CONCURRENCY = 10
+
+if WARM_POOL not in (None, 'provisioned', 'snapstart'):
+    print(f"Error: WARM_POOL must be None, 'provisioned' or 'snapstart', not {WARM_POOL!r}.")
+    exit(1)
+if API_FRONTEND not in ('rest', 'http', 'url'):
+    print(f"Error: API_FRONTEND must be 'rest', 'http' or 'url', not {API_FRONTEND!r}.")
+    exit(1)
+if API_FRONTEND == 'url' and not FUNCTION_URL_ENABLED:
+    print("Error: API_FRONTEND = 'url' creates a public, unthrottled Function URL; set FUNCTION_URL_ENABLED = True as well.")
+    exit(1)
+if RESERVED_CONCURRENCY is not None and WARM_POOL == 'provisioned' and RESERVED_CONCURRENCY < PROVISIONED_CONCURRENCY:
+    print(f"Error: RESERVED_CONCURRENCY ({RESERVED_CONCURRENCY}) must be at least PROVISIONED_CONCURRENCY ({PROVISIONED_CONCURRENCY}).")
+    exit(1)
+
 # Get AWS Region and Account ID from the environment
 try:
     session = boto3.Session()
@@ -35,192 +138,231 @@ except Exception as e:
     print(f"Error getting AWS configuration: {e}")
     exit(1)
 
-print(f"🚀  Starting deployment in region: {AWS_REGION}")
-print(f"🔖  Unique suffix for this deployment: {UNIQUE_SUFFIX}\n")
+def name_resources(suffix):
+    """Sets UNIQUE_SUFFIX and the names of the resources that carry it."""
+    global UNIQUE_SUFFIX, ESTIMATES_TABLE_NAME, USERS_TABLE_NAME, ROLE_NAME, POLICY_NAME, FUNCTION_NAME, API_NAME, DATA_BUCKET_NAME
+    UNIQUE_SUFFIX = suffix
+    ESTIMATES_TABLE_NAME = f"{BASE_NAME}Estimates-{UNIQUE_SUFFIX}"
+    USERS_TABLE_NAME = f"{BASE_NAME}Users-{UNIQUE_SUFFIX}"
+    ROLE_NAME = f"{BASE_NAME}LambdaRole-{UNIQUE_SUFFIX}"
+    POLICY_NAME = f"{BASE_NAME}DynamoDBPolicy-{UNIQUE_SUFFIX}"
+    FUNCTION_NAME = f"{BASE_NAME}Function-{UNIQUE_SUFFIX}"
+    API_NAME = f"{BASE_NAME}API-{UNIQUE_SUFFIX}"
+    # S3 bucket names are global, so this one also carries the account ID
+    DATA_BUCKET_NAME = f"{BASE_NAME.lower()}-data-{UNIQUE_SUFFIX}-{ACCOUNT_ID}"
+
+# A new deployment gets a random suffix to prevent resource name collisions; --update (see
+# __main__) switches to the suffix of the deployment being updated
+UPDATE_MODE = False
+name_resources(''.join(random.choices(string.ascii_lowercase + string.digits, k=6)))
 
 # Initialize boto3 clients
 iam_client = boto3.client('iam')
 dynamodb_client = boto3.client('dynamodb')
 lambda_client = boto3.client('lambda')
 apigateway_client = boto3.client('apigateway')
+apigatewayv2_client = boto3.client('apigatewayv2')
+s3_client = boto3.client('s3')
 
 
 # ======================================================================================
-# LAMBDA FUNCTION HANDLER CODE
+# LAMBDA FUNCTION SOURCE
 # ======================================================================================
-lambda_handler_code = """
-import boto3
-import json
-import os
-
-# Get table names from environment variables
-ESTIMATES_TABLE_NAME = os.environ.get('ESTIMATES_TABLE_NAME')
-USERS_TABLE_NAME = os.environ.get('USERS_TABLE_NAME')
-
-dynamodb = boto3.resource('dynamodb')
-estimates_table = dynamodb.Table(ESTIMATES_TABLE_NAME)
-users_table = dynamodb.Table(USERS_TABLE_NAME)
-
-CORS_HEADERS = {
-    'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE'
-}
-
-def get_user_from_apikey_id(api_key_id):
-    \"\"\"Fetches user details from the UsersTable based on the API Key ID.\"\"\"
-    try:
-        response = users_table.get_item(Key={'apiKeyId': api_key_id})
-        return response.get('Item')
-    except Exception as e:
-        print(f"Error looking up user for apiKeyId {api_key_id}: {e}")
-        return None
-
-def handler(event, context):
-    try:
-        # --- User Identification ---
-        api_key_id = event.get('requestContext', {}).get('identity', {}).get('apiKeyId')
-        if not api_key_id:
-            return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Forbidden: Missing API Key ID.'})}
-
-        user = get_user_from_apikey_id(api_key_id)
-        if not user:
-            return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f"Forbidden: No user found for the provided API Key."})}
-
-        requester_id = user.get('userId')
-        requester_name = user.get('displayName')
-
-        http_method = event['httpMethod']
-        path = event['path']
-
-        # Handle CORS preflight requests
-        if http_method == 'OPTIONS':
-            return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
-
-        # --- Route: GET /estimates ---
-        if http_method == 'GET' and path == '/estimates':
-            response = estimates_table.scan()
-            return {
-                'statusCode': 200,
-                'headers': CORS_HEADERS,
-                'body': json.dumps(response.get('Items', []))
-            }
-
-        # --- Route: POST /estimates ---
-        elif http_method == 'POST' and path == '/estimates':
-            body = json.loads(event.get('body', '{}'))
-            # The frontend sends 'id', we rename to 'estimateId' for clarity
-            if 'id' not in body:
-                 return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': 'Missing required fields'}
-            
-            # Enrich item with owner info
-            item_to_save = body.copy()
-            item_to_save['estimateId'] = item_to_save.pop('id') # Rename key
-            item_to_save['ownerId'] = requester_id
-            item_to_save['ownerName'] = requester_name
-            
-            estimates_table.put_item(Item=item_to_save)
-            return {'statusCode': 201, 'headers': CORS_HEADERS, 'body': 'Estimate saved'}
-
-        # --- Route: DELETE /estimates/{id} ---
-        elif http_method == 'DELETE' and event.get('pathParameters') and 'id' in event['pathParameters']:
-            estimate_id_to_delete = event['pathParameters']['id']
-            
-            # Authorization Check
-            item_response = estimates_table.get_item(Key={'estimateId': estimate_id_to_delete})
-            item_to_delete = item_response.get('Item')
-
-            if not item_to_delete:
-                 return {'statusCode': 404, 'headers': CORS_HEADERS, 'body': 'Not Found'}
-
-            if item_to_delete.get('ownerId') != requester_id:
-                return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Forbidden: You can only delete your own estimates.'})}
-
-            # If authorized, proceed with deletion
-            estimates_table.delete_item(Key={'estimateId': estimate_id_to_delete})
-            return {'statusCode': 204, 'headers': CORS_HEADERS, 'body': ''}
-
-        else:
-            return {'statusCode': 404, 'headers': CORS_HEADERS, 'body': 'Not Found'}
-
-    except Exception as e:
-        print(f"Error: {e}")
-        return {
-            'statusCode': 500,
-            'headers': CORS_HEADERS,
-            'body': json.dumps({'error': str(e)})
-        }
-"""
-
-def create_iam_role():
-    """Creates the IAM Role and Policy for the Lambda function."""
-    print("Step 1: Creating IAM Role and Policy...")
+# The handler lives in these modules next to this script; estimates_api.py is shared with
+# the self-hosted local_server.py
+LAMBDA_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_SOURCE_FILES = ['lambda_function.py', 'estimates_api.py', 'dynamodb_store.py', 'request_metrics.py']
+if MIGRATION_TARGET_TABLE and ':' in MIGRATION_TRANSFORM:
+    LAMBDA_SOURCE_FILES.append(MIGRATION_TRANSFORM.partition(':')[0].replace('.', '/') + '.py')
+# Fixed timestamps and permissions make the zip, and so its hash, depend only on the file contents
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# New roles take a few seconds to become assumable by Lambda; CreateFunction is retried until then
+IAM_PROPAGATION_TIMEOUT_SECONDS = 120
+# Poll interval for tables becoming active (the boto3 waiter default is 20 seconds)
+TABLE_POLL_SECONDS = 2
+# Adding an index to a populated table backfills it first, which can take a while
+INDEX_BUILD_TIMEOUT_SECONDS = 3600
+
+def build_lambda_package():
+    """Zips the handler modules; returns (zip bytes, base64 SHA-256 in the form Lambda reports as CodeSha256)."""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for source_file in sorted(LAMBDA_SOURCE_FILES):
+            info = zipfile.ZipInfo(source_file, date_time=ZIP_DATE_TIME)
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(os.path.join(LAMBDA_SOURCE_DIR, source_file), 'rb') as f:
+                zf.writestr(info, f.read())
+    package = zip_buffer.getvalue()
+    return package, base64.b64encode(hashlib.sha256(package).digest()).decode('ascii')
+
+def create_iam_role(log):
+    """Creates the IAM Role, or reuses it, and puts its (possibly changed) policy."""
+    log.info("Step 1: Creating IAM Role and Policy...")
     trust_policy = json.dumps({
         "Version": "2012-10-17",
         "Statement": [{"Effect": "Allow", "Principal": {"Service": "lambda.amazonaws.com"}, "Action": "sts:AssumeRole"}]
     })
     try:
-        role_response = iam_client.create_role(RoleName=ROLE_NAME, AssumeRolePolicyDocument=trust_policy)
-        role_arn = role_response['Role']['Arn']
-        print(f"  ✅ IAM Role '{ROLE_NAME}' created.")
+        try:
+            role_response = iam_client.create_role(RoleName=ROLE_NAME, AssumeRolePolicyDocument=trust_policy)
+            role_arn = role_response['Role']['Arn']
+            iam_client.get_waiter('role_exists').wait(RoleName=ROLE_NAME, WaiterConfig={'Delay': 1})
+            log.info(f"  ✅ IAM Role '{ROLE_NAME}' created.")
+        except iam_client.exceptions.EntityAlreadyExistsException:
+            role_arn = f"arn:aws:iam::{ACCOUNT_ID}:role/{ROLE_NAME}"
+            log.warning(f"  ⚠️  IAM Role '{ROLE_NAME}' already exists. Reusing.")
 
         estimates_table_arn = f"arn:aws:dynamodb:{AWS_REGION}:{ACCOUNT_ID}:table/{ESTIMATES_TABLE_NAME}"
         users_table_arn = f"arn:aws:dynamodb:{AWS_REGION}:{ACCOUNT_ID}:table/{USERS_TABLE_NAME}"
+        # During a migration the function also writes (but never reads) the target table
+        migration_statements = [{
+            "Effect": "Allow",
+            "Action": ["dynamodb:PutItem", "dynamodb:UpdateItem"],
+            "Resource": f"arn:aws:dynamodb:{AWS_REGION}:{ACCOUNT_ID}:table/{MIGRATION_TARGET_TABLE}"
+        }] if MIGRATION_TARGET_TABLE else []
         
         policy_document = json.dumps({
             "Version": "2012-10-17",
-            "Statement": [
+            "Statement": migration_statements + [
                 {
                     "Effect": "Allow",
                     "Action": [
                         "dynamodb:Scan",
                         "dynamodb:GetItem",
                         "dynamodb:PutItem",
-                        "dynamodb:DeleteItem"
+                        "dynamodb:UpdateItem",
+                        "dynamodb:DeleteItem",
+                        "dynamodb:BatchGetItem",
+                        "dynamodb:BatchWriteItem"
                     ],
                     "Resource": estimates_table_arn
                 },
+                {
+                    "Effect": "Allow",
+                    "Action": "dynamodb:Query",
+                    "Resource": f"{estimates_table_arn}/index/*"
+                },
                 {
                     "Effect": "Allow",
                     "Action": "dynamodb:GetItem",
                     "Resource": users_table_arn
+                },
+                {
+                    "Effect": "Allow",
+                    "Action": [
+                        "s3:PutObject",
+                        "s3:GetObject",
+                        "s3:AbortMultipartUpload"
+                    ],
+                    "Resource": f"arn:aws:s3:::{DATA_BUCKET_NAME}/*"
+                },
+                {
+                    # Without it, reading an owner's archive that doesn't exist yet is AccessDenied, not NoSuchKey
+                    "Effect": "Allow",
+                    "Action": "s3:ListBucket",
+                    "Resource": f"arn:aws:s3:::{DATA_BUCKET_NAME}",
+                    "Condition": {"StringLike": {"s3:prefix": "archive/*"}}
                 }
             ]
         })
+        # put_role_policy replaces the inline policy, so re-running it picks up new permissions
         iam_client.put_role_policy(RoleName=ROLE_NAME, PolicyName=POLICY_NAME, PolicyDocument=policy_document)
-        print(f"  ✅ IAM Policy '{POLICY_NAME}' created and attached for both tables.")
-        print("     Waiting for IAM propagation...")
-        time.sleep(10)
+        log.info(f"  ✅ IAM Policy '{POLICY_NAME}' attached for both tables and the data bucket.")
         return role_arn
-    except iam_client.exceptions.EntityAlreadyExistsException:
-        print(f"  ⚠️  IAM Role '{ROLE_NAME}' already exists. Reusing.")
-        return f"arn:aws:iam::{ACCOUNT_ID}:role/{ROLE_NAME}"
     except Exception as e:
-        print(f"  ❌ Error creating IAM role: {e}")
+        log.error(f"  ❌ Error creating IAM role: {e}")
         raise
 
-def create_estimates_table():
-    """Creates the DynamoDB table to store estimates."""
-    print("\nStep 2: Creating Estimates DynamoDB Table...")
+def index_definition(index_name):
+    """An index on its hash and range keys, projecting every attribute."""
+    (hash_name, _), (range_name, _) = ESTIMATE_INDEXES[index_name]
+    return {
+        'IndexName': index_name,
+        'KeySchema': [
+            {'AttributeName': hash_name, 'KeyType': 'HASH'},
+            {'AttributeName': range_name, 'KeyType': 'RANGE'}
+        ],
+        'Projection': {'ProjectionType': 'ALL'}
+    }
+
+def index_attribute_definitions(index_names):
+    """The attribute definitions that the given indexes' keys need."""
+    attributes = dict(key for index_name in index_names for key in ESTIMATE_INDEXES[index_name])
+    return [{'AttributeName': name, 'AttributeType': attribute_type} for name, attribute_type in attributes.items()]
+
+def wait_for_indexes(table_name, waiting_for):
+    """Waits until the table and all its indexes are ACTIVE."""
+    deadline = time.monotonic() + INDEX_BUILD_TIMEOUT_SECONDS
+    while True:
+        table = dynamodb_client.describe_table(TableName=table_name)['Table']
+        statuses = [index['IndexStatus'] for index in table.get('GlobalSecondaryIndexes', [])]
+        if table['TableStatus'] == 'ACTIVE' and all(status == 'ACTIVE' for status in statuses):
+            return table
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{waiting_for} was still building after {INDEX_BUILD_TIMEOUT_SECONDS} seconds.")
+        time.sleep(TABLE_POLL_SECONDS)
+
+def add_missing_indexes(log, table_name):
+    """Adds the indexes an existing table lacks, one at a time as DynamoDB requires."""
+    # An earlier run may have left an index building; a second one can't start until it is done
+    table = wait_for_indexes(table_name, f"Table '{table_name}'")
+    existing = {index['IndexName'] for index in table.get('GlobalSecondaryIndexes', [])}
+    for index_name in ESTIMATE_INDEXES:
+        if index_name in existing:
+            continue
+        log.info(f"  ⏳ Adding index '{index_name}'; DynamoDB backfills it from the existing estimates...")
+        dynamodb_client.update_table(
+            TableName=table_name,
+            AttributeDefinitions=index_attribute_definitions([index_name]),
+            GlobalSecondaryIndexUpdates=[{'Create': index_definition(index_name)}]
+        )
+        wait_for_indexes(table_name, f"Index '{index_name}'")
+        log.info(f"  ✅ Index '{index_name}' is active.")
+
+def enable_time_to_live(log, table_name):
+    """Lets tombstones left by deletes expire on their own; does nothing if TTL is already on."""
+    description = dynamodb_client.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+    if description.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+        if description.get('AttributeName') != 'expiresAt':
+            raise ValueError(f"Table '{table_name}' expires items on '{description.get('AttributeName')}', not 'expiresAt'.")
+        log.info(f"  ✅ Time to Live is already enabled on 'expiresAt' for '{table_name}'.")
+        return
+    dynamodb_client.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expiresAt'}
+    )
+    log.info("  ✅ Time to Live enabled on 'expiresAt' for deleted-estimate tombstones.")
+
+def create_estimates_table(log, table_name=None):
+    """Creates the DynamoDB table to store estimates (or a migration target with the same schema)."""
+    log.info("\nStep 2: Creating Estimates DynamoDB Table" +
+             ("..." if table_name is None else f" '{table_name}' to migrate to..."))
+    table_name = table_name or ESTIMATES_TABLE_NAME
     try:
         dynamodb_client.create_table(
-            TableName=ESTIMATES_TABLE_NAME,
-            AttributeDefinitions=[{'AttributeName': 'estimateId', 'AttributeType': 'S'}],
+            TableName=table_name,
+            AttributeDefinitions=[{'AttributeName': 'estimateId', 'AttributeType': 'S'}] +
+                                 index_attribute_definitions(ESTIMATE_INDEXES),
             KeySchema=[{'AttributeName': 'estimateId', 'KeyType': 'HASH'}],
+            GlobalSecondaryIndexes=[index_definition(index_name) for index_name in ESTIMATE_INDEXES],
             BillingMode='PAY_PER_REQUEST'
         )
         waiter = dynamodb_client.get_waiter('table_exists')
-        waiter.wait(TableName=ESTIMATES_TABLE_NAME)
-        print(f"  ✅ DynamoDB Table '{ESTIMATES_TABLE_NAME}' is active.")
+        waiter.wait(TableName=table_name, WaiterConfig={'Delay': TABLE_POLL_SECONDS, 'MaxAttempts': 150})
+        log.info(f"  ✅ DynamoDB Table '{table_name}' is active.")
     except dynamodb_client.exceptions.ResourceInUseException:
-        print(f"  ⚠️  Table '{ESTIMATES_TABLE_NAME}' already exists.")
+        log.warning(f"  ⚠️  Table '{table_name}' already exists.")
+        add_missing_indexes(log, table_name)
     except Exception as e:
-        print(f"  ❌ Error creating DynamoDB table: {e}")
+        log.error(f"  ❌ Error creating DynamoDB table: {e}")
         raise
+    enable_time_to_live(log, table_name)
 
-def create_users_table():
+def create_users_table(log):
     """Creates the DynamoDB table to map API Key IDs to Users."""
-    print("\nStep 3: Creating Users DynamoDB Table...")
+    log.info("\nStep 3: Creating Users DynamoDB Table...")
     try:
         dynamodb_client.create_table(
             TableName=USERS_TABLE_NAME,
@@ -229,78 +371,294 @@ def create_users_table():
             BillingMode='PAY_PER_REQUEST'
         )
         waiter = dynamodb_client.get_waiter('table_exists')
-        waiter.wait(TableName=USERS_TABLE_NAME)
-        print(f"  ✅ DynamoDB Table '{USERS_TABLE_NAME}' is active.")
+        waiter.wait(TableName=USERS_TABLE_NAME, WaiterConfig={'Delay': TABLE_POLL_SECONDS, 'MaxAttempts': 150})
+        log.info(f"  ✅ DynamoDB Table '{USERS_TABLE_NAME}' is active.")
     except dynamodb_client.exceptions.ResourceInUseException:
-        print(f"  ⚠️  Table '{USERS_TABLE_NAME}' already exists.")
+        log.warning(f"  ⚠️  Table '{USERS_TABLE_NAME}' already exists.")
     except Exception as e:
-        print(f"  ❌ Error creating DynamoDB table: {e}")
+        log.error(f"  ❌ Error creating DynamoDB table: {e}")
         raise
 
-def create_lambda_function(role_arn):
+def configure_data_bucket():
+    """Blocks public access and expires old exports; both calls replace what is there, so every run reapplies them."""
+    s3_client.put_public_access_block(
+        Bucket=DATA_BUCKET_NAME,
+        PublicAccessBlockConfiguration={
+            'BlockPublicAcls': True,
+            'IgnorePublicAcls': True,
+            'BlockPublicPolicy': True,
+            'RestrictPublicBuckets': True
+        }
+    )
+    # Exports are fetched once through a presigned URL, so they don't need to stick around
+    s3_client.put_bucket_lifecycle_configuration(
+        Bucket=DATA_BUCKET_NAME,
+        LifecycleConfiguration={'Rules': [{
+            'ID': 'expire-exports',
+            'Filter': {'Prefix': 'exports/'},
+            'Status': 'Enabled',
+            'Expiration': {'Days': EXPORT_RETENTION_DAYS},
+            'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 1}
+        }]}
+    )
+
+def create_data_bucket(log):
+    """Creates the private S3 bucket that holds estimate exports."""
+    log.info("\nStep 4: Creating S3 Data Bucket...")
+    try:
+        if AWS_REGION == 'us-east-1':
+            s3_client.create_bucket(Bucket=DATA_BUCKET_NAME)
+        else:
+            s3_client.create_bucket(Bucket=DATA_BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': AWS_REGION})
+        log.info(f"  ✅ S3 Bucket '{DATA_BUCKET_NAME}' created.")
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        log.warning(f"  ⚠️  Bucket '{DATA_BUCKET_NAME}' already exists.")
+    except Exception as e:
+        log.error(f"  ❌ Error creating S3 bucket: {e}")
+        raise
+    configure_data_bucket()
+    log.info(f"  ✅ Public access blocked; exports expire after {EXPORT_RETENTION_DAYS} day(s).")
+
+def lambda_configuration(role_arn):
+    """The function settings that create and --update apply, and that --update compares with the live function."""
+    return {
+        'Role': role_arn,
+        'Handler': 'lambda_function.handler',
+        'Runtime': LAMBDA_RUNTIME,
+        'MemorySize': LAMBDA_MEMORY_MB,
+        # Exports can take a while; API Gateway gives up at 29 seconds regardless
+        'Timeout': 29,
+        'Environment': {
+            'Variables': {
+                'ESTIMATES_TABLE_NAME': ESTIMATES_TABLE_NAME,
+                'USERS_TABLE_NAME': USERS_TABLE_NAME,
+                'OWNER_INDEX_NAME': OWNER_INDEX_NAME,
+                'LAST_MODIFIED_INDEX_NAME': LAST_MODIFIED_INDEX_NAME,
+                'COST_INDEX_NAME': COST_INDEX_NAME,
+                'NAME_INDEX_NAME': NAME_INDEX_NAME,
+                'TIMESTAMP_INDEX_NAME': TIMESTAMP_INDEX_NAME,
+                'USER_CACHE_TTL_SECONDS': str(USER_CACHE_TTL_SECONDS),
+                'USER_NEGATIVE_CACHE_TTL_SECONDS': str(USER_NEGATIVE_CACHE_TTL_SECONDS),
+                'TOMBSTONE_TTL_SECONDS': str(TOMBSTONE_TTL_SECONDS),
+                'COMPRESSION_MIN_BYTES': str(COMPRESSION_MIN_BYTES),
+                'BLOB_BUCKET': DATA_BUCKET_NAME,
+                'EXPORT_SEGMENTS': str(EXPORT_SEGMENTS),
+                'METRICS_NAMESPACE': METRICS_NAMESPACE,
+                'SERVER_TIMING_ENABLED': str(SERVER_TIMING_ENABLED).lower(),
+                **({'MIGRATION_TARGET_TABLE': MIGRATION_TARGET_TABLE, 'MIGRATION_TRANSFORM': MIGRATION_TRANSFORM}
+                   if MIGRATION_TARGET_TABLE else {})
+            }
+        },
+        'SnapStart': {'ApplyOn': 'PublishedVersions' if WARM_POOL == 'snapstart' else 'None'}
+    }
+
+def configuration_changes(desired, current):
+    """Returns the settings in `desired` that differ from get_function_configuration's `current`."""
+    changes = {}
+    for name, value in desired.items():
+        live = current.get(name)
+        if name == 'Environment':
+            live = {'Variables': (live or {}).get('Variables', {})}
+        elif name == 'SnapStart':
+            live = {'ApplyOn': (live or {}).get('ApplyOn', 'None')}
+        if live != value:
+            changes[name] = value
+    return changes
+
+def create_function_when_role_ready(log, **kwargs):
+    """Calls CreateFunction, retrying while the new IAM role is not yet assumable by Lambda."""
+    deadline = time.monotonic() + IAM_PROPAGATION_TIMEOUT_SECONDS
+    delay = 1
+    while True:
+        try:
+            return lambda_client.create_function(**kwargs)
+        except lambda_client.exceptions.InvalidParameterValueException as e:
+            if 'assume' not in str(e) or time.monotonic() > deadline:
+                raise
+            log.info(f"     Waiting {delay}s for IAM role propagation...")
+            time.sleep(delay)
+            delay = min(delay * 2, 8)
+
+def create_lambda_function(log, role_arn):
     """Creates and packages the Lambda function."""
-    print("\nStep 4: Creating Lambda Function...")
+    log.info("\nStep 5: Creating Lambda Function...")
     try:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED, False) as zf:
-            zf.writestr('lambda_function.py', lambda_handler_code)
-        zip_buffer.seek(0)
-        response = lambda_client.create_function(
+        package, _ = build_lambda_package()
+        response = create_function_when_role_ready(
+            log,
             FunctionName=FUNCTION_NAME,
-            Runtime='python3.9',
-            Role=role_arn,
-            Handler='lambda_function.handler',
-            Code={'ZipFile': zip_buffer.read()},
-            Timeout=15,
-            Environment={
-                'Variables': {
-                    'ESTIMATES_TABLE_NAME': ESTIMATES_TABLE_NAME,
-                    'USERS_TABLE_NAME': USERS_TABLE_NAME
-                }
-            }
+            Architectures=[LAMBDA_ARCHITECTURE],
+            Code={'ZipFile': package},
+            **lambda_configuration(role_arn)
         )
         function_arn = response['FunctionArn']
         waiter = lambda_client.get_waiter('function_active_v2')
         waiter.wait(FunctionName=FUNCTION_NAME)
-        print(f"  ✅ Lambda function '{FUNCTION_NAME}' created.")
+        log.info(f"  ✅ Lambda function '{FUNCTION_NAME}' created ({LAMBDA_RUNTIME}, {LAMBDA_ARCHITECTURE}, {LAMBDA_MEMORY_MB} MB).")
+        configure_reserved_concurrency(log)
+        if WARM_POOL:
+            function_arn = configure_warm_pool(log, publish=True)
         return function_arn
     except lambda_client.exceptions.ResourceConflictException:
-        print(f"  ⚠️  Lambda function '{FUNCTION_NAME}' already exists. Skipping.")
-        return f"arn:aws:lambda:{AWS_REGION}:{ACCOUNT_ID}:function/{FUNCTION_NAME}"
+        log.warning(f"  ⚠️  Lambda function '{FUNCTION_NAME}' already exists. Skipping.")
+        function_arn = f"arn:aws:lambda:{AWS_REGION}:{ACCOUNT_ID}:function/{FUNCTION_NAME}"
+        return f"{function_arn}:{LAMBDA_ALIAS_NAME}" if WARM_POOL else function_arn
     except Exception as e:
-        print(f"  ❌ Error creating Lambda function: {e}")
+        log.error(f"  ❌ Error creating Lambda function: {e}")
         raise
 
-def create_api_gateway(function_arn):
-    """Creates the REST API Gateway and integrates it with the Lambda function."""
-    print("\nStep 5: Creating REST API Gateway...")
+def update_lambda_function(log, role_arn):
+    """Updates the function's code and configuration, each only if it differs from what is deployed."""
+    log.info("\nStep 5: Updating Lambda Function...")
     try:
-        # Create the REST API
-        api_response = apigateway_client.create_rest_api(name=API_NAME)
-        api_id = api_response['id']
-        print(f"  ✅ REST API '{API_NAME}' created with ID: {api_id}")
-
-        # Get the root resource ID
-        root_resource_id = apigateway_client.get_resources(restApiId=api_id)['items'][0]['id']
-
-        # Create the /estimates resource
-        estimates_resource = apigateway_client.create_resource(restApiId=api_id, parentId=root_resource_id, pathPart='estimates')
-        estimates_resource_id = estimates_resource['id']
-
-        # Create the /{id} resource
-        id_resource = apigateway_client.create_resource(restApiId=api_id, parentId=estimates_resource_id, pathPart='{id}')
-        id_resource_id = id_resource['id']
+        package, code_sha256 = build_lambda_package()
+        current = lambda_client.get_function_configuration(FunctionName=FUNCTION_NAME)
+        changed = False
+        waiter = lambda_client.get_waiter('function_updated_v2')
+
+        # Lambda reports the package's SHA-256, so an unchanged zip needs no upload
+        if current['CodeSha256'] != code_sha256 or current.get('Architectures') != [LAMBDA_ARCHITECTURE]:
+            lambda_client.update_function_code(FunctionName=FUNCTION_NAME, ZipFile=package,
+                                               Architectures=[LAMBDA_ARCHITECTURE])
+            waiter.wait(FunctionName=FUNCTION_NAME)
+            log.info(f"  ✅ Code updated (sha256 {code_sha256}).")
+            changed = True
+        else:
+            log.info("  ⏭️  Code unchanged.")
+
+        updates = configuration_changes(lambda_configuration(role_arn), current)
+        if updates:
+            lambda_client.update_function_configuration(FunctionName=FUNCTION_NAME, **updates)
+            waiter.wait(FunctionName=FUNCTION_NAME)
+            log.info(f"  ✅ Configuration updated: {', '.join(sorted(updates))}.")
+            changed = True
+        else:
+            log.info("  ⏭️  Configuration unchanged.")
+
+        configure_reserved_concurrency(log)
+        function_arn = f"arn:aws:lambda:{AWS_REGION}:{ACCOUNT_ID}:function/{FUNCTION_NAME}"
+        if WARM_POOL:
+            return configure_warm_pool(log, publish=changed)
+        try:
+            # Warm pool switched off: stop paying for provisioned environments
+            lambda_client.delete_provisioned_concurrency_config(FunctionName=FUNCTION_NAME, Qualifier=LAMBDA_ALIAS_NAME)
+            log.info(f"  ✅ Provisioned concurrency removed from '{LAMBDA_ALIAS_NAME}'.")
+        except lambda_client.exceptions.ResourceNotFoundException:
+            pass
+        return function_arn
+    except lambda_client.exceptions.ResourceNotFoundException:
+        log.error(f"  ❌ Lambda function '{FUNCTION_NAME}' not found; is '{UNIQUE_SUFFIX}' the right suffix?")
+        raise
+    except Exception as e:
+        log.error(f"  ❌ Error updating Lambda function: {e}")
+        raise
 
-        # Lambda Integration URI
-        lambda_uri = f"arn:aws:apigateway:{AWS_REGION}:lambda:path/2015-03-31/functions/{function_arn}/invocations"
+def configure_reserved_concurrency(log):
+    """Reserves RESERVED_CONCURRENCY for the function (or releases it when None), if not already so."""
+    current = lambda_client.get_function_concurrency(FunctionName=FUNCTION_NAME).get('ReservedConcurrentExecutions')
+    if current == RESERVED_CONCURRENCY:
+        return
+    if RESERVED_CONCURRENCY is None:
+        lambda_client.delete_function_concurrency(FunctionName=FUNCTION_NAME)
+        log.info("  ✅ Reserved concurrency removed.")
+        return
+    try:
+        lambda_client.put_function_concurrency(FunctionName=FUNCTION_NAME, ReservedConcurrentExecutions=RESERVED_CONCURRENCY)
+        log.info(f"  ✅ Concurrency capped at {RESERVED_CONCURRENCY} environment(s).")
+    except lambda_client.exceptions.InvalidParameterValueException as e:
+        # The account's concurrency limit leaves nothing to reserve; ask for a higher quota to cap it
+        log.warning(f"  ⚠️  Could not reserve {RESERVED_CONCURRENCY} concurrent executions, so the function is uncapped: {e}")
+
+def configure_warm_pool(log, publish):
+    """Points the alias at a newly published version (when publish, or the alias is missing) and applies
+    the WARM_POOL mode to it; returns the alias ARN."""
+    try:
+        alias = lambda_client.get_alias(FunctionName=FUNCTION_NAME, Name=LAMBDA_ALIAS_NAME)
+    except lambda_client.exceptions.ResourceNotFoundException:
+        alias = None
+    if alias is None or publish:
+        # With SnapStart, publishing runs init and takes the snapshot, which can take a minute or two
+        version = lambda_client.publish_version(FunctionName=FUNCTION_NAME)['Version']
+        lambda_client.get_waiter('published_version_active').wait(FunctionName=FUNCTION_NAME, Qualifier=version)
+        if alias is None:
+            alias = lambda_client.create_alias(FunctionName=FUNCTION_NAME, Name=LAMBDA_ALIAS_NAME, FunctionVersion=version)
+        else:
+            alias = lambda_client.update_alias(FunctionName=FUNCTION_NAME, Name=LAMBDA_ALIAS_NAME, FunctionVersion=version)
+        log.info(f"  ✅ Version {version} published as '{LAMBDA_ALIAS_NAME}'" + (" with SnapStart." if WARM_POOL == 'snapstart' else "."))
+    if WARM_POOL == 'provisioned':
+        try:
+            current = lambda_client.get_provisioned_concurrency_config(FunctionName=FUNCTION_NAME, Qualifier=LAMBDA_ALIAS_NAME)
+            requested = current['RequestedProvisionedConcurrentExecutions']
+        except lambda_client.exceptions.ProvisionedConcurrencyConfigNotFoundException:
+            requested = None
+        if requested != PROVISIONED_CONCURRENCY:
+            lambda_client.put_provisioned_concurrency_config(
+                FunctionName=FUNCTION_NAME,
+                Qualifier=LAMBDA_ALIAS_NAME,
+                ProvisionedConcurrentExecutions=PROVISIONED_CONCURRENCY
+            )
+            log.info(f"  ✅ {PROVISIONED_CONCURRENCY} provisioned environment(s) on '{LAMBDA_ALIAS_NAME}'.")
+    return alias['AliasArn']
 
-        # --- Setup Methods and Integrations ---
-        resources = {
-            estimates_resource_id: ['GET', 'POST', 'OPTIONS'],
-            id_resource_id: ['DELETE', 'OPTIONS']
-        }
-        for resource_id, methods in resources.items():
-            for method in methods:
+# ======================================================================================
+# API GATEWAY
+# ======================================================================================
+# Resource paths and their methods. API Gateway matches /estimates/export and /estimates/stats
+# ahead of their /{id} sibling, and the greedy /{proxy+} lets custom-method paths such as
+# /estimates:batchDelete reach the Lambda, which does its own routing. Parents must come before their children.
+API_ROUTES = {
+    '/estimates': ['GET', 'POST', 'OPTIONS'],
+    '/estimates/{id}': ['DELETE', 'OPTIONS'],
+    '/estimates/export': ['GET', 'OPTIONS'],
+    '/estimates/stats': ['GET', 'OPTIONS'],
+    '/{proxy+}': ['POST', 'OPTIONS']
+}
+# Treating every media type as binary lets the Lambda return gzip/deflate bodies base64-encoded;
+# request bodies then arrive base64-encoded too
+API_BINARY_MEDIA_TYPES = ['*/*']
+
+def api_definition_hash(lambda_uri):
+    """Identifies the routes and integration target; stored in each deployment's description."""
+    definition = json.dumps([API_ROUTES, API_BINARY_MEDIA_TYPES, lambda_uri], sort_keys=True)
+    return f"definition {hashlib.sha256(definition.encode('utf-8')).hexdigest()[:16]}"
+
+def find_rest_api():
+    for page in apigateway_client.get_paginator('get_rest_apis').paginate():
+        for api in page.get('items', []):
+            if api['name'] == API_NAME:
+                return api['id']
+    return None
+
+def deployed_definition(api_id):
+    """The definition hash of the deployment the stage serves, or None before the first deployment."""
+    try:
+        stage = apigateway_client.get_stage(restApiId=api_id, stageName=API_STAGE_NAME)
+    except apigateway_client.exceptions.NotFoundException:
+        return None
+    return apigateway_client.get_deployment(restApiId=api_id, deploymentId=stage['deploymentId']).get('description')
+
+def sync_api_routes(api_id, lambda_uri):
+    """Adds missing binary media types, resources and methods and points every integration at lambda_uri."""
+    # APIs created before compression was added lack the binary media types; '/' is escaped as '~1' in patch paths
+    present = apigateway_client.get_rest_api(restApiId=api_id).get('binaryMediaTypes', [])
+    missing = [media_type for media_type in API_BINARY_MEDIA_TYPES if media_type not in present]
+    if missing:
+        apigateway_client.update_rest_api(
+            restApiId=api_id,
+            patchOperations=[{'op': 'add', 'path': '/binaryMediaTypes/' + media_type.replace('/', '~1')} for media_type in missing]
+        )
+    existing = {}
+    for page in apigateway_client.get_paginator('get_resources').paginate(restApiId=api_id):
+        for resource in page['items']:
+            existing[resource['path']] = resource
+    for path, methods in API_ROUTES.items():
+        if path not in existing:
+            parent_path, _, path_part = path.rpartition('/')
+            existing[path] = apigateway_client.create_resource(
+                restApiId=api_id, parentId=existing[parent_path or '/']['id'], pathPart=path_part)
+        resource_id = existing[path]['id']
+        for method in methods:
+            if method not in existing[path].get('resourceMethods', {}):
                 apigateway_client.put_method(
                     restApiId=api_id,
                     resourceId=resource_id,
@@ -308,48 +666,166 @@ def create_api_gateway(function_arn):
                     authorizationType='NONE',
                     apiKeyRequired=False if method == 'OPTIONS' else True
                 )
-                apigateway_client.put_integration(
-                    restApiId=api_id,
-                    resourceId=resource_id,
-                    httpMethod=method,
-                    type='AWS_PROXY',
-                    integrationHttpMethod='POST',
-                    uri=lambda_uri
-                )
-        print("  ✅ API Methods and Integrations created.")
+            apigateway_client.put_integration(
+                restApiId=api_id,
+                resourceId=resource_id,
+                httpMethod=method,
+                type='AWS_PROXY',
+                integrationHttpMethod='POST',
+                uri=lambda_uri
+            )
+
+def deploy_api_gateway(log, function_arn):
+    """Creates the REST API (or finds it on --update) and redeploys it only when its definition changed."""
+    log.info("\nStep 6: Deploying REST API Gateway...")
+    try:
+        # Lambda Integration URI
+        lambda_uri = f"arn:aws:apigateway:{AWS_REGION}:lambda:path/2015-03-31/functions/{function_arn}/invocations"
+        definition = api_definition_hash(lambda_uri)
+
+        api_id = find_rest_api() if UPDATE_MODE else None
+        if api_id is None:
+            api_id = apigateway_client.create_rest_api(name=API_NAME, binaryMediaTypes=API_BINARY_MEDIA_TYPES)['id']
+            log.info(f"  ✅ REST API '{API_NAME}' created with ID: {api_id}")
 
-        # Deploy the API
-        apigateway_client.create_deployment(restApiId=api_id, stageName=API_STAGE_NAME)
-        print(f"  ✅ API deployed to stage '{API_STAGE_NAME}'.")
+        if deployed_definition(api_id) == definition:
+            log.info("  ⏭️  API routes unchanged; no redeploy.")
+        else:
+            sync_api_routes(api_id, lambda_uri)
+            log.info("  ✅ API Methods and Integrations up to date.")
+            apigateway_client.create_deployment(restApiId=api_id, stageName=API_STAGE_NAME, description=definition)
+            log.info(f"  ✅ API deployed to stage '{API_STAGE_NAME}'.")
 
-        # Grant Lambda permission
+        # Grant Lambda permission. A qualified (alias) ARN scopes it to the alias the integration invokes.
         source_arn = f"arn:aws:execute-api:{AWS_REGION}:{ACCOUNT_ID}:{api_id}/*/*/*"
-        lambda_client.add_permission(
-            FunctionName=FUNCTION_NAME,
-            StatementId=f'api-gateway-invoke-{UNIQUE_SUFFIX}',
-            Action='lambda:InvokeFunction',
-            Principal='apigateway.amazonaws.com',
-            SourceArn=source_arn
-        )
-        print("  ✅ Granted API Gateway permission to invoke Lambda.")
+        try:
+            lambda_client.add_permission(
+                FunctionName=function_arn,
+                StatementId=f'api-gateway-invoke-{UNIQUE_SUFFIX}',
+                Action='lambda:InvokeFunction',
+                Principal='apigateway.amazonaws.com',
+                SourceArn=source_arn
+            )
+            log.info("  ✅ Granted API Gateway permission to invoke Lambda.")
+        except lambda_client.exceptions.ResourceConflictException:
+            pass # Already granted by an earlier run
 
         final_url = f"https://{api_id}.execute-api.{AWS_REGION}.amazonaws.com/{API_STAGE_NAME}/estimates"
         return api_id, final_url
     except Exception as e:
-        print(f"  ❌ Error creating API Gateway: {e}")
+        log.error(f"  ❌ Error deploying API Gateway: {e}")
+        raise
+
+def find_http_api():
+    for page in apigatewayv2_client.get_paginator('get_apis').paginate():
+        for api in page.get('Items', []):
+            if api['Name'] == API_NAME and api.get('ProtocolType') == 'HTTP':
+                return api
+    return None
+
+def deploy_http_api(log, function_arn):
+    """Creates the HTTP API (or finds it on --update): one catch-all route to the function, payload format 2.0."""
+    log.info("\nStep 6: Deploying HTTP API...")
+    try:
+        api = find_http_api() if UPDATE_MODE else None
+        if api is None:
+            # Quick create: a $default route and an auto-deploying $default stage, both pointing at the function
+            api = apigatewayv2_client.create_api(Name=API_NAME, ProtocolType='HTTP', Target=function_arn)
+            log.info(f"  ✅ HTTP API '{API_NAME}' created with ID: {api['ApiId']}")
+        else:
+            for integration in apigatewayv2_client.get_integrations(ApiId=api['ApiId']).get('Items', []):
+                if integration.get('IntegrationUri') != function_arn:
+                    apigatewayv2_client.update_integration(ApiId=api['ApiId'], IntegrationId=integration['IntegrationId'],
+                                                           IntegrationUri=function_arn, PayloadFormatVersion='2.0')
+                    log.info("  ✅ Integration now targets the current function.")
+        api_id = api['ApiId']
+        # HTTP APIs have no usage plans; stage throttling stands in for the REST usage plan's limits
+        apigatewayv2_client.update_stage(
+            ApiId=api_id,
+            StageName='$default',
+            DefaultRouteSettings={'ThrottlingRateLimit': API_RATE_LIMIT, 'ThrottlingBurstLimit': API_BURST_LIMIT}
+        )
+        log.info(f"  ✅ Stage throttled to {API_RATE_LIMIT} requests/s (burst {API_BURST_LIMIT}).")
+
+        try:
+            lambda_client.add_permission(
+                FunctionName=function_arn,
+                StatementId=f'http-api-invoke-{UNIQUE_SUFFIX}',
+                Action='lambda:InvokeFunction',
+                Principal='apigateway.amazonaws.com',
+                SourceArn=f"arn:aws:execute-api:{AWS_REGION}:{ACCOUNT_ID}:{api_id}/*"
+            )
+            log.info("  ✅ Granted the HTTP API permission to invoke Lambda.")
+        except lambda_client.exceptions.ResourceConflictException:
+            pass # Already granted by an earlier run
+
+        return api_id, f"{api['ApiEndpoint']}/estimates"
+    except Exception as e:
+        log.error(f"  ❌ Error deploying HTTP API: {e}")
+        raise
+
+def deploy_function_url(log, function_arn):
+    """Creates the function's public URL (on the alias when WARM_POOL is set), or reuses it."""
+    log.info("\nStep 6: Creating Lambda Function URL...")
+    qualifier = {'Qualifier': LAMBDA_ALIAS_NAME} if WARM_POOL else {}
+    try:
+        try:
+            url = lambda_client.get_function_url_config(FunctionName=FUNCTION_NAME, **qualifier)['FunctionUrl']
+            log.warning("  ⚠️  Function URL already exists. Reusing.")
+        except lambda_client.exceptions.ResourceNotFoundException:
+            # The function checks API keys itself, so the URL needs no IAM auth
+            url = lambda_client.create_function_url_config(FunctionName=FUNCTION_NAME, AuthType='NONE',
+                                                           InvokeMode='BUFFERED', **qualifier)['FunctionUrl']
+            log.info(f"  ✅ Function URL created: {url}")
+
+        # Public URLs need both grants: one for the URL itself, one for invoking the function through it
+        grants = [
+            {'StatementId': f'function-url-{UNIQUE_SUFFIX}', 'Action': 'lambda:InvokeFunctionUrl', 'FunctionUrlAuthType': 'NONE'},
+            {'StatementId': f'function-url-invoke-{UNIQUE_SUFFIX}', 'Action': 'lambda:InvokeFunction', 'InvokedViaFunctionUrl': True}
+        ]
+        for grant in grants:
+            try:
+                lambda_client.add_permission(FunctionName=function_arn, Principal='*', **grant)
+            except lambda_client.exceptions.ResourceConflictException:
+                pass # Already granted by an earlier run
+        log.info("  ✅ Function URL is publicly invocable; requests still need a valid x-api-key.")
+        return None, f"{url.rstrip('/')}/estimates"
+    except Exception as e:
+        log.error(f"  ❌ Error creating Function URL: {e}")
         raise
 
+def remove_function_url(log):
+    """Deletes the Function URL and its public grants left by an earlier run, on the function and its alias."""
+    removed = False
+    for qualifier in ({}, {'Qualifier': LAMBDA_ALIAS_NAME}):
+        try:
+            lambda_client.delete_function_url_config(FunctionName=FUNCTION_NAME, **qualifier)
+            removed = True
+        except lambda_client.exceptions.ResourceNotFoundException:
+            pass
+        for statement_id in (f'function-url-{UNIQUE_SUFFIX}', f'function-url-invoke-{UNIQUE_SUFFIX}'):
+            try:
+                lambda_client.remove_permission(FunctionName=FUNCTION_NAME, StatementId=statement_id, **qualifier)
+            except lambda_client.exceptions.ResourceNotFoundException:
+                pass
+    if removed:
+        log.info("  ✅ Function URL removed (FUNCTION_URL_ENABLED is False).")
+
 def create_usage_plan(api_id):
     """Creates a Usage Plan and associates it with the API Stage."""
-    print("\nStep 6: Creating API Gateway Usage Plan...")
+    print("\nStep 7: Creating API Gateway Usage Plan...")
     try:
         plan_name = f'{BASE_NAME}-UsagePlan-{UNIQUE_SUFFIX}'
+        for page in apigateway_client.get_paginator('get_usage_plans').paginate():
+            if any(plan['name'] == plan_name for plan in page.get('items', [])):
+                print(f"  ⚠️  Usage Plan '{plan_name}' already exists.")
+                return
         plan_response = apigateway_client.create_usage_plan(
             name=plan_name,
             description='Limits usage for the CalcLinkSaver API',
             apiStages=[{'apiId': api_id, 'stage': API_STAGE_NAME}],
-            throttle={'rateLimit': 10, 'burstLimit': 5},
-            quota={'limit': 5000, 'period': 'MONTH'}
+            throttle={'rateLimit': API_RATE_LIMIT, 'burstLimit': API_BURST_LIMIT},
+            quota={'limit': API_MONTHLY_QUOTA, 'period': 'MONTH'}
         )
         print(f"  ✅ Usage Plan '{plan_name}' created and associated with the API.")
     except Exception as e:
@@ -357,26 +833,74 @@ def create_usage_plan(api_id):
         raise
 
 if __name__ == "__main__":
-    try:
-        role_arn = create_iam_role()
-        create_estimates_table()
-        create_users_table()
-        function_arn = create_lambda_function(role_arn)
-        api_id, final_url = create_api_gateway(function_arn)
-        create_usage_plan(api_id) # Added this step back in
-
-        print("\n" + "="*70)
-        print("🎉 SUCCESS! Your AWS backend infrastructure has been deployed. 🎉")
-        print("="*70)
-        print("\nAll infrastructure, including the API Usage Plan, is now ready.")
-        print("You can now add users by running the 'add_user.py' script.")
-        
-        print("\nTo add your first user, run this command:")
-        print("python3 add_user.py")
+    parser = argparse.ArgumentParser(description="Deploy the CalcLinkSaver multi-user backend to AWS.")
+    parser.add_argument('--update', metavar='SUFFIX',
+                        help="Update the existing deployment with this suffix instead of creating a new one. "
+                             "Only the Lambda code, its configuration and the API that changed are redeployed.")
+    args = parser.parse_args()
+    if args.update:
+        UPDATE_MODE = True
+        name_resources(args.update)
+
+    # The steps run on several threads and log through this; a handler writes each line whole,
+    # so lines of concurrent steps don't interleave
+    log = logging.getLogger(BASE_NAME)
+    log.addHandler(logging.StreamHandler(sys.stdout))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+    if UPDATE_MODE:
+        print(f"🚀  Updating deployment in region: {AWS_REGION}")
+    else:
+        print(f"🚀  Starting deployment in region: {AWS_REGION}")
+    print(f"🔖  Unique suffix for this deployment: {UNIQUE_SUFFIX}\n")
 
-        print("\n" + "-"*70)
-        print("\nEach user will need the following API URL:")
-        print(f"\n  ➡️   API URL: {final_url}\n")
+    try:
+        started = time.monotonic()
+        # IAM, the tables and the bucket don't depend on each other, so they run concurrently.
+        # The function only needs the role; the tables and bucket keep going in the background.
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            role_future = pool.submit(create_iam_role, log)
+            independent_steps = [pool.submit(step, log) for step in (create_estimates_table, create_users_table, create_data_bucket)]
+            if MIGRATION_TARGET_TABLE:
+                independent_steps.append(pool.submit(create_estimates_table, log, MIGRATION_TARGET_TABLE))
+            if UPDATE_MODE:
+                function_arn = update_lambda_function(log, role_future.result())
+            else:
+                function_arn = create_lambda_function(log, role_future.result())
+            if API_FRONTEND == 'http':
+                api_id, final_url = deploy_http_api(log, function_arn)
+            elif API_FRONTEND == 'url':
+                api_id, final_url = deploy_function_url(log, function_arn)
+            else:
+                api_id, final_url = deploy_api_gateway(log, function_arn)
+            if UPDATE_MODE and not FUNCTION_URL_ENABLED:
+                remove_function_url(log)
+            for future in independent_steps:
+                future.result()
+        if API_FRONTEND == 'rest':
+            create_usage_plan(api_id)
+        elapsed = time.monotonic() - started
+
+        if UPDATE_MODE:
+            print("\n" + "="*70)
+            print(f"🎉 SUCCESS! Deployment '{UNIQUE_SUFFIX}' is up to date ({elapsed:.0f}s). 🎉")
+            print("="*70)
+            print(f"\n  ➡️   API URL: {final_url}\n")
+        else:
+            print("\n" + "="*70)
+            print(f"🎉 SUCCESS! Your AWS backend infrastructure has been deployed ({elapsed:.0f}s). 🎉")
+            print("="*70)
+            print("\nAll infrastructure" + (", including the API Usage Plan," if API_FRONTEND == 'rest' else "") + " is now ready.")
+            print("You can now add users by running the 'add_user.py' script.")
+
+            print("\nTo add your first user, run this command:")
+            print("python3 add_user.py")
+
+            print("\n" + "-"*70)
+            print("\nEach user will need the following API URL:")
+            print(f"\n  ➡️   API URL: {final_url}\n")
+            print(f"To redeploy changes later, run: python3 deploy_backend_multiuser.py --update {UNIQUE_SUFFIX}\n")
 
 
     except Exception as e:
@@ -0,0 +1,593 @@
+# filename: dynamodb_store.py
+# description: DynamoDB storage for the /estimates API (see the store interface in estimates_api.py).
+
+import contextvars
+import importlib
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import boto3
+
+import request_metrics
+from estimates_api import (build_tombstone, decode_cursor, derived_attributes, encode_cursor, SORT_ATTRIBUTES, stats_deltas,
+                           SYNC_BUCKET)
+
+OWNER_INDEX_NAME = os.environ.get('OWNER_INDEX_NAME', 'OwnerTimestampIndex')
+LAST_MODIFIED_INDEX_NAME = os.environ.get('LAST_MODIFIED_INDEX_NAME', 'LastModifiedIndex')
+# Sparse syncBucket indexes that order every estimate by one of the derived attributes
+SORT_INDEX_NAMES = {
+    'cost': os.environ.get('COST_INDEX_NAME', 'CostIndex'),
+    'name': os.environ.get('NAME_INDEX_NAME', 'NameIndex'),
+    'timestamp': os.environ.get('TIMESTAMP_INDEX_NAME', 'TimestampIndex')
+}
+
+# Parallel Scan segments (and worker threads) used by GET /estimates/export
+EXPORT_SEGMENTS = int(os.environ.get('EXPORT_SEGMENTS', '4'))
+# Concurrent conditional writes when an archive job retires estimates
+RETIRE_WORKERS = int(os.environ.get('RETIRE_WORKERS', '8'))
+# Concurrent conditional writes when a batch is mirrored into a migration's target table
+MIRROR_WORKERS = int(os.environ.get('MIRROR_WORKERS', '8'))
+
+# API Key ID -> user lookups are cached per warm container; 0 disables the cache
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '300'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '256'))
+# Keys that matched no user are remembered briefly, in a cache of their own so a stream of bad keys
+# can't push real users out of the one above
+USER_NEGATIVE_CACHE_TTL_SECONDS = int(os.environ.get('USER_NEGATIVE_CACHE_TTL_SECONDS', '30'))
+
+# A single counter item in the estimates table, bumped by every write, backs list ETags.
+# Estimate ids starting with '#' are reserved for such bookkeeping items.
+VERSION_ITEM_KEY = {'estimateId': '#version'}
+# Each owner's stats live in a small bookkeeping item of their own, '#stats#<ownerId>', so a
+# write's UpdateItem costs one unit however many owners there are. The '#stats' item lists the
+# owners (a string set, only written when an owner's stats item is created), so reading every
+# owner's stats takes one GetItem and one BatchGetItem, both strongly consistent.
+STATS_ITEM_KEY = {'estimateId': '#stats'}
+STATS_ITEM_PREFIX = '#stats#'
+STATS_ATTRIBUTES = ('estimateCount', 'annualCostCents', 'lastSavedMs', 'ownerName')
+STATS_COUNTERS = ('estimateCount', 'annualCostCents')
+
+# DynamoDB caps BatchGetItem at 100 keys and BatchWriteItem at 25 requests
+BATCH_GET_CHUNK_SIZE = 100
+BATCH_WRITE_CHUNK_SIZE = 25
+BATCH_MAX_ATTEMPTS = 6
+
+# Bookkeeping items have no ownerId, so this keeps them and tombstones out of listings
+LIVE_ESTIMATES_FILTER = 'attribute_exists(ownerId) AND attribute_not_exists(deleted)'
+
+def stats_item_id(owner_id):
+    return f'{STATS_ITEM_PREFIX}{owner_id}'
+
+def backoff(attempt):
+    """Sleeps with capped exponential backoff and full jitter before a retry."""
+    time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+
+def projection(fields):
+    """Builds ProjectionExpression arguments, with placeholders since name, url and timestamp are reserved words."""
+    return {
+        'ProjectionExpression': ', '.join(f'#p{i}' for i in range(len(fields))),
+        'ExpressionAttributeNames': {f'#p{i}': field for i, field in enumerate(fields)}
+    }
+
+# The store talks to the low-level client, which starts faster than boto3.resource('dynamodb'),
+# and converts items to and from DynamoDB's AttributeValue wire format itself.
+def serialize_value(value):
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, dict):
+        return {'M': serialize_item(value)}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize_value(v) for v in value]}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (set, frozenset)) and value and all(isinstance(v, str) for v in value):
+        return {'SS': sorted(value)}
+    raise TypeError(f"Unsupported DynamoDB attribute type: {type(value).__name__}")
+
+def deserialize_value(attribute):
+    """Numbers come back as Decimal, as with the resource API; json_default handles them."""
+    (kind, value), = attribute.items()
+    if kind in ('S', 'B', 'BOOL'):
+        return value
+    if kind == 'N':
+        return Decimal(value)
+    if kind == 'NULL':
+        return None
+    if kind == 'M':
+        return deserialize_item(value)
+    if kind == 'L':
+        return [deserialize_value(v) for v in value]
+    if kind in ('SS', 'BS'):
+        return set(value)
+    if kind == 'NS':
+        return {Decimal(v) for v in value}
+    raise TypeError(f"Unsupported DynamoDB attribute type: {kind}")
+
+def serialize_item(item):
+    return {name: serialize_value(value) for name, value in item.items()}
+
+def deserialize_item(item):
+    return {name: deserialize_value(value) for name, value in item.items()}
+
+# Request arguments and response fields that hold items, keys or values in wire format
+WIRE_ARGUMENTS = ('Key', 'Item', 'ExclusiveStartKey', 'ExpressionAttributeValues')
+
+def call(kind, operation, **kwargs):
+    """Runs one DynamoDB call, recording its latency and consumed capacity ('read' or 'write' units).
+
+    Item-shaped arguments are serialized and Item, Items and LastEvaluatedKey deserialized;
+    batch requests are passed through as they are.
+    """
+    for name in WIRE_ARGUMENTS:
+        if name in kwargs:
+            kwargs[name] = serialize_item(kwargs[name])
+    started = time.perf_counter()
+    response = None
+    try:
+        response = operation(ReturnConsumedCapacity='TOTAL', **kwargs)
+    finally:
+        consumed_capacity = response.get('ConsumedCapacity') if response else None
+        request_metrics.record_store_call(time.perf_counter() - started, consumed_capacity, kind)
+    if 'Item' in response:
+        response['Item'] = deserialize_item(response['Item'])
+    if 'Attributes' in response:
+        response['Attributes'] = deserialize_item(response['Attributes'])
+    if 'Items' in response:
+        response['Items'] = [deserialize_item(item) for item in response['Items']]
+    if 'LastEvaluatedKey' in response:
+        response['LastEvaluatedKey'] = deserialize_item(response['LastEvaluatedKey'])
+    return response
+
+# Per-item transforms for migrate.py, which also applies them to the writes mirrored during the
+# migration's dual-write window. A transform gets every item, bookkeeping ones included (and, for
+# mirrored counter updates, just a bookkeeping item's key), and returns the item to write to the
+# target table or None to leave it out.
+def copy_item(item):
+    return item
+
+def derive_sort_keys(item):
+    """Recomputes a live estimate's derived sort attributes on its way across, like maintenance.py backfill-sort-keys."""
+    if 'ownerId' not in item or item.get('deleted'):
+        return item
+    item = {name: value for name, value in item.items() if name not in SORT_ATTRIBUTES.values()}
+    item.update(derived_attributes(item))
+    return item
+
+MIGRATION_TRANSFORMS = {'copy': copy_item, 'derive-sort-keys': derive_sort_keys}
+
+def load_transform(spec):
+    """Resolves a MIGRATION_TRANSFORMS name or a 'module:function' reference to the transform function."""
+    if spec in MIGRATION_TRANSFORMS:
+        return MIGRATION_TRANSFORMS[spec]
+    module_name, separator, function_name = spec.partition(':')
+    if not separator:
+        raise ValueError(f"Unknown transform {spec!r}: use one of {', '.join(MIGRATION_TRANSFORMS)} or 'module:function'.")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def remember(cache, key, value, ttl_seconds):
+    """Caches value for ttl_seconds (0 turns caching off), evicting the oldest entries beyond USER_CACHE_MAX_ENTRIES."""
+    if ttl_seconds <= 0:
+        return
+    cache[key] = (time.monotonic() + ttl_seconds, value)
+    cache.move_to_end(key)
+    while len(cache) > USER_CACHE_MAX_ENTRIES:
+        cache.popitem(last=False)
+
+class DynamoDBStore:
+    """Estimates and users kept in the two DynamoDB tables created by deploy_backend_multiuser.py."""
+
+    def __init__(self, estimates_table_name, users_table_name, client=None, mirror_table_name=None, mirror_transform='copy'):
+        self.estimates_table_name = estimates_table_name
+        self.users_table_name = users_table_name
+        # Low-level clients are thread-safe, so the export's scan workers share this one.
+        # Benchmarks pass a stand-in (InMemoryDynamoDB.client() from inmemory_dynamodb.py).
+        self.client = client or boto3.client('dynamodb')
+        # While migrate.py copies the table, every write is also mirrored into its target
+        self.mirror_table_name = mirror_table_name
+        self.mirror_transform = load_transform(mirror_transform) if mirror_table_name else None
+        # Live as long as the store, i.e. across invocations: apiKeyId -> (expires_at, user), oldest first
+        self.user_cache = OrderedDict()
+        self.unknown_key_cache = OrderedDict()
+
+    def get_user(self, api_key_id):
+        """Fetches user details from the UsersTable based on the API Key ID."""
+        now = time.monotonic()
+        for cache in (self.user_cache, self.unknown_key_cache):
+            cached = cache.get(api_key_id)
+            if cached and cached[0] > now:
+                cache.move_to_end(api_key_id)
+                return cached[1]
+        try:
+            response = call('read', self.client.get_item, TableName=self.users_table_name, Key={'apiKeyId': api_key_id})
+        except Exception as e:
+            print(f"Error looking up user for apiKeyId {api_key_id}: {e}")
+            return None
+        user = response.get('Item')
+        # Unknown keys are only remembered briefly, so newly added users are recognised soon
+        if user:
+            remember(self.user_cache, api_key_id, user, USER_CACHE_TTL_SECONDS)
+            self.unknown_key_cache.pop(api_key_id, None)
+        else:
+            remember(self.unknown_key_cache, api_key_id, None, USER_NEGATIVE_CACHE_TTL_SECONDS)
+        return user
+
+    def list_operation(self, owner_id=None, since=None, fields=None, view=None):
+        """Returns the table call and arguments for listing all estimates or one owner's."""
+        operation, kwargs = self.view_source(owner_id, view) if view else self.list_source(owner_id, since)
+        if fields:
+            kwargs.update(projection(fields))
+        return operation, kwargs
+
+    def list_source(self, owner_id, since):
+        """Chooses between the table Scan and the owner or last-modified index Query."""
+        if since is not None:
+            # Delta mode: everything changed after `since`, tombstones included, oldest change first
+            kwargs = {
+                'TableName': self.estimates_table_name,
+                'IndexName': LAST_MODIFIED_INDEX_NAME,
+                'KeyConditionExpression': 'syncBucket = :bucket AND lastModified > :since',
+                'ExpressionAttributeValues': {':bucket': SYNC_BUCKET, ':since': since}
+            }
+            if owner_id:
+                kwargs['FilterExpression'] = 'ownerId = :owner'
+                kwargs['ExpressionAttributeValues'][':owner'] = owner_id
+            return self.client.query, kwargs
+        if owner_id:
+            # Owner mode: a Query on the owner/timestamp index, newest first. Tombstones
+            # have no timestamp, so they never appear in this index.
+            return self.client.query, {
+                'TableName': self.estimates_table_name,
+                'IndexName': OWNER_INDEX_NAME,
+                'KeyConditionExpression': 'ownerId = :owner',
+                'ExpressionAttributeValues': {':owner': owner_id},
+                'ScanIndexForward': False
+            }
+        return self.client.scan, {'TableName': self.estimates_table_name, 'FilterExpression': LIVE_ESTIMATES_FILTER}
+
+    def view_source(self, owner_id, view):
+        """Queries the index for the view's sort. Bounds on the sort attribute become key conditions,
+        the other filters FilterExpressions (which can leave a page short of `limit`)."""
+        values = {}
+        if owner_id and view['sort'] == 'timestamp':
+            # One owner's estimates are already ordered by timestamp in the owner index; the filter
+            # drops unparseable timestamps, as the sparse TimestampIndex would
+            index_name, sort_attribute = OWNER_INDEX_NAME, None
+            key_conditions, filters = ['ownerId = :owner'], ['attribute_exists(timestampMs)']
+            values[':owner'] = owner_id
+        else:
+            index_name, sort_attribute = SORT_INDEX_NAMES[view['sort']], SORT_ATTRIBUTES[view['sort']]
+            key_conditions, filters = ['syncBucket = :bucket'], []
+            values[':bucket'] = SYNC_BUCKET
+            if owner_id:
+                filters.append('ownerId = :owner')
+                values[':owner'] = owner_id
+        cost_bounds = []
+        if view['min_cost'] is not None:
+            cost_bounds.append('annualCostCents >= :minCost')
+            values[':minCost'] = view['min_cost']
+        if view['max_cost'] is not None:
+            cost_bounds.append('annualCostCents <= :maxCost')
+            values[':maxCost'] = view['max_cost']
+        if len(cost_bounds) == 2 and sort_attribute == 'annualCostCents':
+            # A key condition allows only one comparison on the sort key
+            cost_bounds = ['annualCostCents BETWEEN :minCost AND :maxCost']
+        (key_conditions if sort_attribute == 'annualCostCents' else filters).extend(cost_bounds)
+        if view['name_prefix'] is not None:
+            (key_conditions if sort_attribute == 'nameLower' else filters).append('begins_with(nameLower, :prefix)')
+            values[':prefix'] = view['name_prefix']
+        kwargs = {
+            'TableName': self.estimates_table_name,
+            'IndexName': index_name,
+            'KeyConditionExpression': ' AND '.join(key_conditions),
+            'ExpressionAttributeValues': values,
+            'ScanIndexForward': not view['descending']
+        }
+        if filters:
+            kwargs['FilterExpression'] = ' AND '.join(filters)
+        return self.client.query, kwargs
+
+    def read_page(self, limit, cursor, owner_id=None, since=None, fields=None, view=None):
+        """Reads one bounded page of estimates and returns (items, next_cursor)."""
+        operation, kwargs = self.list_operation(owner_id, since, fields, view)
+        kwargs['Limit'] = limit
+        if cursor:
+            kwargs['ExclusiveStartKey'] = decode_cursor(cursor)
+        response = call('read', operation, **kwargs)
+        return response.get('Items', []), encode_cursor(response.get('LastEvaluatedKey'))
+
+    def read_all(self, owner_id=None, since=None, fields=None, view=None):
+        """Follows LastEvaluatedKey until every matching estimate has been read."""
+        operation, kwargs = self.list_operation(owner_id, since, fields, view)
+        items = []
+        while True:
+            response = call('read', operation, **kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def get_collection_version(self):
+        """Reads the counter that every write to the estimates table increments."""
+        response = call('read', self.client.get_item, TableName=self.estimates_table_name, Key=VERSION_ITEM_KEY,
+                        ConsistentRead=True)
+        return int(response.get('Item', {}).get('version', 0))
+
+    def bump_collection_version(self):
+        """Atomically increments the collection version after a successful write."""
+        call(
+            'write', self.client.update_item,
+            TableName=self.estimates_table_name,
+            Key=VERSION_ITEM_KEY,
+            UpdateExpression='ADD version :one',
+            ExpressionAttributeValues={':one': 1}
+        )
+        self.mirror_update(VERSION_ITEM_KEY, UpdateExpression='ADD version :one', ExpressionAttributeValues={':one': 1})
+
+    def get_stats(self, owner_id=None):
+        """Reads one owner's stats, or every owner's listed in the '#stats' item."""
+        if owner_id:
+            owner_ids = [owner_id]
+        else:
+            response = call('read', self.client.get_item, TableName=self.estimates_table_name, Key=STATS_ITEM_KEY,
+                            ConsistentRead=True, **projection(['owners']))
+            owner_ids = sorted(response.get('Item', {}).get('owners', ()))
+        stats = []
+        for item in self.get_items([stats_item_id(owner_id) for owner_id in owner_ids], list(STATS_ATTRIBUTES),
+                                   consistent=True).values():
+            stats.append({
+                'ownerId': item['estimateId'][len(STATS_ITEM_PREFIX):],
+                'ownerName': item.get('ownerName'),
+                'estimateCount': int(item.get('estimateCount', 0)),
+                'annualCostCents': int(item.get('annualCostCents', 0)),
+                'lastSavedMs': int(item.get('lastSavedMs', 0))
+            })
+        return stats
+
+    def apply_stats(self, deltas):
+        """Adds stats_deltas() output to each owner's stats item: counters with atomic ADD, the rest with SET."""
+        for owner_id, delta in deltas.items():
+            additions, assignments, values = [], [], {}
+            for stat in STATS_ATTRIBUTES:
+                if delta[stat] is None or (stat in STATS_COUNTERS and not delta[stat]):
+                    continue
+                values[f':{stat}'] = delta[stat]
+                if stat in STATS_COUNTERS:
+                    additions.append(f'{stat} :{stat}')
+                else:
+                    assignments.append(f'{stat} = :{stat}')
+            update = {
+                'UpdateExpression': ' '.join(([f"ADD {', '.join(additions)}"] if additions else []) +
+                                             ([f"SET {', '.join(assignments)}"] if assignments else [])),
+                'ExpressionAttributeValues': values
+            }
+            key = {'estimateId': stats_item_id(owner_id)}
+            response = call('write', self.client.update_item, TableName=self.estimates_table_name, Key=key,
+                            ReturnValues='ALL_OLD', **update)
+            self.mirror_update(key, **update)
+            if not response.get('Attributes'):
+                # A new owner: list them, so reads of every owner's stats find the item
+                owner_update = {'UpdateExpression': 'ADD owners :owner', 'ExpressionAttributeValues': {':owner': {owner_id}}}
+                call('write', self.client.update_item, TableName=self.estimates_table_name, Key=STATS_ITEM_KEY, **owner_update)
+                self.mirror_update(STATS_ITEM_KEY, **owner_update)
+
+    def replace_stats(self, owner_stats):
+        """Overwrites every owner's stats item with freshly computed stats, dropping owners left with none."""
+        response = call('read', self.client.get_item, TableName=self.estimates_table_name, Key=STATS_ITEM_KEY,
+                        ConsistentRead=True, **projection(['owners']))
+        stale_owners = set(response.get('Item', {}).get('owners', ())) - {entry['ownerId'] for entry in owner_stats}
+        items = [dict({stat: entry[stat] for stat in STATS_ATTRIBUTES if entry.get(stat) is not None},
+                      estimateId=stats_item_id(entry['ownerId'])) for entry in owner_stats]
+        requests = [{'PutRequest': {'Item': serialize_item(item)}} for item in items]
+        requests += [{'DeleteRequest': {'Key': {'estimateId': {'S': stats_item_id(owner_id)}}}} for owner_id in stale_owners]
+        if self.batch_write(requests):
+            raise Exception('BatchWriteItem did not complete after retries.')
+        # Also replaces the single stats item that earlier versions kept every owner's stats in
+        owners_item = dict(STATS_ITEM_KEY, **({'owners': {entry['ownerId'] for entry in owner_stats}} if owner_stats else {}))
+        call('write', self.client.put_item, TableName=self.estimates_table_name, Item=owners_item)
+        self.mirror_items(items + [owners_item])
+
+    def put_item(self, item):
+        """Writes an estimate unless its id belongs to another owner's live estimate."""
+        try:
+            response = call(
+                'write', self.client.put_item, TableName=self.estimates_table_name, Item=item,
+                ConditionExpression='attribute_not_exists(ownerId) OR ownerId = :owner OR attribute_exists(deleted)',
+                ExpressionAttributeValues={':owner': item['ownerId']},
+                ReturnValues='ALL_OLD'
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        self.mirror_items([item])
+        self.apply_stats(stats_deltas([(response.get('Attributes'), item)]))
+        return True
+
+    def delete_item(self, estimate_id, requester_id):
+        """Swaps the requester's estimate for a tombstone with a single conditional write."""
+        tombstone = build_tombstone(estimate_id, requester_id)
+        try:
+            response = call(
+                'write', self.client.put_item,
+                TableName=self.estimates_table_name,
+                Item=tombstone,
+                ConditionExpression='ownerId = :requester AND attribute_not_exists(deleted)',
+                ExpressionAttributeValues={':requester': requester_id},
+                ReturnValues='ALL_OLD',
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except self.client.exceptions.ConditionalCheckFailedException as e:
+            # The old item (if any, still in wire format) tells "not yours" from "not there"
+            old_item = e.response.get('Item')
+            if not old_item or 'deleted' in old_item:
+                return 'not_found'
+            return 'forbidden'
+        self.mirror_items([tombstone])
+        self.apply_stats(stats_deltas([(response.get('Attributes'), None)]))
+        return 'deleted'
+
+    def get_items(self, estimate_ids, fields, consistent=False):
+        """Returns {estimateId: item} with just `fields` (None: all) of the stored items, using chunked BatchGetItem."""
+        items = {}
+        unique_ids = list(dict.fromkeys(estimate_ids))
+        for start in range(0, len(unique_ids), BATCH_GET_CHUNK_SIZE):
+            chunk = unique_ids[start:start + BATCH_GET_CHUNK_SIZE]
+            request = {self.estimates_table_name: dict(
+                projection(['estimateId'] + fields) if fields else {},
+                Keys=[{'estimateId': {'S': estimate_id}} for estimate_id in chunk],
+                ConsistentRead=consistent
+            )}
+            attempt = 0
+            while request:
+                if attempt:
+                    backoff(attempt)
+                response = call('read', self.client.batch_get_item, RequestItems=request)
+                for item in response.get('Responses', {}).get(self.estimates_table_name, []):
+                    item = deserialize_item(item)
+                    items[item['estimateId']] = item
+                request = response.get('UnprocessedKeys') or {}
+                attempt += 1
+                if request and attempt >= BATCH_MAX_ATTEMPTS:
+                    raise Exception('BatchGetItem did not complete after retries.')
+        return items
+
+    def get_owners(self, estimate_ids):
+        """Returns {estimateId: ownerId} for the live (non-tombstoned) ids."""
+        return {estimate_id: item.get('ownerId') for estimate_id, item in self.get_items(estimate_ids, ['ownerId', 'deleted']).items()
+                if not item.get('deleted')}
+
+    def put_items(self, items):
+        """Writes items with BatchWriteItem in chunks of 25, retrying unprocessed ones.
+
+        BatchWriteItem can't return what it replaced, so the stats are adjusted from a read made
+        just before; a write racing in between makes them drift until the next rebuild.
+        Returns the set of estimateIds whose writes were still unprocessed after all retries.
+        """
+        old_items = self.get_items([item['estimateId'] for item in items], ['ownerId', 'deleted', 'annualCostCents'])
+        unprocessed = self.batch_write([{'PutRequest': {'Item': serialize_item(item)}} for item in items])
+        failed = {request['PutRequest']['Item']['estimateId']['S'] for request in unprocessed}
+        # Only the last write of a repeated id sticks
+        written = {item['estimateId']: item for item in items if item['estimateId'] not in failed}
+        self.mirror_items(list(written.values()))
+        self.apply_stats(stats_deltas((old_items.get(estimate_id), item) for estimate_id, item in written.items()))
+        return failed
+
+    def batch_write(self, requests):
+        """Sends write requests with BatchWriteItem in chunks of 25, retrying unprocessed ones.
+
+        Returns the requests still unprocessed after BATCH_MAX_ATTEMPTS.
+        """
+        failed = []
+        for start in range(0, len(requests), BATCH_WRITE_CHUNK_SIZE):
+            pending = requests[start:start + BATCH_WRITE_CHUNK_SIZE]
+            attempt = 0
+            while pending:
+                if attempt:
+                    backoff(attempt)
+                response = call('write', self.client.batch_write_item,
+                                RequestItems={self.estimates_table_name: pending})
+                pending = response.get('UnprocessedItems', {}).get(self.estimates_table_name, [])
+                attempt += 1
+                if pending and attempt >= BATCH_MAX_ATTEMPTS:
+                    failed.extend(pending)
+                    break
+        return failed
+
+    def retire_items(self, items):
+        """Tombstones each estimate whose lastModified still matches `items`, with one conditional write apiece.
+
+        BatchWriteItem can't be conditional, and an unconditional tombstone could bury a save made
+        since the archive job read the estimate.
+        """
+        def retire(item):
+            tombstone = build_tombstone(item['estimateId'], item['ownerId'])
+            try:
+                response = call(
+                    'write', self.client.put_item,
+                    TableName=self.estimates_table_name,
+                    Item=tombstone,
+                    ConditionExpression='lastModified = :seen AND attribute_not_exists(deleted)',
+                    ExpressionAttributeValues={':seen': item['lastModified']},
+                    ReturnValues='ALL_OLD'
+                )
+            except self.client.exceptions.ConditionalCheckFailedException:
+                return None
+            self.mirror_items([tombstone])
+            return response.get('Attributes')
+
+        with ThreadPoolExecutor(max_workers=RETIRE_WORKERS) as pool:
+            retired = [old_item for old_item in pool.map(retire, items) if old_item]
+        self.apply_stats(stats_deltas((old_item, None) for old_item in retired))
+        return {old_item['estimateId'] for old_item in retired}
+
+    def mirror_items(self, items):
+        """Copies just-written items into the migration target, if there is one.
+
+        Each copy is conditional on lastModified, so a delayed mirror never replaces a newer one.
+        Failures are only logged: the request already succeeded, and the next migrate.py run's
+        catch-up copies everything changed since the migration started.
+        """
+        if not self.mirror_table_name:
+            return
+
+        def mirror(item):
+            target_item = self.mirror_transform(dict(item))
+            if target_item is None:
+                return
+            condition = {}
+            if 'lastModified' in target_item:
+                condition = {'ConditionExpression': 'attribute_not_exists(lastModified) OR lastModified <= :modified',
+                             'ExpressionAttributeValues': {':modified': target_item['lastModified']}}
+            try:
+                call('write', self.client.put_item, TableName=self.mirror_table_name, Item=target_item, **condition)
+            except self.client.exceptions.ConditionalCheckFailedException:
+                pass
+            except Exception as e:
+                print(f"Error mirroring estimate {item['estimateId']} to {self.mirror_table_name}: {e}")
+
+        if len(items) == 1:
+            mirror(items[0])
+            return
+        with ThreadPoolExecutor(max_workers=MIRROR_WORKERS) as pool:
+            list(pool.map(mirror, items))
+
+    def mirror_update(self, key, **kwargs):
+        """Repeats an update of a bookkeeping item (the version or stats counters) on the migration target."""
+        if not self.mirror_table_name:
+            return
+        target_key = self.mirror_transform(dict(key))
+        if target_key is None:
+            return
+        try:
+            call('write', self.client.update_item, TableName=self.mirror_table_name, Key=target_key, **kwargs)
+        except Exception as e:
+            print(f"Error mirroring {key['estimateId']} to {self.mirror_table_name}: {e}")
+
+    def scan_for_export(self, columns, write_items):
+        """Scans the table in EXPORT_SEGMENTS parallel segments, handing each page to write_items."""
+        def export_segment(segment):
+            kwargs = dict(projection(columns), TableName=self.estimates_table_name, Segment=segment, TotalSegments=EXPORT_SEGMENTS,
+                          FilterExpression=LIVE_ESTIMATES_FILTER)
+            count = 0
+            while True:
+                response = call('read', self.client.scan, **kwargs)
+                items = response.get('Items', [])
+                if items:
+                    write_items(items)
+                    count += len(items)
+                if 'LastEvaluatedKey' not in response:
+                    return count
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        # Each worker runs in a copy of this context so its scans count towards the request's metrics
+        contexts = [contextvars.copy_context() for _ in range(EXPORT_SEGMENTS)]
+        with ThreadPoolExecutor(max_workers=EXPORT_SEGMENTS) as pool:
+            return sum(pool.map(lambda segment: contexts[segment].run(export_segment, segment), range(EXPORT_SEGMENTS)))
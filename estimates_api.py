@@ -0,0 +1,1020 @@
+# filename: estimates_api.py
+# description: The storage-agnostic /estimates REST contract, shared by the Lambda function
+#              (lambda_function.py + dynamodb_store.py) and the self-hosted server (local_server.py).
+
+import base64
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit, urlunsplit
+
+import request_metrics
+
+# Deleted estimates are kept as tombstones for delta sync until they expire
+TOMBSTONE_TTL_SECONDS = int(os.environ.get('TOMBSTONE_TTL_SECONDS', str(30 * 24 * 3600)))
+
+# Exports and other blobs go to S3 when BLOB_BUCKET is set, otherwise to a local directory
+BLOB_BUCKET = os.environ.get('BLOB_BUCKET')
+BLOB_DIR = os.environ.get('BLOB_DIR', '/tmp/calclinksaver-blobs')
+EXPORT_URL_TTL_SECONDS = int(os.environ.get('EXPORT_URL_TTL_SECONDS', '3600'))
+
+# Archive jobs move estimates saved more than this many days ago into per-owner blobs
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_PREFIX = 'archive/'
+
+# Response bodies at least this large are compressed when the client sends Accept-Encoding
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,If-None-Match',
+    'Access-Control-Allow-Methods': 'OPTIONS,GET,POST,DELETE',
+    'Access-Control-Expose-Headers': 'ETag,Server-Timing'
+}
+
+# Every estimate and tombstone carries this constant partition key so the LastModifiedIndex
+# can answer "everything changed after T" with a single Query
+SYNC_BUCKET = 'estimates'
+# syncTokens are backdated by this much to cover clock skew and index propagation delay
+SYNC_OVERLAP_MS = 5000
+# Attributes the server owns; clients may not set them directly
+SERVER_MANAGED_ATTRIBUTES = ('deleted', 'expiresAt', 'lastModified', 'syncBucket',
+                             'annualCostCents', 'timestampMs', 'nameLower')
+# Attributes that GET /estimates?fields=... may request; projections always include estimateId
+PROJECTABLE_FIELDS = ('estimateId', 'name', 'url', 'timestamp', 'annualCost', 'ownerId', 'ownerName', 'lastModified',
+                      'annualCostCents', 'timestampMs')
+# Columns written by GET /estimates/export, in order
+EXPORT_COLUMNS = ('estimateId', 'name', 'url', 'timestamp', 'annualCost', 'ownerId', 'ownerName')
+
+# Page size bounds for GET /estimates?limit=...
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Entries accepted by one batch route request
+MAX_BATCH_ITEMS = 100
+
+# GET /estimates?sort=... -> the derived attribute it orders by. Estimates without that attribute
+# (e.g. an 'N/A' cost) are left out of the sorted listing, like they are from a sparse index.
+SORT_ATTRIBUTES = {'cost': 'annualCostCents', 'name': 'nameLower', 'timestamp': 'timestampMs'}
+# Default direction per sort, matching the userscript's table headers
+DEFAULT_SORT_ORDER = {'cost': 'asc', 'name': 'asc', 'timestamp': 'desc'}
+MAX_NAME_PREFIX_LENGTH = 200
+# Everything but the amount in a scraped cost such as '$1,234.56'
+COST_NOISE = re.compile(r'[^\d.-]')
+
+# Saves of the same link by the same owner share one estimateId: this many hex digits of a
+# SHA-256 over the owner and the canonical URL
+ESTIMATE_KEY_HEX_DIGITS = 32
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Store interface
+# ---------------
+# route_request() reaches storage only through a store object with these methods:
+#   get_user(api_key_id)                          -> user dict (userId, displayName) or None
+#   read_page(limit, cursor, owner_id, since, fields, view) -> (items, next_cursor or None)
+#   read_all(owner_id, since, fields, view)       -> items
+#   get_collection_version() / bump_collection_version()
+#   put_item(item)                                -> False if estimateId is another owner's live estimate
+#   delete_item(estimate_id, requester_id)        -> 'deleted', 'not_found' or 'forbidden'
+#   get_owners(estimate_ids)                      -> {estimateId: ownerId} for live estimates
+#   put_items(items)                              -> set of estimateIds that were not written
+#   scan_for_export(columns, write_items)         -> number of estimates passed to write_items
+#   retire_items(items)                           -> estimateIds tombstoned because unchanged since read (archive jobs)
+#   get_stats(owner_id=None)                      -> [{ownerId, ownerName, estimateCount, annualCostCents, lastSavedMs}]
+#                                                    (every owner's, or just owner_id's)
+#   replace_stats(owner_stats)                    -> overwrites the per-owner stats (rebuild jobs)
+# Every write also applies stats_deltas() to the per-owner stats.
+# Listings never include bookkeeping items, and only delta (since) listings include tombstones.
+# `view` is None or a parse_view() dict; it orders and filters a listing (never combined with since).
+
+class BadRequest(Exception):
+    """Raised for malformed query parameters; mapped to a 400 response."""
+
+def json_default(value):
+    """Serializes the Decimals that boto3 returns for DynamoDB numbers."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def now_ms():
+    """Current time as epoch milliseconds, the unit of lastModified and syncTokens."""
+    return int(time.time() * 1000)
+
+def encode_cursor(last_evaluated_key):
+    """Encodes a store's continuation key as an opaque URL-safe token."""
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(',', ':'), default=json_default).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decodes a token produced by encode_cursor back into a continuation key."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise BadRequest('Invalid cursor.')
+    if not isinstance(key, dict):
+        raise BadRequest('Invalid cursor.')
+    return key
+
+def parse_limit(value):
+    """Validates the limit query parameter, falling back to DEFAULT_PAGE_SIZE."""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise BadRequest('limit must be an integer.')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise BadRequest(f'limit must be between 1 and {MAX_PAGE_SIZE}.')
+    return limit
+
+def parse_since(value):
+    """Validates the since query parameter (epoch milliseconds), if present."""
+    if value is None:
+        return None
+    try:
+        since = int(value)
+    except ValueError:
+        raise BadRequest('since must be an epoch timestamp in milliseconds.')
+    if since < 0:
+        raise BadRequest('since must be an epoch timestamp in milliseconds.')
+    return since
+
+def parse_fields(value):
+    """Validates a comma-separated fields parameter against PROJECTABLE_FIELDS."""
+    if value is None:
+        return None
+    fields = ['estimateId']
+    for field in value.split(','):
+        field = field.strip()
+        if field not in PROJECTABLE_FIELDS:
+            raise BadRequest(f"Unknown field '{field}'. Allowed fields: {', '.join(PROJECTABLE_FIELDS)}.")
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+def parse_cost(value, name):
+    """Validates a minCost/maxCost parameter (dollars) and returns it in cents, if present."""
+    if value is None:
+        return None
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        raise BadRequest(f'{name} must be a number of dollars.')
+    if not amount.is_finite() or amount < 0:
+        raise BadRequest(f'{name} must be a number of dollars.')
+    return int((amount * 100).to_integral_value(ROUND_HALF_UP))
+
+def parse_view(query):
+    """Validates sort, order, minCost, maxCost and namePrefix; returns None when none is given.
+
+    Filters without a sort use the matching sort's index: cost bounds sort by cost, a name prefix by name.
+    """
+    sort, order = query.get('sort'), query.get('order')
+    min_cost, max_cost = parse_cost(query.get('minCost'), 'minCost'), parse_cost(query.get('maxCost'), 'maxCost')
+    name_prefix = query.get('namePrefix')
+    if sort is None and order is None and min_cost is None and max_cost is None and name_prefix is None:
+        return None
+    if sort is None:
+        if order is not None:
+            raise BadRequest('order requires sort.')
+        sort = 'cost' if min_cost is not None or max_cost is not None else 'name'
+    if sort not in SORT_ATTRIBUTES:
+        raise BadRequest(f"sort must be one of: {', '.join(SORT_ATTRIBUTES)}.")
+    if order not in (None, 'asc', 'desc'):
+        raise BadRequest("order must be 'asc' or 'desc'.")
+    if min_cost is not None and max_cost is not None and min_cost > max_cost:
+        raise BadRequest('minCost must not exceed maxCost.')
+    if name_prefix is not None:
+        if not name_prefix or len(name_prefix) > MAX_NAME_PREFIX_LENGTH:
+            raise BadRequest(f'namePrefix must be 1 to {MAX_NAME_PREFIX_LENGTH} characters.')
+        name_prefix = name_prefix.lower()
+    return {
+        'sort': sort,
+        'descending': (order or DEFAULT_SORT_ORDER[sort]) == 'desc',
+        'min_cost': min_cost,
+        'max_cost': max_cost,
+        'name_prefix': name_prefix
+    }
+
+def parse_format(value):
+    """Validates the format parameter; returns True for the compact array-of-arrays format."""
+    if value in (None, 'objects'):
+        return False
+    if value == 'compact':
+        return True
+    raise BadRequest("format must be 'objects' or 'compact'.")
+
+def to_compact(items, columns):
+    """Converts items to a header row of column names followed by one value row per item."""
+    return [columns] + [[item.get(column) for column in columns] for item in items]
+
+def make_etag(version, query, owner_id):
+    """Derives a list ETag from the collection version and the request's parameters."""
+    variant = json.dumps([sorted(query.items()), owner_id], separators=(',', ':'))
+    return '"%d-%s"' % (version, hashlib.sha1(variant.encode('utf-8')).hexdigest()[:12])
+
+def read_body(event):
+    """Parses the JSON request body, undoing API Gateway's base64 encoding of binary media types."""
+    body = event.get('body') or '{}'
+    try:
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body).decode('utf-8')
+        body = json.loads(body)
+    except ValueError:
+        raise BadRequest('Request body must be valid JSON.')
+    # Every route reads fields from an object; a bare number or list would fail later as a 500
+    if not isinstance(body, dict):
+        raise BadRequest('Request body must be a JSON object.')
+    return body
+
+def choose_encoding(accept_encoding):
+    """Picks gzip or deflate from an Accept-Encoding header, honouring q=0 exclusions."""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ('gzip', 'deflate'):
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+def compress_response(event, response):
+    """Compresses large successful bodies and returns them base64-encoded for API Gateway."""
+    body = response.get('body')
+    if response.get('statusCode') != 200 or not body or response.get('isBase64Encoded'):
+        return response
+    raw = body.encode('utf-8')
+    if len(raw) < COMPRESSION_MIN_BYTES:
+        return response
+    headers = dict(response.get('headers') or {}, Vary='Accept-Encoding')
+    encoding = choose_encoding(get_header(event, 'accept-encoding'))
+    if not encoding:
+        return dict(response, headers=headers)
+    compressed = gzip.compress(raw, compresslevel=6) if encoding == 'gzip' else zlib.compress(raw, 6)
+    headers['Content-Encoding'] = encoding
+    return dict(response, headers=headers, body=base64.b64encode(compressed).decode('ascii'), isBase64Encoded=True)
+
+def get_header(event, name):
+    """Case-insensitive request header lookup."""
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def etag_matches(if_none_match, etag):
+    """Implements the If-None-Match comparison (weak, list-aware, with '*')."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in [tag[2:] if tag.startswith('W/') else tag for tag in candidates]
+
+def parse_batch(body, field):
+    """Validates a batch request body and returns its list under `field`."""
+    entries = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise BadRequest(f"Request body must contain a non-empty '{field}' list.")
+    if len(entries) > MAX_BATCH_ITEMS:
+        raise BadRequest(f'A batch may contain at most {MAX_BATCH_ITEMS} entries.')
+    return entries
+
+def cost_to_cents(value):
+    """Reads a scraped cost such as '$1,234.56' as integer cents, the way the userscript's sort did; None if it has no amount."""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, Decimal)):
+        return None
+    try:
+        amount = Decimal(COST_NOISE.sub('', value) if isinstance(value, str) else str(value))
+    except InvalidOperation:
+        return None
+    if not amount.is_finite():
+        return None
+    return int((amount * 100).to_integral_value(ROUND_HALF_UP))
+
+def timestamp_to_ms(value):
+    """Reads an ISO 8601 timestamp (the userscript sends toISOString()) as epoch milliseconds; None if unparseable."""
+    if not isinstance(value, str):
+        return None
+    try:
+        # fromisoformat() only accepts a 'Z' suffix from Python 3.11 on
+        parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def derived_attributes(item):
+    """The normalized sort and filter attributes of an estimate; missing ones keep it out of that sort's index."""
+    derived = {
+        'annualCostCents': cost_to_cents(item.get('annualCost')),
+        'timestampMs': timestamp_to_ms(item.get('timestamp')),
+        'nameLower': item['name'].lower() if isinstance(item.get('name'), str) and item['name'] else None
+    }
+    return {name: value for name, value in derived.items() if value is not None}
+
+def canonical_url(url):
+    """Normalizes an estimate URL so different spellings of the same link compare equal.
+
+    Scheme and host are lowercased, default ports and trailing slashes dropped, and the parameters
+    of the query and of the calculator's '#/estimate?id=...' fragment sorted.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '') + (f':{port}' if port is not None and port != DEFAULT_PORTS.get(scheme) else '')
+    fragment_path, separator, fragment_query = parts.fragment.partition('?')
+    fragment = fragment_path + separator + urlencode(sorted(parse_qsl(fragment_query, keep_blank_values=True)))
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path.rstrip('/') or '/', query, fragment))
+
+def estimate_key(owner_id, url):
+    """The estimateId under which `owner_id` keeps `url`; saving the link again updates that estimate."""
+    digest = hashlib.sha256(f'{owner_id}\n{canonical_url(url)}'.encode('utf-8')).hexdigest()
+    return digest[:ESTIMATE_KEY_HEX_DIGITS]
+
+def build_item(body, requester_id, requester_name):
+    """Turns a frontend estimate payload into the item stored for the requester.
+
+    Estimates with a url are stored under estimate_key(); the client's id is only used without one.
+    """
+    if str(body['id']).startswith('#'):
+        raise BadRequest("Estimate ids may not start with '#'.")
+    # The frontend sends 'id', we rename to 'estimateId' for clarity
+    item_to_save = body.copy()
+    item_to_save['estimateId'] = item_to_save.pop('id') # Rename key
+    if isinstance(item_to_save.get('url'), str) and item_to_save['url'].strip():
+        item_to_save['estimateId'] = estimate_key(requester_id, item_to_save['url'])
+    for attribute in SERVER_MANAGED_ATTRIBUTES:
+        item_to_save.pop(attribute, None)
+    item_to_save['ownerId'] = requester_id
+    item_to_save['ownerName'] = requester_name
+    item_to_save['lastModified'] = now_ms()
+    item_to_save['syncBucket'] = SYNC_BUCKET
+    item_to_save.update(derived_attributes(item_to_save))
+    return item_to_save
+
+def build_tombstone(estimate_id, owner_id):
+    """Builds the soft-delete marker that replaces a deleted estimate until it expires."""
+    modified = now_ms()
+    return {
+        'estimateId': estimate_id,
+        'ownerId': owner_id,
+        'deleted': True,
+        'lastModified': modified,
+        'syncBucket': SYNC_BUCKET,
+        'expiresAt': modified // 1000 + TOMBSTONE_TTL_SECONDS
+    }
+
+def batch_delete(store, estimate_ids, requester_id):
+    """Deletes the requester's estimates in bulk and returns per-item results.
+
+    Only the first entry for an id can succeed; repeats of it are reported as 404.
+    """
+    if not all(isinstance(estimate_id, str) and estimate_id for estimate_id in estimate_ids):
+        raise BadRequest('ids must be non-empty strings.')
+    unique_ids = list(dict.fromkeys(estimate_ids))
+    owners = store.get_owners(unique_ids)
+    statuses = {}
+    tombstones = []
+    for estimate_id in unique_ids:
+        if estimate_id not in owners:
+            statuses[estimate_id] = (404, 'Not Found')
+        elif owners[estimate_id] != requester_id:
+            statuses[estimate_id] = (403, 'Forbidden: You can only delete your own estimates.')
+        else:
+            tombstones.append(build_tombstone(estimate_id, requester_id))
+    failed = store.put_items(tombstones)
+    for tombstone in tombstones:
+        estimate_id = tombstone['estimateId']
+        statuses[estimate_id] = (500, 'Delete was not processed.') if estimate_id in failed else (204, None)
+    # An id listed again was already deleted by its first entry, like a repeated DELETE
+    results = []
+    seen = set()
+    for estimate_id in estimate_ids:
+        status = (404, 'Not Found') if estimate_id in seen else statuses[estimate_id]
+        seen.add(estimate_id)
+        results.append(batch_result(estimate_id, *status))
+    return results
+
+def batch_save(store, entries, requester_id, requester_name):
+    """Saves estimates in bulk, refusing to overwrite other owners' items; returns per-item results.
+
+    Results are reported under the ids the client sent. Entries for the same link collapse into
+    one write of the last of them.
+    """
+    if not all(isinstance(entry, dict) and isinstance(entry.get('id'), str) and entry['id'] for entry in entries):
+        raise BadRequest("Every item must be an object with a non-empty 'id'.")
+    client_ids = [entry['id'] for entry in entries]
+    if len(set(client_ids)) != len(client_ids):
+        raise BadRequest('Duplicate ids in batch.')
+    items = {}
+    keys = []
+    for entry in entries:
+        item = build_item(entry, requester_id, requester_name)
+        items[item['estimateId']] = item
+        keys.append(item['estimateId'])
+    estimate_ids = [item['estimateId'] for item in items.values()]
+    owners = store.get_owners(estimate_ids)
+    statuses = {}
+    writable = []
+    for estimate_id, item in items.items():
+        if estimate_id in owners and owners[estimate_id] != requester_id:
+            statuses[estimate_id] = (403, 'Forbidden: You can only overwrite your own estimates.')
+        else:
+            writable.append(item)
+    failed = store.put_items(writable)
+    for item in writable:
+        estimate_id = item['estimateId']
+        statuses[estimate_id] = (500, 'Save was not processed.') if estimate_id in failed else (201, None)
+    return [batch_result(client_id, *statuses[key]) for client_id, key in zip(client_ids, keys)]
+
+def plan_dedup(items):
+    """Plans collapsing live estimates that share an estimate_key() into one stored under that key.
+
+    Returns (items to write, tombstones for the rest). The newest duplicate's content wins;
+    estimates saved under a client id before keys were derived move to their key.
+    """
+    groups = {}
+    for item in items:
+        if item.get('ownerId') and isinstance(item.get('url'), str) and item['url'].strip():
+            groups.setdefault(estimate_key(item['ownerId'], item['url']), []).append(item)
+    writes, tombstones = [], []
+    for key, group in groups.items():
+        newest = max(group, key=lambda item: (item.get('lastModified') or 0, item['estimateId'] == key))
+        if newest['estimateId'] != key:
+            moved = dict(newest, estimateId=key, lastModified=now_ms())
+            moved.update(derived_attributes(moved))
+            writes.append(moved)
+        tombstones += [build_tombstone(item['estimateId'], item['ownerId']) for item in group if item['estimateId'] != key]
+    return writes, tombstones
+
+def is_live(item):
+    """True for a stored estimate, False for a tombstone, a bookkeeping item or no item at all."""
+    return bool(item) and bool(item.get('ownerId')) and not item.get('deleted')
+
+def stats_deltas(changes):
+    """Turns (old item or None, new item or None) pairs into per-owner stat changes.
+
+    Returns {ownerId: {'estimateCount', 'annualCostCents', 'lastSavedMs', 'ownerName'}}; the last two
+    are None unless the owner saved something.
+    """
+    deltas = {}
+
+    def delta(owner_id):
+        return deltas.setdefault(owner_id, {'estimateCount': 0, 'annualCostCents': 0, 'lastSavedMs': None, 'ownerName': None})
+
+    for old, new in changes:
+        if is_live(old):
+            entry = delta(old['ownerId'])
+            entry['estimateCount'] -= 1
+            entry['annualCostCents'] -= int(old.get('annualCostCents') or 0)
+        if is_live(new):
+            entry = delta(new['ownerId'])
+            entry['estimateCount'] += 1
+            entry['annualCostCents'] += int(new.get('annualCostCents') or 0)
+            entry['lastSavedMs'] = max(entry['lastSavedMs'] or 0, int(new['lastModified']))
+            entry['ownerName'] = new.get('ownerName')
+    return {owner_id: entry for owner_id, entry in deltas.items()
+            if entry['estimateCount'] or entry['annualCostCents'] or entry['lastSavedMs']}
+
+def compute_stats(items):
+    """Per-owner stats from scratch, for rebuild jobs; items need ownerId, ownerName, annualCostCents and lastModified."""
+    stats = {}
+    for item in items:
+        if not is_live(item):
+            continue
+        entry = stats.setdefault(item['ownerId'], {'ownerId': item['ownerId'], 'ownerName': item.get('ownerName'),
+                                                   'estimateCount': 0, 'annualCostCents': 0, 'lastSavedMs': 0})
+        entry['estimateCount'] += 1
+        entry['annualCostCents'] += int(item.get('annualCostCents') or 0)
+        if int(item.get('lastModified') or 0) >= entry['lastSavedMs']:
+            entry['lastSavedMs'] = int(item.get('lastModified') or 0)
+            entry['ownerName'] = item.get('ownerName') or entry['ownerName']
+    return list(stats.values())
+
+def batch_result(estimate_id, status, error):
+    """Formats one entry of a batch route's per-item results."""
+    result = {'id': estimate_id, 'status': status}
+    if error:
+        result['error'] = error
+    return result
+
+class LocalBlobWriter:
+    """Streams a blob to a temporary file and moves it into place on close."""
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f'{path}.partial'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(self.temp_path, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+class LocalBlobStore:
+    """Filesystem blob store, used when no bucket is configured (self-hosted and offline runs)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def open_writer(self, key):
+        return LocalBlobWriter(os.path.join(self.root, key))
+
+    def retrieval_url(self, key):
+        return 'file://' + os.path.abspath(os.path.join(self.root, key))
+
+    def read(self, key):
+        """Returns the blob's bytes, or None if there is no such blob."""
+        try:
+            with open(os.path.join(self.root, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+class S3BlobWriter:
+    """Streams a blob to S3 as a multipart upload, one part per PART_SIZE bytes written."""
+    PART_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.PART_SIZE:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=part_number, Body=bytes(self.buffer))
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.upload_id is None:
+            # Small blobs never started a multipart upload
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            self._upload_part()
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+class S3BlobStore:
+    """S3 blob store; retrieval is through time-limited presigned URLs."""
+
+    def __init__(self, bucket):
+        import boto3 # Only the Lambda deployment needs boto3
+        self.bucket = bucket
+        self.client = boto3.client('s3')
+
+    def open_writer(self, key):
+        return S3BlobWriter(self.client, self.bucket, key)
+
+    def retrieval_url(self, key):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                                  ExpiresIn=EXPORT_URL_TTL_SECONDS)
+
+    def read(self, key):
+        """Returns the object's bytes, or None if there is no such object (needs s3:ListBucket to tell)."""
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+_blob_store = None
+
+def get_blob_store():
+    """Creates the blob store on first use, so routes that never need it don't pay for an S3 client."""
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = S3BlobStore(BLOB_BUCKET) if BLOB_BUCKET else LocalBlobStore(BLOB_DIR)
+    return _blob_store
+
+def serialize_export_rows(items, export_format):
+    """Renders a batch of estimates as CSV rows or NDJSON lines."""
+    if export_format == 'ndjson':
+        return ''.join(json.dumps({column: item.get(column) for column in EXPORT_COLUMNS}, default=json_default) + '\n'
+                       for item in items).encode('utf-8')
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([[item.get(column, '') for column in EXPORT_COLUMNS] for item in items])
+    return buffer.getvalue().encode('utf-8')
+
+def export_estimates(store, export_format):
+    """Writes every live estimate to the blob store as the store scans them; returns a retrieval handle."""
+    export_id = uuid.uuid4().hex
+    key = f'exports/{export_id}.{export_format}'
+    writer = get_blob_store().open_writer(key)
+    write_lock = threading.Lock()
+    if export_format == 'csv':
+        writer.write(serialize_export_rows([dict(zip(EXPORT_COLUMNS, EXPORT_COLUMNS))], 'csv'))
+
+    def write_items(items):
+        # Stores may scan in parallel, so serialization happens outside the lock
+        chunk = serialize_export_rows(items, export_format)
+        with write_lock:
+            writer.write(chunk)
+
+    try:
+        item_count = store.scan_for_export(EXPORT_COLUMNS, write_items)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+    return {
+        'exportId': export_id,
+        'format': export_format,
+        'itemCount': item_count,
+        'url': get_blob_store().retrieval_url(key)
+    }
+
+def archive_key(owner_id):
+    return f"{ARCHIVE_PREFIX}{quote(owner_id, safe='')}.json.gz"
+
+def read_archive(owner_id, blob_store=None):
+    """Loads an owner's archived estimates as {estimateId: item}; empty if they have none."""
+    data = (blob_store or get_blob_store()).read(archive_key(owner_id))
+    if data is None:
+        return {}
+    return {item['estimateId']: item for item in json.loads(gzip.decompress(data))}
+
+def write_archive(owner_id, archive, blob_store=None):
+    """Replaces an owner's archive blob with the estimates in `archive`."""
+    writer = (blob_store or get_blob_store()).open_writer(archive_key(owner_id))
+    writer.write(gzip.compress(json.dumps(list(archive.values()), separators=(',', ':'), default=json_default).encode('utf-8')))
+    writer.close()
+
+def saved_at_ms(item):
+    """When an estimate was saved; estimates without a parseable timestamp fall back to their last change."""
+    return item.get('timestampMs') or item.get('lastModified') or 0
+
+def archive_owner(store, owner_id, items, blob_store=None):
+    """Moves one owner's estimates into their archive blob, then out of the hot table; returns the ids moved.
+
+    The blob is written first, so a failure never loses an estimate. Estimates changed since they
+    were read stay in the table and are dropped from the archive again.
+    """
+    archive = read_archive(owner_id, blob_store)
+    for item in items:
+        archive[item['estimateId']] = {name: value for name, value in item.items() if name != 'syncBucket'}
+    write_archive(owner_id, archive, blob_store)
+    retired = store.retire_items(items)
+    changed = [item['estimateId'] for item in items if item['estimateId'] not in retired]
+    if changed:
+        for estimate_id in changed:
+            archive.pop(estimate_id, None)
+        write_archive(owner_id, archive, blob_store)
+    return retired
+
+def archive_estimates(store, items, older_than_days, blob_store=None, workers=4):
+    """Archives the live estimates in `items` saved more than `older_than_days` ago, owners in parallel.
+
+    Returns the number of estimates moved out of the hot table.
+    """
+    cutoff_ms = now_ms() - older_than_days * 24 * 3600 * 1000
+    by_owner = {}
+    for item in items:
+        if item.get('ownerId') and not item.get('deleted') and saved_at_ms(item) < cutoff_ms:
+            by_owner.setdefault(item['ownerId'], []).append(item)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        moved = sum(len(retired) for retired in pool.map(
+            lambda owner: archive_owner(store, owner, by_owner[owner], blob_store), list(by_owner)))
+    if moved:
+        store.bump_collection_version()
+    return moved
+
+def list_archived(owner_id, query, fields, compact):
+    """GET /estimates?archived=true: one owner's archived estimates, newest first, read from their blob."""
+    with request_metrics.timed('store'):
+        items = sorted(read_archive(owner_id).values(), key=lambda item: (saved_at_ms(item), item['estimateId']), reverse=True)
+    if fields:
+        items = [{field: item[field] for field in fields if field in item} for item in items]
+    if 'limit' in query or 'cursor' in query:
+        offset = decode_cursor(query['cursor']).get('offset', 0) if query.get('cursor') else 0
+        if not isinstance(offset, int) or offset < 0:
+            raise BadRequest('Invalid cursor.')
+        end = offset + parse_limit(query.get('limit'))
+        page = items[offset:end]
+        return {'items': to_compact(page, fields) if compact else page,
+                'nextCursor': encode_cursor({'offset': end}) if end < len(items) else None}
+    return to_compact(items, fields) if compact else items
+
+def restore_archived(store, estimate_ids, requester_id):
+    """Moves the requester's archived estimates back into the hot table; returns per-item results."""
+    if not all(isinstance(estimate_id, str) and estimate_id for estimate_id in estimate_ids):
+        raise BadRequest('ids must be non-empty strings.')
+    unique_ids = list(dict.fromkeys(estimate_ids))
+    archive = read_archive(requester_id)
+    live = store.get_owners([estimate_id for estimate_id in unique_ids if estimate_id in archive])
+    statuses = {}
+    restored = []
+    for estimate_id in unique_ids:
+        if estimate_id not in archive:
+            statuses[estimate_id] = (404, 'Not Found')
+        elif estimate_id in live:
+            # The link was saved again after it was archived; the archived copy is kept
+            statuses[estimate_id] = (409, 'A live estimate with this id already exists.')
+        else:
+            item = dict(archive[estimate_id], lastModified=now_ms(), syncBucket=SYNC_BUCKET)
+            item.update(derived_attributes(item))
+            restored.append(item)
+    failed = store.put_items(restored)
+    for item in restored:
+        estimate_id = item['estimateId']
+        if estimate_id in failed:
+            statuses[estimate_id] = (500, 'Restore was not processed.')
+        else:
+            statuses[estimate_id] = (201, None)
+            del archive[estimate_id]
+    if len(restored) > len(failed):
+        write_archive(requester_id, archive)
+    return [batch_result(estimate_id, *statuses[estimate_id]) for estimate_id in estimate_ids]
+
+# Paths with their own resources, which an /estimates/{id} path parameter must not swallow
+FIXED_ESTIMATE_PATHS = ('/estimates/export', '/estimates/stats')
+
+# REST APIs send version 1.0 proxy events, with the x-api-key header already checked against the
+# usage plan and resolved to requestContext.identity.apiKeyId. HTTP APIs and Function URLs send
+# version 2.0 events and check no key, so their users are stored under hash_api_key(key) instead.
+def hash_api_key(api_key):
+    """Key-hash deployments store users under a hash of their API key, never the key itself."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+def normalize_event(event):
+    """Rewrites a version 2.0 event in the 1.0 shape the router reads; 1.0 events pass through unchanged."""
+    if event.get('version') != '2.0':
+        return event
+    context = event.get('requestContext') or {}
+    path = unquote(event.get('rawPath') or '/')
+    stage = context.get('stage')
+    if stage and stage != '$default' and path.startswith(f'/{stage}/'):
+        path = path[len(stage) + 1:]
+    # A Function URL, or an HTTP API's catch-all route, has no path parameters of its own
+    path_parameters = event.get('pathParameters')
+    if not path_parameters and path.startswith('/estimates/') and path not in FIXED_ESTIMATE_PATHS:
+        path_parameters = {'id': path[len('/estimates/'):]}
+    api_key = get_header(event, 'x-api-key')
+    return {
+        'httpMethod': context.get('http', {}).get('method', ''),
+        'path': path,
+        'headers': event.get('headers') or {},
+        'queryStringParameters': event.get('queryStringParameters'),
+        'pathParameters': path_parameters,
+        'body': event.get('body'),
+        'isBase64Encoded': event.get('isBase64Encoded', False),
+        'requestContext': {
+            'requestId': context.get('requestId'),
+            'identity': {'apiKeyId': hash_api_key(api_key) if api_key else None}
+        }
+    }
+
+# Paths the router serves; anything else is labelled 'unmatched' so scanners can't mint metric labels
+ROUTE_PATHS = {'/estimates', '/estimates/stats', '/estimates/export', '/estimates:batchDelete',
+               '/estimates:batchSave', '/estimates:restore'}
+
+def route_name(event):
+    """Labels the request for metrics, with estimate ids replaced by a placeholder."""
+    http_method = event.get('httpMethod', '')
+    if event.get('pathParameters') and 'id' in event['pathParameters']:
+        return f"{http_method} /estimates/{{id}}"
+    if event.get('path', '') in ROUTE_PATHS:
+        return f"{http_method} {event['path']}"
+    return 'unmatched'
+
+def handle(event, store):
+    """Serves one proxy event (payload version 1.0 or 2.0) against `store`, compressing the response when asked.
+
+    Emits one metrics record per request (see request_metrics.py).
+    """
+    event = normalize_event(event)
+    request_id = event.get('requestContext', {}).get('requestId')
+    with request_metrics.track(route_name(event), request_id) as metrics:
+        response = route_request(event, store)
+        with request_metrics.timed('serialize'):
+            response = compress_response(event, response)
+        metrics.status_code = response['statusCode']
+        if request_metrics.SERVER_TIMING_ENABLED:
+            response = dict(response, headers=dict(response.get('headers') or {}, **{
+                'Server-Timing': metrics.server_timing(),
+                'Timing-Allow-Origin': '*'
+            }))
+    return response
+
+def route_request(event, store):
+    try:
+        http_method = event['httpMethod']
+        path = event['path']
+
+        # Handle CORS preflight requests before any user lookup; they carry no API key
+        if http_method == 'OPTIONS':
+            return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
+
+        # --- User Identification ---
+        api_key_id = event.get('requestContext', {}).get('identity', {}).get('apiKeyId')
+        if not api_key_id:
+            return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Forbidden: Missing API Key ID.'})}
+
+        with request_metrics.timed('auth'):
+            user = store.get_user(api_key_id)
+        if not user:
+            return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f"Forbidden: No user found for the provided API Key."})}
+
+        requester_id = user.get('userId')
+        requester_name = user.get('displayName')
+
+        # --- Route: GET /estimates ---
+        if http_method == 'GET' and path == '/estimates':
+            started_ms = now_ms()
+            query = event.get('queryStringParameters') or {}
+            # owner=me (or owner=<userId>) lists a single owner's estimates via the index
+            owner_id = requester_id if query.get('owner') == 'me' else query.get('owner')
+            # since=<epoch ms> returns only changes, with deletions as tombstones
+            since = parse_since(query.get('since'))
+            if since is not None and since < started_ms - TOMBSTONE_TTL_SECONDS * 1000:
+                return {'statusCode': 410, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'since is older than the tombstone retention window; list again without since.'})}
+            # fields=a,b,... projects items; format=compact returns a header row plus value rows
+            fields = parse_fields(query.get('fields'))
+            compact = parse_format(query.get('format'))
+            if compact and not fields:
+                fields = list(PROJECTABLE_FIELDS)
+            if fields and since is not None:
+                fields.append('deleted') # Tombstones must stay recognisable
+            # sort=cost|name|timestamp, order=asc|desc, minCost/maxCost (dollars) and namePrefix
+            view = parse_view(query)
+            if view and since is not None:
+                raise BadRequest('sort and filters cannot be combined with since.')
+
+            # archived=true lists one owner's archive tier (the requester's unless owner= is given)
+            archived = query.get('archived') == 'true'
+            if archived and (since is not None or view):
+                raise BadRequest('archived cannot be combined with since or sort and filter parameters.')
+            if archived:
+                owner_id = owner_id or requester_id
+
+            # Conditional GET: read the version first and skip the listing if the client is current
+            etag = make_etag(store.get_collection_version(), query, owner_id)
+            headers = dict(CORS_HEADERS, ETag=etag)
+            if etag_matches(get_header(event, 'if-none-match'), etag):
+                return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+            if archived:
+                body = list_archived(owner_id, query, fields, compact)
+            elif 'limit' in query or 'cursor' in query or since is not None:
+                # Paginated mode: one bounded read per request, continuation via an opaque cursor
+                if 'limit' in query or 'cursor' in query:
+                    items, next_cursor = store.read_page(parse_limit(query.get('limit')), query.get('cursor'), owner_id, since, fields, view)
+                else:
+                    items, next_cursor = store.read_all(owner_id, since, fields), None
+                # Clients pass the first page's syncToken as `since` on their next sync
+                body = {'items': to_compact(items, fields) if compact else items, 'nextCursor': next_cursor, 'syncToken': started_ms - SYNC_OVERLAP_MS}
+            else:
+                # Legacy mode: the full list as a bare array
+                items = store.read_all(owner_id, fields=fields, view=view)
+                body = to_compact(items, fields) if compact else items
+            with request_metrics.timed('serialize'):
+                body = json.dumps(body, default=json_default)
+            return {'statusCode': 200, 'headers': dict(headers, **{'Content-Type': 'application/json'}), 'body': body}
+
+        # --- Route: GET /estimates/stats ---
+        elif http_method == 'GET' and path == '/estimates/stats':
+            # Per-owner counts and totals come from the maintained stats, never from the estimates
+            query = event.get('queryStringParameters') or {}
+            owner_id = requester_id if query.get('owner') == 'me' else query.get('owner')
+            etag = make_etag(store.get_collection_version(), query, owner_id)
+            headers = dict(CORS_HEADERS, ETag=etag)
+            if etag_matches(get_header(event, 'if-none-match'), etag):
+                return {'statusCode': 304, 'headers': headers, 'body': ''}
+            owners = sorted((entry for entry in store.get_stats(owner_id) if entry['estimateCount'] > 0 or entry['ownerId'] == owner_id),
+                            key=lambda entry: ((entry.get('ownerName') or '').lower(), entry['ownerId']))
+            if owner_id:
+                owners = [entry for entry in owners if entry['ownerId'] == owner_id]
+            body = {
+                'owners': owners,
+                'totals': {
+                    'estimateCount': sum(entry['estimateCount'] for entry in owners),
+                    'annualCostCents': sum(entry['annualCostCents'] for entry in owners)
+                }
+            }
+            with request_metrics.timed('serialize'):
+                body = json.dumps(body, default=json_default)
+            return {'statusCode': 200, 'headers': dict(headers, **{'Content-Type': 'application/json'}), 'body': body}
+
+        # --- Route: GET /estimates/export ---
+        elif http_method == 'GET' and path == '/estimates/export':
+            query = event.get('queryStringParameters') or {}
+            export_format = query.get('format', 'csv')
+            if export_format not in ('csv', 'ndjson'):
+                raise BadRequest("format must be 'csv' or 'ndjson'.")
+            export_handle = export_estimates(store, export_format)
+            return {'statusCode': 200, 'headers': dict(CORS_HEADERS, **{'Content-Type': 'application/json'}), 'body': json.dumps(export_handle)}
+
+        # --- Route: POST /estimates ---
+        elif http_method == 'POST' and path == '/estimates':
+            body = read_body(event)
+            if 'id' not in body:
+                 return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': 'Missing required fields'}
+
+            # Enrich item with owner info
+            item_to_save = build_item(body, requester_id, requester_name)
+
+            # Saving a link again overwrites its estimate in place; the write is conditional so an
+            # id-only save can't replace someone else's estimate
+            if not store.put_item(item_to_save):
+                return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Forbidden: You can only overwrite your own estimates.'})}
+            store.bump_collection_version()
+            return {'statusCode': 201, 'headers': CORS_HEADERS, 'body': 'Estimate saved'}
+
+        # --- Route: POST /estimates:batchDelete ---
+        elif http_method == 'POST' and path == '/estimates:batchDelete':
+            body = read_body(event)
+            results = batch_delete(store, parse_batch(body, 'ids'), requester_id)
+            if any(result['status'] == 204 for result in results):
+                store.bump_collection_version()
+            return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'results': results})}
+
+        # --- Route: POST /estimates:batchSave ---
+        elif http_method == 'POST' and path == '/estimates:batchSave':
+            body = read_body(event)
+            results = batch_save(store, parse_batch(body, 'items'), requester_id, requester_name)
+            if any(result['status'] == 201 for result in results):
+                store.bump_collection_version()
+            return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'results': results})}
+
+        # --- Route: POST /estimates:restore ---
+        elif http_method == 'POST' and path == '/estimates:restore':
+            body = read_body(event)
+            results = restore_archived(store, parse_batch(body, 'ids'), requester_id)
+            if any(result['status'] == 201 for result in results):
+                store.bump_collection_version()
+            return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'results': results})}
+
+        # --- Route: DELETE /estimates/{id} ---
+        elif http_method == 'DELETE' and event.get('pathParameters') and 'id' in event['pathParameters']:
+            estimate_id_to_delete = event['pathParameters']['id']
+
+            # The store checks ownership and swaps in a tombstone atomically, so delta-sync
+            # clients learn about the deletion
+            outcome = store.delete_item(estimate_id_to_delete, requester_id)
+            if outcome == 'not_found':
+                return {'statusCode': 404, 'headers': CORS_HEADERS, 'body': 'Not Found'}
+            if outcome == 'forbidden':
+                return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Forbidden: You can only delete your own estimates.'})}
+
+            store.bump_collection_version()
+            return {'statusCode': 204, 'headers': CORS_HEADERS, 'body': ''}
+
+        else:
+            return {'statusCode': 404, 'headers': CORS_HEADERS, 'body': 'Not Found'}
+
+    except BadRequest as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+    except Exception as e:
+        print(f"Error: {e}")
+        request_metrics.record_error(e)
+        return {
+            'statusCode': 500,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': str(e)})
+        }
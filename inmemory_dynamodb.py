@@ -0,0 +1,786 @@
+# filename: inmemory_dynamodb.py
+# description: An in-memory stand-in for the slice of the boto3 DynamoDB API that dynamodb_store.py
+#              uses, with DynamoDB-style capacity accounting. Tables follow the resource API;
+#              InMemoryDynamoDB.client() adds the low-level client on top. Used by
+#              benchmark_handler.py to run the real handler without AWS.
+
+import bisect
+import random
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from decimal import Decimal
+
+# ======================================================================================
+# ERRORS
+# ======================================================================================
+
+class ClientError(Exception):
+    """Mirrors botocore's ClientError: the details live in .response."""
+
+    def __init__(self, code, message, item=None):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.response = {'Error': {'Code': code, 'Message': message}}
+        if item is not None:
+            self.response['Item'] = item
+
+class ConditionalCheckFailedException(ClientError):
+    def __init__(self, item=None):
+        super().__init__('ConditionalCheckFailedException', 'The conditional request failed', item)
+
+class _Exceptions:
+    ClientError = ClientError
+    ConditionalCheckFailedException = ConditionalCheckFailedException
+
+class _Client:
+    exceptions = _Exceptions
+
+class _Meta:
+    client = _Client
+
+# ======================================================================================
+# VALUES AND SIZES
+# ======================================================================================
+
+def normalize(value):
+    """Converts Python numbers to Decimal, as boto3 requires on the way in and returns on the way out."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    return value
+
+def clone(value):
+    """Copies an item so callers can't mutate the stored one. Items are mostly flat, so this beats deepcopy."""
+    if isinstance(value, dict):
+        return {k: clone(v) if isinstance(v, (dict, list, set)) else v for k, v in value.items()}
+    if isinstance(value, list):
+        return [clone(v) for v in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+def to_wire(item):
+    """Low-level AttributeValue form, which is how errors carry items even through the resource API."""
+    def convert(value):
+        if isinstance(value, bool):
+            return {'BOOL': value}
+        if value is None:
+            return {'NULL': True}
+        if isinstance(value, (int, float, Decimal)):
+            return {'N': str(value)}
+        if isinstance(value, dict):
+            return {'M': {k: convert(v) for k, v in value.items()}}
+        if isinstance(value, list):
+            return {'L': [convert(v) for v in value]}
+        if isinstance(value, set):
+            return {'SS': sorted(value)}
+        return {'S': str(value)}
+    return {k: convert(v) for k, v in item.items()}
+
+def from_wire(item):
+    """Native form of a low-level AttributeValue map, with numbers as Decimal."""
+    def convert(attribute):
+        (kind, value), = attribute.items()
+        if kind == 'N':
+            return Decimal(value)
+        if kind == 'NULL':
+            return None
+        if kind == 'M':
+            return from_wire(value)
+        if kind == 'L':
+            return [convert(v) for v in value]
+        if kind == 'SS':
+            return set(value)
+        return value
+    return {k: convert(v) for k, v in item.items()}
+
+def value_size(value):
+    """Approximates DynamoDB's per-attribute size rules."""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return len(str(value).lstrip('-').replace('.', '')) // 2 + 2
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode('utf-8')) + value_size(v) for k, v in value.items())
+    if isinstance(value, (list, set)):
+        return 3 + sum(value_size(v) for v in value)
+    return len(str(value))
+
+def item_size(item):
+    return sum(len(k.encode('utf-8')) + value_size(v) for k, v in item.items()) if item else 0
+
+# Query and Scan stop after evaluating this much data, even without a Limit
+MAX_PAGE_BYTES = 1024 * 1024
+
+def read_units(size, consistent):
+    """Reads cost one unit per 4 KB (rounded up); eventually consistent reads cost half."""
+    units = max(1, -(-size // 4096))
+    return units if consistent else units / 2
+
+def write_units(size):
+    """Writes cost one unit per 1 KB (rounded up)."""
+    return max(1, -(-size // 1024))
+
+# ======================================================================================
+# EXPRESSIONS
+# ======================================================================================
+
+TOKEN_RE = re.compile(r'\s*(<>|<=|>=|=|<|>|\(|\)|,|\+|-|[#:]?[A-Za-z_][A-Za-z0-9_]*)')
+
+def tokenize(expression):
+    tokens, position = [], 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_RE.match(expression, position)
+        if not match:
+            raise ClientError('ValidationException', f"Invalid expression near: {expression[position:]}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+def comparable(a, b):
+    if a is None or b is None:
+        return False
+    numbers = (int, float, Decimal)
+    return (isinstance(a, numbers) and isinstance(b, numbers)) or type(a) == type(b)
+
+COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: comparable(a, b) and a < b,
+    '<=': lambda a, b: comparable(a, b) and a <= b,
+    '>': lambda a, b: comparable(a, b) and a > b,
+    '>=': lambda a, b: comparable(a, b) and a >= b,
+}
+
+class ExpressionParser:
+    """Recursive-descent parser for condition, filter and update expressions over top-level attributes."""
+
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = normalize(values or {})
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def is_keyword(self, keyword):
+        token = self.peek()
+        return token is not None and token.upper() == keyword
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and (token is None or token.upper() != expected):
+            raise ClientError('ValidationException', f"Expected {expected} but found {token}")
+        self.position += 1
+        return token
+
+    def attribute(self):
+        token = self.take()
+        if token.startswith('#'):
+            if token not in self.names:
+                raise ClientError('ValidationException', f"Undefined attribute name {token}")
+            return self.names[token]
+        return token
+
+    def value(self):
+        token = self.take()
+        if token not in self.values:
+            raise ClientError('ValidationException', f"Undefined attribute value {token}")
+        return self.values[token]
+
+    def operand(self):
+        if self.peek().startswith(':'):
+            value = self.value()
+            return lambda item: value
+        if self.peek() == 'size' and self.peek(1) == '(':
+            self.take()
+            self.take('(')
+            name = self.attribute()
+            self.take(')')
+            return lambda item: Decimal(len(item[name])) if name in item else None
+        name = self.attribute()
+        return lambda item: item.get(name)
+
+    def condition(self):
+        left = self.conjunction()
+        while self.is_keyword('OR'):
+            self.take()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, self.conjunction())
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.is_keyword('AND'):
+            self.take()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, self.negation())
+        return left
+
+    def negation(self):
+        if self.is_keyword('NOT'):
+            self.take()
+            inner = self.negation()
+            return lambda item: not inner(item)
+        return self.predicate()
+
+    def predicate(self):
+        token = self.peek()
+        if token == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+        if token in ('attribute_exists', 'attribute_not_exists', 'begins_with', 'contains') and self.peek(1) == '(':
+            self.take()
+            self.take('(')
+            name = self.attribute()
+            if token in ('attribute_exists', 'attribute_not_exists'):
+                self.take(')')
+                return (lambda item: name in item) if token == 'attribute_exists' else (lambda item: name not in item)
+            self.take(',')
+            operand = self.operand()
+            self.take(')')
+            if token == 'begins_with':
+                return lambda item: isinstance(item.get(name), str) and item[name].startswith(operand(item))
+            return lambda item: name in item and operand(item) in item[name]
+        left = self.operand()
+        operator = self.take()
+        if operator.upper() == 'BETWEEN':
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda item: COMPARISONS['>='](left(item), low(item)) and COMPARISONS['<='](left(item), high(item))
+        if operator.upper() == 'IN':
+            self.take('(')
+            options = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return lambda item: any(left(item) == option(item) for option in options)
+        if operator not in COMPARISONS:
+            raise ClientError('ValidationException', f"Unsupported operator {operator}")
+        right = self.operand()
+        compare = COMPARISONS[operator]
+        return lambda item: compare(left(item), right(item))
+
+    def key_condition(self):
+        """Parses 'hash = :v [AND range <op> :v | BETWEEN | begins_with]' into (hash_value, range_bounds)."""
+        self.attribute()
+        self.take('=')
+        hash_value = self.value()
+        if not self.is_keyword('AND'):
+            return hash_value, None
+        self.take('AND')
+        if self.peek() == 'begins_with':
+            self.take()
+            self.take('(')
+            self.attribute()
+            self.take(',')
+            prefix = self.value()
+            self.take(')')
+            return hash_value, ('begins_with', prefix)
+        self.attribute()
+        operator = self.take()
+        if operator.upper() == 'BETWEEN':
+            low = self.value()
+            self.take('AND')
+            return hash_value, ('between', low, self.value())
+        return hash_value, (operator, self.value())
+
+    def apply_update(self, item):
+        clause = None
+        while self.peek() is not None:
+            if self.peek().upper() in ('SET', 'ADD', 'REMOVE', 'DELETE'):
+                clause = self.take().upper()
+                continue
+            if self.peek() == ',':
+                self.take()
+                continue
+            name = self.attribute()
+            if clause == 'SET':
+                self.take('=')
+                value = self.update_value(item)
+                if self.peek() in ('+', '-'):
+                    operator = self.take()
+                    other = self.update_value(item)
+                    value = value + other if operator == '+' else value - other
+                item[name] = value
+            elif clause == 'ADD':
+                value = self.value()
+                if isinstance(value, set):
+                    item[name] = set(item.get(name, set())) | value
+                else:
+                    item[name] = item.get(name, Decimal(0)) + value
+            elif clause == 'REMOVE':
+                item.pop(name, None)
+            elif clause == 'DELETE':
+                item[name] = set(item.get(name, set())) - self.value()
+            else:
+                raise ClientError('ValidationException', 'Update expression must start with SET, ADD, REMOVE or DELETE')
+
+    def update_value(self, item):
+        if self.peek() == 'if_not_exists':
+            self.take()
+            self.take('(')
+            name = self.attribute()
+            self.take(',')
+            default = self.value()
+            self.take(')')
+            return item[name] if name in item else default
+        if self.peek().startswith(':'):
+            return self.value()
+        return item.get(self.attribute())
+
+def compile_condition(expression, names, values):
+    return ExpressionParser(expression, names, values).condition() if expression else None
+
+def project(item, expression, names):
+    if not expression:
+        return clone(item)
+    projected = {}
+    for part in expression.split(','):
+        name = part.strip()
+        name = (names or {}).get(name, name)
+        if name in item:
+            projected[name] = clone(item[name])
+    return projected
+
+# ======================================================================================
+# TABLES
+# ======================================================================================
+
+class _Top:
+    """Sorts after every key value, so (hash, _TOP) bounds the end of a partition."""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+_TOP = _Top()
+
+class Table:
+    """A table plus its global secondary indexes, each kept as a sorted list of key tuples."""
+
+    def __init__(self, database, name, key_schema, indexes):
+        self.database = database
+        self.name = name
+        self.table_name = name
+        self.meta = _Meta
+        self.hash_key, self.range_key = key_schema
+        self.key_attributes = (self.hash_key,) + ((self.range_key,) if self.range_key else ())
+        self.indexes = indexes # index name -> (hash attribute, range attribute or None)
+        self.items = {} # primary key tuple -> item
+        self.orders = {None: []}
+        self.orders.update({name: [] for name in indexes})
+        self.lock = threading.RLock()
+
+    def primary_key(self, key):
+        try:
+            return tuple(normalize(key[name]) for name in self.key_attributes)
+        except KeyError as e:
+            raise ClientError('ValidationException', f"Missing key attribute {e}")
+
+    def order_entry(self, item, index_name):
+        """Position of an item in the base table or an index; None if the index doesn't include it."""
+        primary = tuple(item[name] for name in self.key_attributes)
+        if index_name is None:
+            return primary
+        hash_name, range_name = self.indexes[index_name]
+        if hash_name not in item or (range_name and range_name not in item):
+            return None # Sparse index
+        return (item[hash_name],) + ((item[range_name],) if range_name else ()) + (primary,)
+
+    def start_entry(self, start_key, index_name):
+        return self.order_entry(normalize(start_key), index_name)
+
+    def store(self, primary, new_item):
+        """Replaces (or with None, removes) an item, keeping every ordering in step.
+
+        Returns the extra write units that the global secondary indexes consume.
+        """
+        old_item = self.items.get(primary)
+        index_units = 0
+        for index_name, order in self.orders.items():
+            old_entry = self.order_entry(old_item, index_name) if old_item else None
+            new_entry = self.order_entry(new_item, index_name) if new_item else None
+            if old_entry == new_entry and (index_name is None or old_entry is None):
+                continue
+            if old_entry is not None and old_entry != new_entry:
+                del order[bisect.bisect_left(order, old_entry)]
+            if new_entry is not None and old_entry != new_entry:
+                bisect.insort(order, new_entry)
+            if index_name is not None:
+                # A key change is a delete plus a put on the index; anything else is one index write
+                changes = (old_entry is not None) + (new_entry is not None) if old_entry != new_entry else 1
+                index_units += changes * write_units(item_size(new_item or old_item))
+        if new_item is None:
+            self.items.pop(primary, None)
+        else:
+            self.items[primary] = new_item
+        return index_units
+
+    def check_condition(self, existing, expression, names, values, return_on_failure):
+        condition = compile_condition(expression, names, values)
+        if condition and not condition(existing or {}):
+            old_item = to_wire(existing) if return_on_failure == 'ALL_OLD' and existing else None
+            raise ConditionalCheckFailedException(old_item)
+
+    def respond(self, response, return_consumed_capacity, units):
+        if return_consumed_capacity in ('TOTAL', 'INDEXES'):
+            response['ConsumedCapacity'] = {'TableName': self.name, 'CapacityUnits': units}
+        return response
+
+    def get_item(self, Key, ConsistentRead=False, ProjectionExpression=None, ExpressionAttributeNames=None,
+                 ReturnConsumedCapacity=None, **kwargs):
+        with self.lock:
+            item = self.items.get(self.primary_key(Key))
+            units = read_units(item_size(item), ConsistentRead)
+            self.database.record('GetItem', read=units)
+            response = {'Item': project(item, ProjectionExpression, ExpressionAttributeNames)} if item else {}
+        return self.respond(response, ReturnConsumedCapacity, units)
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                 ReturnValues=None, ReturnValuesOnConditionCheckFailure=None, ReturnConsumedCapacity=None, **kwargs):
+        item = normalize(Item)
+        primary = self.primary_key(item)
+        with self.lock:
+            existing = self.items.get(primary)
+            units = write_units(max(item_size(item), item_size(existing)))
+            try:
+                self.check_condition(existing, ConditionExpression, ExpressionAttributeNames,
+                                     ExpressionAttributeValues, ReturnValuesOnConditionCheckFailure)
+            except ConditionalCheckFailedException:
+                self.database.record('PutItem', write=units) # Failed conditions still consume capacity
+                raise
+            units += self.store(primary, clone(item))
+            self.database.record('PutItem', write=units)
+        response = {'Attributes': existing} if ReturnValues == 'ALL_OLD' and existing else {}
+        return self.respond(response, ReturnConsumedCapacity, units)
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ReturnValues=None, ReturnValuesOnConditionCheckFailure=None, ReturnConsumedCapacity=None, **kwargs):
+        primary = self.primary_key(Key)
+        with self.lock:
+            existing = self.items.get(primary)
+            units = write_units(item_size(existing))
+            try:
+                self.check_condition(existing, ConditionExpression, ExpressionAttributeNames,
+                                     ExpressionAttributeValues, ReturnValuesOnConditionCheckFailure)
+            except ConditionalCheckFailedException:
+                self.database.record('DeleteItem', write=units)
+                raise
+            if existing:
+                units += self.store(primary, None)
+            self.database.record('DeleteItem', write=units)
+        response = {'Attributes': existing} if ReturnValues == 'ALL_OLD' and existing else {}
+        return self.respond(response, ReturnConsumedCapacity, units)
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None, ReturnValuesOnConditionCheckFailure=None,
+                    ReturnConsumedCapacity=None, **kwargs):
+        primary = self.primary_key(Key)
+        with self.lock:
+            existing = self.items.get(primary)
+            try:
+                self.check_condition(existing, ConditionExpression, ExpressionAttributeNames,
+                                     ExpressionAttributeValues, ReturnValuesOnConditionCheckFailure)
+            except ConditionalCheckFailedException:
+                self.database.record('UpdateItem', write=write_units(item_size(existing)))
+                raise
+            item = clone(existing) if existing else dict(zip(self.key_attributes, primary))
+            ExpressionParser(UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues).apply_update(item)
+            units = write_units(max(item_size(item), item_size(existing)))
+            units += self.store(primary, item)
+            self.database.record('UpdateItem', write=units)
+        if ReturnValues in ('ALL_NEW', 'UPDATED_NEW'):
+            response = {'Attributes': clone(item)}
+        elif ReturnValues in ('ALL_OLD', 'UPDATED_OLD') and existing:
+            response = {'Attributes': existing}
+        else:
+            response = {}
+        return self.respond(response, ReturnConsumedCapacity, units)
+
+    def read(self, operation, entries, index_name, limit, filter_expression, names, values, projection_expression,
+             select, consistent, return_consumed_capacity):
+        """Shared tail of Query and Scan: evaluate up to `limit` entries or 1 MB, then filter and project.
+
+        `entries` is an iterator, so a page near the start of a large table costs only that page.
+        """
+        rows, size, more = [], 0, False
+        for entry in entries:
+            if (limit and len(rows) >= limit) or size >= MAX_PAGE_BYTES:
+                more = True
+                break
+            row = self.items[entry if index_name is None else entry[-1]]
+            rows.append(row)
+            size += item_size(row)
+        units = read_units(size, consistent)
+        self.database.record(operation, read=units)
+        keep = compile_condition(filter_expression, names, values)
+        matched = [row for row in rows if keep is None or keep(row)]
+        response = {'Count': len(matched), 'ScannedCount': len(rows)}
+        if select != 'COUNT':
+            response['Items'] = [project(row, projection_expression, names) for row in matched]
+        if more:
+            last = rows[-1]
+            key = {name: last[name] for name in self.key_attributes}
+            if index_name is not None:
+                key.update({name: last[name] for name in self.indexes[index_name] if name})
+            response['LastEvaluatedKey'] = key
+        return self.respond(response, return_consumed_capacity, units)
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, ExclusiveStartKey=None, FilterExpression=None,
+              ExpressionAttributeNames=None, ExpressionAttributeValues=None, ProjectionExpression=None,
+              ScanIndexForward=True, Select=None, ConsistentRead=False, ReturnConsumedCapacity=None, **kwargs):
+        hash_value, bounds = ExpressionParser(KeyConditionExpression, ExpressionAttributeNames,
+                                              ExpressionAttributeValues).key_condition()
+        with self.lock:
+            order = self.orders[IndexName]
+            low = bisect.bisect_left(order, (hash_value,))
+            high = bisect.bisect_left(order, (hash_value, _TOP))
+            prefix = None
+            if bounds:
+                operator, *operands = bounds
+                if operator in ('>', '>='):
+                    low = bisect.bisect_right(order, (hash_value, operands[0], _TOP)) if operator == '>' else bisect.bisect_left(order, (hash_value, operands[0]), low, high)
+                elif operator in ('<', '<='):
+                    high = bisect.bisect_left(order, (hash_value, operands[0]), low, high) if operator == '<' else bisect.bisect_right(order, (hash_value, operands[0], _TOP), low, high)
+                elif operator == 'between':
+                    low = bisect.bisect_left(order, (hash_value, operands[0]), low, high)
+                    high = bisect.bisect_right(order, (hash_value, operands[1], _TOP), low, high)
+                elif operator == '=':
+                    low = bisect.bisect_left(order, (hash_value, operands[0]), low, high)
+                    high = bisect.bisect_right(order, (hash_value, operands[0], _TOP), low, high)
+                elif operator == 'begins_with':
+                    low = bisect.bisect_left(order, (hash_value, operands[0]), low, high)
+                    prefix = operands[0]
+            if ExclusiveStartKey:
+                start = self.start_entry(ExclusiveStartKey, IndexName)
+                if ScanIndexForward:
+                    low = max(low, bisect.bisect_right(order, start))
+                else:
+                    high = min(high, bisect.bisect_left(order, start))
+            positions = range(low, high) if ScanIndexForward else range(high - 1, low - 1, -1)
+            entries = (order[position] for position in positions)
+            if prefix is not None:
+                entries = (entry for entry in entries if entry[1].startswith(prefix))
+            return self.read('Query', entries, IndexName, Limit, FilterExpression, ExpressionAttributeNames,
+                             ExpressionAttributeValues, ProjectionExpression, Select, ConsistentRead, ReturnConsumedCapacity)
+
+    def scan(self, IndexName=None, Limit=None, ExclusiveStartKey=None, FilterExpression=None, ExpressionAttributeNames=None,
+             ExpressionAttributeValues=None, ProjectionExpression=None, Segment=None, TotalSegments=None, Select=None,
+             ConsistentRead=False, ReturnConsumedCapacity=None, **kwargs):
+        with self.lock:
+            order = self.orders[IndexName]
+            start = bisect.bisect_right(order, self.start_entry(ExclusiveStartKey, IndexName)) if ExclusiveStartKey else 0
+            entries = (order[position] for position in range(start, len(order)))
+            if TotalSegments:
+                # Segments partition by a stable hash of the primary key, like DynamoDB's hash ranges
+                primary_of = (lambda entry: entry) if IndexName is None else (lambda entry: entry[-1])
+                entries = (entry for entry in entries
+                           if zlib.crc32(repr(primary_of(entry)).encode('utf-8')) % TotalSegments == Segment)
+            return self.read('Scan', entries, IndexName, Limit, FilterExpression, ExpressionAttributeNames,
+                             ExpressionAttributeValues, ProjectionExpression, Select, ConsistentRead, ReturnConsumedCapacity)
+
+# ======================================================================================
+# RESOURCE
+# ======================================================================================
+
+class InMemoryDynamoDB:
+    """Stands in for boto3.resource('dynamodb'). Safe to share between threads.
+
+    Every call is tallied by operation in .stats; `with db.capture() as usage:` additionally
+    tallies the calls made by the current thread inside the block.
+    """
+
+    def __init__(self, unprocessed_rate=0.0, seed=None):
+        self.tables = {}
+        self.meta = _Meta
+        # Fraction of batch entries returned as unprocessed, to exercise retry paths
+        self.unprocessed_rate = unprocessed_rate
+        self.random = random.Random(seed)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.local = threading.local()
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=(), **kwargs):
+        def parse_schema(schema):
+            keys = {entry['KeyType']: entry['AttributeName'] for entry in schema}
+            return keys['HASH'], keys.get('RANGE')
+        indexes = {index['IndexName']: parse_schema(index['KeySchema']) for index in GlobalSecondaryIndexes}
+        self.tables[TableName] = Table(self, TableName, parse_schema(KeySchema), indexes)
+        return self.tables[TableName]
+
+    def Table(self, name):
+        if name not in self.tables:
+            raise ClientError('ResourceNotFoundException', f"Requested resource not found: Table: {name} not found")
+        return self.tables[name]
+
+    @staticmethod
+    def tally(totals, operation, read, write):
+        entry = totals.setdefault(operation, {'calls': 0, 'read_units': 0.0, 'write_units': 0.0})
+        entry['calls'] += 1
+        entry['read_units'] += read
+        entry['write_units'] += write
+
+    def record(self, operation, read=0.0, write=0.0):
+        with self.stats_lock:
+            self.tally(self.stats, operation, read, write)
+        usage = getattr(self.local, 'usage', None)
+        if usage is not None:
+            self.tally(usage, operation, read, write)
+
+    @contextmanager
+    def capture(self):
+        usage = {}
+        self.local.usage = usage
+        try:
+            yield usage
+        finally:
+            self.local.usage = None
+
+    def client(self):
+        return InMemoryDynamoDBClient(self)
+
+    def unprocessed(self):
+        return self.unprocessed_rate and self.random.random() < self.unprocessed_rate
+
+    def batch_get_item(self, RequestItems, ReturnConsumedCapacity=None, **kwargs):
+        responses, unprocessed, consumed = {}, {}, []
+        total_units = 0
+        for table_name, request in RequestItems.items():
+            if len(request['Keys']) > 100:
+                raise ClientError('ValidationException', 'Too many items requested for the BatchGetItem call')
+            table = self.Table(table_name)
+            found, deferred, units = [], [], 0
+            with table.lock:
+                for key in request['Keys']:
+                    if self.unprocessed():
+                        deferred.append(key)
+                        continue
+                    item = table.items.get(table.primary_key(key))
+                    units += read_units(item_size(item), request.get('ConsistentRead', False))
+                    if item:
+                        found.append(project(item, request.get('ProjectionExpression'), request.get('ExpressionAttributeNames')))
+            responses[table_name] = found
+            if deferred:
+                unprocessed[table_name] = dict(request, Keys=deferred)
+            consumed.append({'TableName': table_name, 'CapacityUnits': units})
+            total_units += units
+        self.record('BatchGetItem', read=total_units)
+        response = {'Responses': responses, 'UnprocessedKeys': unprocessed}
+        if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+            response['ConsumedCapacity'] = consumed
+        return response
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity=None, **kwargs):
+        unprocessed, consumed = {}, []
+        total_units = 0
+        for table_name, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise ClientError('ValidationException', 'Too many items requested for the BatchWriteItem call')
+            table = self.Table(table_name)
+            deferred, units = [], 0
+            with table.lock:
+                for request in requests:
+                    if self.unprocessed():
+                        deferred.append(request)
+                        continue
+                    if 'PutRequest' in request:
+                        item = normalize(request['PutRequest']['Item'])
+                        primary = table.primary_key(item)
+                        units += write_units(max(item_size(item), item_size(table.items.get(primary))))
+                        units += table.store(primary, clone(item))
+                    else:
+                        primary = table.primary_key(request['DeleteRequest']['Key'])
+                        existing = table.items.get(primary)
+                        units += write_units(item_size(existing))
+                        if existing:
+                            units += table.store(primary, None)
+            if deferred:
+                unprocessed[table_name] = deferred
+            consumed.append({'TableName': table_name, 'CapacityUnits': units})
+            total_units += units
+        self.record('BatchWriteItem', write=total_units)
+        response = {'UnprocessedItems': unprocessed}
+        if ReturnConsumedCapacity in ('TOTAL', 'INDEXES'):
+            response['ConsumedCapacity'] = consumed
+        return response
+
+# ======================================================================================
+# LOW-LEVEL CLIENT
+# ======================================================================================
+
+class InMemoryDynamoDBClient:
+    """Stands in for boto3.client('dynamodb'): the same tables, with items in wire format."""
+    exceptions = _Exceptions
+
+    # Request arguments and response fields that carry items, keys or values
+    WIRE_ARGUMENTS = ('Key', 'Item', 'ExclusiveStartKey', 'ExpressionAttributeValues')
+    WIRE_FIELDS = ('Item', 'Attributes', 'LastEvaluatedKey')
+
+    def __init__(self, database):
+        self.database = database
+
+    def table_call(self, method, TableName, **kwargs):
+        for name in self.WIRE_ARGUMENTS:
+            if name in kwargs:
+                kwargs[name] = from_wire(kwargs[name])
+        response = getattr(self.database.Table(TableName), method)(**kwargs)
+        for name in self.WIRE_FIELDS:
+            if name in response:
+                response[name] = to_wire(response[name])
+        if 'Items' in response:
+            response['Items'] = [to_wire(item) for item in response['Items']]
+        return response
+
+    def get_item(self, **kwargs):
+        return self.table_call('get_item', **kwargs)
+
+    def put_item(self, **kwargs):
+        return self.table_call('put_item', **kwargs)
+
+    def delete_item(self, **kwargs):
+        return self.table_call('delete_item', **kwargs)
+
+    def update_item(self, **kwargs):
+        return self.table_call('update_item', **kwargs)
+
+    def query(self, **kwargs):
+        return self.table_call('query', **kwargs)
+
+    def scan(self, **kwargs):
+        return self.table_call('scan', **kwargs)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        request = {name: dict(entry, Keys=[from_wire(key) for key in entry['Keys']])
+                   for name, entry in RequestItems.items()}
+        response = self.database.batch_get_item(RequestItems=request, **kwargs)
+        response['Responses'] = {name: [to_wire(item) for item in items] for name, items in response['Responses'].items()}
+        response['UnprocessedKeys'] = {name: dict(entry, Keys=[to_wire(key) for key in entry['Keys']])
+                                       for name, entry in response['UnprocessedKeys'].items()}
+        return response
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        def convert(request, codec):
+            if 'PutRequest' in request:
+                return {'PutRequest': {'Item': codec(request['PutRequest']['Item'])}}
+            return {'DeleteRequest': {'Key': codec(request['DeleteRequest']['Key'])}}
+        request = {name: [convert(entry, from_wire) for entry in entries] for name, entries in RequestItems.items()}
+        response = self.database.batch_write_item(RequestItems=request, **kwargs)
+        response['UnprocessedItems'] = {name: [convert(entry, to_wire) for entry in entries]
+                                        for name, entries in response['UnprocessedItems'].items()}
+        return response
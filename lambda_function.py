@@ -0,0 +1,31 @@
+# filename: lambda_function.py
+# description: AWS Lambda entry point. API Gateway has already validated the API key; the shared
+#              router in estimates_api.py does the rest against DynamoDB.
+
+import os
+import random
+
+from dynamodb_store import DynamoDBStore
+from estimates_api import handle
+
+# Module-level so it (and its user cache) survives across warm invocations. Its DynamoDB client
+# is built here, during the init phase, so SnapStart snapshots and provisioned concurrency
+# include it; the S3 client is only created by the export route (see get_blob_store).
+# MIGRATION_TARGET_TABLE is only set during a migrate.py dual-write window.
+store = DynamoDBStore(os.environ.get('ESTIMATES_TABLE_NAME'), os.environ.get('USERS_TABLE_NAME'),
+                      mirror_table_name=os.environ.get('MIGRATION_TARGET_TABLE'),
+                      mirror_transform=os.environ.get('MIGRATION_TRANSFORM', 'copy'))
+
+try:
+    from snapshot_restore_py import register_after_restore # Only present on SnapStart-enabled runtimes
+except ImportError:
+    register_after_restore = None
+
+if register_after_restore:
+    @register_after_restore
+    def reseed_after_restore():
+        # Every environment restored from one snapshot would otherwise share the retry jitter sequence
+        random.seed()
+
+def handler(event, context):
+    return handle(event, store)
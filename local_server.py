@@ -0,0 +1,496 @@
+# filename: local_server.py
+# description: Self-hosted CalcLinkSaver backend. Serves the same /estimates REST contract as the
+#              AWS deployment from a single process, storing estimates and users in SQLite.
+
+import argparse
+import json
+import queue
+import secrets
+import sqlite3
+import time
+import uuid
+from base64 import b64decode
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import request_metrics
+from estimates_api import (ARCHIVE_AFTER_DAYS, archive_estimates, BadRequest, build_tombstone, compute_stats, decode_cursor,
+                           derived_attributes, encode_cursor, FIXED_ESTIMATE_PATHS, handle, hash_api_key, plan_dedup,
+                           SORT_ATTRIBUTES, stats_deltas)
+
+# ======================================================================================
+# SCRIPT CONFIGURATION
+# ======================================================================================
+DEFAULT_DB_PATH = "calclinksaver.db"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# SQLite connections shared by the request threads. WAL lets readers run alongside the writer.
+DEFAULT_POOL_SIZE = 8
+# Rows fetched per round trip when streaming an export
+EXPORT_FETCH_SIZE = 500
+# Ids per SELECT when reading what a batch write replaces (older SQLite allows 999 parameters)
+LOOKUP_CHUNK_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS estimates (
+    estimateId   TEXT PRIMARY KEY,
+    ownerId      TEXT,
+    timestamp    TEXT,
+    lastModified INTEGER NOT NULL,
+    deleted      INTEGER NOT NULL DEFAULT 0,
+    expiresAt    INTEGER,
+    item         TEXT NOT NULL,
+    annualCostCents INTEGER,
+    timestampMs     INTEGER,
+    nameLower       TEXT
+);
+CREATE INDEX IF NOT EXISTS estimates_owner_timestamp ON estimates (ownerId, timestamp, estimateId);
+CREATE INDEX IF NOT EXISTS estimates_last_modified ON estimates (lastModified, estimateId);
+CREATE TABLE IF NOT EXISTS users (
+    apiKeyId    TEXT PRIMARY KEY,
+    userId      TEXT NOT NULL,
+    displayName TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS owner_stats (
+    ownerId         TEXT PRIMARY KEY,
+    ownerName       TEXT,
+    estimateCount   INTEGER NOT NULL DEFAULT 0,
+    annualCostCents INTEGER NOT NULL DEFAULT 0,
+    lastSavedMs     INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# The derived sort columns (see derived_attributes in estimates_api.py). Databases created before
+# they existed get them added, and backfilled, at startup.
+SORT_COLUMNS = {'annualCostCents': 'INTEGER', 'timestampMs': 'INTEGER', 'nameLower': 'TEXT'}
+SORT_INDEX_SCHEMA = """
+CREATE INDEX IF NOT EXISTS estimates_cost ON estimates (annualCostCents, estimateId) WHERE annualCostCents IS NOT NULL;
+CREATE INDEX IF NOT EXISTS estimates_name ON estimates (nameLower, estimateId) WHERE nameLower IS NOT NULL;
+CREATE INDEX IF NOT EXISTS estimates_timestamp_ms ON estimates (timestampMs, estimateId) WHERE timestampMs IS NOT NULL;
+"""
+
+def project(item, fields):
+    """Applies a fields= projection to a stored item."""
+    return {field: item[field] for field in fields if field in item} if fields else item
+
+# ======================================================================================
+# SQLITE STORE
+# ======================================================================================
+
+class ConnectionPool:
+    """A fixed set of SQLite connections handed out to one thread at a time."""
+
+    def __init__(self, db_path, size):
+        # Every connection to ':memory:' would open its own empty database
+        if db_path == ':memory:':
+            size = 1
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(self._connect(db_path))
+
+    @staticmethod
+    def _connect(db_path):
+        # Autocommit mode; writes open their own transactions with BEGIN IMMEDIATE
+        conn = sqlite3.connect(db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # Each checkout counts as one store call; the time includes waiting for a free connection
+        started = time.perf_counter()
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+            request_metrics.record_store_call(time.perf_counter() - started)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+class SQLiteStore:
+    """Estimates, users and the collection version in one SQLite database (see estimates_api.py)."""
+
+    def __init__(self, db_path, pool_size=DEFAULT_POOL_SIZE):
+        self.pool = ConnectionPool(db_path, pool_size)
+        with self.pool.connection() as conn:
+            has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'owner_stats'").fetchone()
+            conn.executescript(SCHEMA)
+        self.add_sort_columns()
+        with self.pool.connection() as conn:
+            conn.executescript(SORT_INDEX_SCHEMA)
+        self.purge_expired_tombstones()
+        if not has_stats:
+            # Databases created before the stats table existed start from a full count
+            self.rebuild_stats()
+
+    def add_sort_columns(self):
+        """Adds any missing sort columns and fills them, and the stored items, from existing estimates."""
+        with self.pool.transaction() as conn:
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(estimates)')}
+            missing = [column for column in SORT_COLUMNS if column not in existing]
+            if not missing:
+                return
+            for column in missing:
+                conn.execute(f'ALTER TABLE estimates ADD COLUMN {column} {SORT_COLUMNS[column]}')
+            rows = conn.execute('SELECT estimateId, item FROM estimates WHERE deleted = 0').fetchall()
+            updates = []
+            for estimate_id, raw in rows:
+                item = json.loads(raw)
+                item.update(derived_attributes(item))
+                updates.append((item.get('annualCostCents'), item.get('timestampMs'), item.get('nameLower'),
+                                json.dumps(item), estimate_id))
+            conn.executemany('UPDATE estimates SET annualCostCents = ?, timestampMs = ?, nameLower = ?, item = ? '
+                             'WHERE estimateId = ?', updates)
+            # Items gained attributes, so cached list ETags must stop matching
+            conn.execute("INSERT INTO meta (name, value) VALUES ('version', 1) "
+                         "ON CONFLICT (name) DO UPDATE SET value = value + 1")
+        print(f"🔧  Added sort columns and backfilled {len(updates)} estimate(s).")
+
+    def purge_expired_tombstones(self):
+        """SQLite has no TTL, so expired tombstones are removed at startup and hidden from reads."""
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM estimates WHERE deleted = 1 AND expiresAt <= ?', (int(time.time()),))
+
+    def add_user(self, display_name):
+        """Creates a user and returns (userId, apiKey). Only the key's hash is stored."""
+        user_id = str(uuid.uuid4())
+        api_key = secrets.token_urlsafe(30)
+        with self.pool.transaction() as conn:
+            conn.execute('INSERT INTO users (apiKeyId, userId, displayName) VALUES (?, ?, ?)',
+                         (hash_api_key(api_key), user_id, display_name))
+        return user_id, api_key
+
+    def get_user(self, api_key_id):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT userId, displayName FROM users WHERE apiKeyId = ?', (api_key_id,)).fetchone()
+        return {'userId': row[0], 'displayName': row[1]} if row else None
+
+    def list_query(self, owner_id, since, start_key, view=None):
+        """Builds the SELECT for one listing mode, resuming after start_key (a decoded cursor) if given."""
+        try:
+            if view:
+                return self.view_query(owner_id, start_key, view)
+            if since is not None:
+                # Delta mode: everything changed after `since`, unexpired tombstones included, oldest change first
+                sql = 'SELECT item, lastModified, estimateId FROM estimates WHERE lastModified > ? AND (expiresAt IS NULL OR expiresAt > ?)'
+                params = [since, int(time.time())]
+                if owner_id:
+                    sql += ' AND ownerId = ?'
+                    params.append(owner_id)
+                if start_key:
+                    sql += ' AND (lastModified, estimateId) > (?, ?)'
+                    params += [int(start_key['lastModified']), str(start_key['estimateId'])]
+                return sql + ' ORDER BY lastModified, estimateId', params, ('lastModified', 'estimateId')
+            if owner_id:
+                # Owner mode: newest first on the owner/timestamp index; like the DynamoDB index it skips untimestamped items
+                sql = 'SELECT item, timestamp, estimateId FROM estimates WHERE ownerId = ? AND deleted = 0 AND timestamp IS NOT NULL'
+                params = [owner_id]
+                if start_key:
+                    sql += ' AND (timestamp, estimateId) < (?, ?)'
+                    params += [str(start_key['timestamp']), str(start_key['estimateId'])]
+                return sql + ' ORDER BY timestamp DESC, estimateId DESC', params, ('timestamp', 'estimateId')
+            sql = 'SELECT item, estimateId FROM estimates WHERE deleted = 0'
+            params = []
+            if start_key:
+                sql += ' AND estimateId > ?'
+                params.append(str(start_key['estimateId']))
+            return sql + ' ORDER BY estimateId', params, ('estimateId',)
+        except (KeyError, TypeError, ValueError):
+            raise BadRequest('Invalid cursor.')
+
+    @staticmethod
+    def view_query(owner_id, start_key, view):
+        """Sorted and filtered listing; like the DynamoDB indexes it skips rows without the sort column."""
+        column = SORT_ATTRIBUTES[view['sort']]
+        sql = f'SELECT item, {column}, estimateId FROM estimates WHERE deleted = 0 AND {column} IS NOT NULL'
+        params = []
+        if owner_id:
+            sql += ' AND ownerId = ?'
+            params.append(owner_id)
+        if view['min_cost'] is not None:
+            sql += ' AND annualCostCents >= ?'
+            params.append(view['min_cost'])
+        if view['max_cost'] is not None:
+            sql += ' AND annualCostCents <= ?'
+            params.append(view['max_cost'])
+        if view['name_prefix'] is not None:
+            sql += ' AND substr(nameLower, 1, ?) = ?'
+            params += [len(view['name_prefix']), view['name_prefix']]
+        direction = 'DESC' if view['descending'] else 'ASC'
+        if start_key:
+            sql += f" AND ({column}, estimateId) {'<' if view['descending'] else '>'} (?, ?)"
+            value = start_key[column]
+            params += [str(value) if column == 'nameLower' else int(value), str(start_key['estimateId'])]
+        return sql + f' ORDER BY {column} {direction}, estimateId {direction}', params, (column, 'estimateId')
+
+    def read_page(self, limit, cursor, owner_id=None, since=None, fields=None, view=None):
+        sql, params, key_columns = self.list_query(owner_id, since, decode_cursor(cursor) if cursor else None, view)
+        with self.pool.connection() as conn:
+            # One extra row tells whether another page exists
+            rows = conn.execute(sql + ' LIMIT ?', params + [limit + 1]).fetchall()
+        next_cursor = encode_cursor(dict(zip(key_columns, rows[limit - 1][1:]))) if len(rows) > limit else None
+        return [project(json.loads(row[0]), fields) for row in rows[:limit]], next_cursor
+
+    def read_all(self, owner_id=None, since=None, fields=None, view=None):
+        sql, params, _ = self.list_query(owner_id, since, None, view)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [project(json.loads(row[0]), fields) for row in rows]
+
+    def get_collection_version(self):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def bump_collection_version(self):
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT INTO meta (name, value) VALUES ('version', 1) "
+                         "ON CONFLICT (name) DO UPDATE SET value = value + 1")
+
+    def get_stats(self, owner_id=None):
+        query = 'SELECT ownerId, ownerName, estimateCount, annualCostCents, lastSavedMs FROM owner_stats'
+        with self.pool.connection() as conn:
+            rows = (conn.execute(query + ' WHERE ownerId = ?', (owner_id,)) if owner_id else conn.execute(query)).fetchall()
+        return [dict(zip(('ownerId', 'ownerName', 'estimateCount', 'annualCostCents', 'lastSavedMs'), row)) for row in rows]
+
+    def replace_stats(self, owner_stats):
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM owner_stats')
+            conn.executemany('INSERT INTO owner_stats (ownerId, ownerName, estimateCount, annualCostCents, lastSavedMs) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             [(entry['ownerId'], entry['ownerName'], entry['estimateCount'], entry['annualCostCents'],
+                               entry['lastSavedMs']) for entry in owner_stats])
+
+    def rebuild_stats(self):
+        """Recounts every owner's stats from the estimates table; returns how many owners have estimates."""
+        with self.pool.connection() as conn:
+            items = [json.loads(row[0]) for row in conn.execute('SELECT item FROM estimates WHERE deleted = 0')]
+        owner_stats = compute_stats(items)
+        self.replace_stats(owner_stats)
+        # Stats responses carry the collection version's ETag
+        self.bump_collection_version()
+        return len(owner_stats)
+
+    @staticmethod
+    def _apply_stats(conn, deltas):
+        conn.executemany(
+            'INSERT INTO owner_stats (ownerId, ownerName, estimateCount, annualCostCents, lastSavedMs) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (ownerId) DO UPDATE SET estimateCount = estimateCount + excluded.estimateCount, '
+            'annualCostCents = annualCostCents + excluded.annualCostCents, '
+            'ownerName = COALESCE(excluded.ownerName, ownerName), lastSavedMs = MAX(lastSavedMs, excluded.lastSavedMs)',
+            [(owner_id, delta['ownerName'], delta['estimateCount'], delta['annualCostCents'], delta['lastSavedMs'] or 0)
+             for owner_id, delta in deltas.items()]
+        )
+
+    @staticmethod
+    def _write(conn, items):
+        """Writes items and adjusts the owner stats for what they replace, inside the caller's transaction."""
+        ids = list({item['estimateId'] for item in items})
+        old_items = {}
+        for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+            chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+            rows = conn.execute(f"SELECT estimateId, ownerId, deleted, annualCostCents FROM estimates "
+                                f"WHERE estimateId IN ({', '.join('?' * len(chunk))})", chunk)
+            old_items.update({row[0]: dict(zip(('estimateId', 'ownerId', 'deleted', 'annualCostCents'), row)) for row in rows})
+        # Only the last write of a repeated id sticks
+        written = {item['estimateId']: item for item in items}
+        SQLiteStore._apply_stats(conn, stats_deltas((old_items.get(estimate_id), item) for estimate_id, item in written.items()))
+        conn.executemany(
+            'INSERT OR REPLACE INTO estimates (estimateId, ownerId, timestamp, lastModified, deleted, expiresAt, item, '
+            'annualCostCents, timestampMs, nameLower) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(item['estimateId'], item.get('ownerId'), item.get('timestamp'), item['lastModified'],
+              1 if item.get('deleted') else 0, item.get('expiresAt'), json.dumps(item),
+              item.get('annualCostCents'), item.get('timestampMs'), item.get('nameLower')) for item in items]
+        )
+
+    def put_item(self, item):
+        with self.pool.transaction() as conn:
+            row = conn.execute('SELECT ownerId FROM estimates WHERE estimateId = ? AND deleted = 0',
+                               (item['estimateId'],)).fetchone()
+            if row and row[0] != item['ownerId']:
+                return False
+            self._write(conn, [item])
+        return True
+
+    def put_items(self, items):
+        # One transaction either writes everything or raises, so nothing is ever left unprocessed
+        with self.pool.transaction() as conn:
+            self._write(conn, items)
+        return set()
+
+    def delete_item(self, estimate_id, requester_id):
+        with self.pool.transaction() as conn:
+            row = conn.execute('SELECT ownerId, deleted FROM estimates WHERE estimateId = ?', (estimate_id,)).fetchone()
+            if not row or row[1]:
+                return 'not_found'
+            if row[0] != requester_id:
+                return 'forbidden'
+            self._write(conn, [build_tombstone(estimate_id, requester_id)])
+        return 'deleted'
+
+    def retire_items(self, items):
+        with self.pool.transaction() as conn:
+            retired = set()
+            for item in items:
+                row = conn.execute('SELECT lastModified FROM estimates WHERE estimateId = ? AND deleted = 0',
+                                   (item['estimateId'],)).fetchone()
+                if row and row[0] == item['lastModified']:
+                    retired.add(item['estimateId'])
+            self._write(conn, [build_tombstone(item['estimateId'], item['ownerId']) for item in items
+                               if item['estimateId'] in retired])
+        return retired
+
+    def collapse_duplicates(self, dry_run=False):
+        """Leaves one estimate per owner and link (see plan_dedup); returns (estimates rewritten, estimates removed)."""
+        with self.pool.transaction() as conn:
+            items = [json.loads(row[0]) for row in conn.execute('SELECT item FROM estimates WHERE deleted = 0')]
+            writes, tombstones = plan_dedup(items)
+            if not dry_run and (writes or tombstones):
+                self._write(conn, writes + tombstones)
+                conn.execute("INSERT INTO meta (name, value) VALUES ('version', 1) "
+                             "ON CONFLICT (name) DO UPDATE SET value = value + 1")
+        return len(writes), len(tombstones)
+
+    def archive_old_estimates(self, older_than_days):
+        """Moves estimates saved more than older_than_days ago to the archive under BLOB_DIR; returns how many."""
+        with self.pool.connection() as conn:
+            items = [json.loads(row[0]) for row in conn.execute('SELECT item FROM estimates WHERE deleted = 0')]
+        return archive_estimates(self, items, older_than_days)
+
+    def get_owners(self, estimate_ids):
+        placeholders = ', '.join('?' * len(estimate_ids))
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'SELECT estimateId, ownerId FROM estimates WHERE deleted = 0 AND estimateId IN ({placeholders})',
+                                list(estimate_ids)).fetchall()
+        return dict(rows)
+
+    def scan_for_export(self, columns, write_items):
+        count = 0
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT item FROM estimates WHERE deleted = 0 ORDER BY estimateId')
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    return count
+                write_items([project(json.loads(row[0]), columns) for row in rows])
+                count += len(rows)
+
+# ======================================================================================
+# HTTP SERVER
+# ======================================================================================
+
+class EstimatesRequestHandler(BaseHTTPRequestHandler):
+    """Translates HTTP requests into the API Gateway proxy events that estimates_api.handle expects."""
+    protocol_version = 'HTTP/1.1'
+    store = None # Set by serve()
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def do_OPTIONS(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else None
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        path_parameters = None
+        if path.startswith('/estimates/') and path not in FIXED_ESTIMATE_PATHS:
+            path_parameters = {'id': path[len('/estimates/'):]}
+        # API Gateway resolves the x-api-key header to an apiKeyId; here the key's hash plays that role
+        api_key = self.headers.get('x-api-key')
+        event = {
+            'httpMethod': self.command,
+            'path': path,
+            'headers': dict(self.headers.items()),
+            'queryStringParameters': query or None,
+            'pathParameters': path_parameters,
+            'body': body,
+            'isBase64Encoded': False,
+            'requestContext': {
+                'requestId': str(uuid.uuid4()),
+                'identity': {'apiKeyId': hash_api_key(api_key)} if api_key else {}
+            }
+        }
+        response = handle(event, self.store)
+
+        payload = response.get('body') or ''
+        payload = b64decode(payload) if response.get('isBase64Encoded') else payload.encode('utf-8')
+        self.send_response(response['statusCode'])
+        for name, value in (response.get('headers') or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def serve(store, host, port):
+    EstimatesRequestHandler.store = store
+    server = ThreadingHTTPServer((host, port), EstimatesRequestHandler)
+    print(f"🚀  CalcLinkSaver backend listening on http://{host}:{port}/estimates")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋  Shutting down.")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the CalcLinkSaver backend locally on SQLite.")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help=f"SQLite database file (default: {DEFAULT_DB_PATH})")
+    subcommands = parser.add_subparsers(dest='command')
+    serve_parser = subcommands.add_parser('serve', help="Serve the /estimates API (the default)")
+    serve_parser.add_argument('--host', default=DEFAULT_HOST)
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE)
+    add_user_parser = subcommands.add_parser('add-user', help="Create a user and print their API key")
+    add_user_parser.add_argument('display_name')
+    dedupe_parser = subcommands.add_parser('dedupe', help="Collapse saves of the same link into one estimate per owner")
+    dedupe_parser.add_argument('--dry-run', action='store_true', help="Only report what would change")
+    archive_parser = subcommands.add_parser('archive', help="Move old estimates to the per-owner archive under BLOB_DIR")
+    archive_parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                                help=f"Archive estimates saved more than this many days ago (default: {ARCHIVE_AFTER_DAYS})")
+    subcommands.add_parser('rebuild-stats', help="Recount the per-owner stats behind GET /estimates/stats")
+    args = parser.parse_args()
+
+    if args.command == 'add-user':
+        user_id, api_key = SQLiteStore(args.db, pool_size=1).add_user(args.display_name)
+        print(f"✅  User '{args.display_name}' created with ID: {user_id}")
+        print(f"🔑  API Key: {api_key}")
+        print("    Store it now; only a hash of the key is kept.")
+    elif args.command == 'dedupe':
+        rewritten, removed = SQLiteStore(args.db, pool_size=1).collapse_duplicates(args.dry_run)
+        verb = 'would be' if args.dry_run else 'were'
+        print(f"✅  {removed} estimate(s) {verb} replaced by tombstones and {rewritten} {verb} rewritten under their link's key.")
+    elif args.command == 'archive':
+        moved = SQLiteStore(args.db, pool_size=1).archive_old_estimates(args.older_than_days)
+        print(f"✅  Archived {moved} estimate(s) saved more than {args.older_than_days} days ago.")
+    elif args.command == 'rebuild-stats':
+        owners = SQLiteStore(args.db, pool_size=1).rebuild_stats()
+        print(f"✅  Recounted the stats of {owners} owner(s) from their estimates.")
+    else:
+        serve(SQLiteStore(args.db, getattr(args, 'pool_size', DEFAULT_POOL_SIZE)),
+              getattr(args, 'host', DEFAULT_HOST), getattr(args, 'port', DEFAULT_PORT))
@@ -0,0 +1,262 @@
+# filename: maintenance.py
+# description: One-off maintenance jobs against a deployed backend's DynamoDB tables.
+#
+# Usage:
+#   python3 maintenance.py --suffix abc123 backfill-sort-keys [--dry-run]
+#   python3 maintenance.py --suffix abc123 collapse-duplicates [--dry-run]
+#   python3 maintenance.py --suffix abc123 archive [--older-than-days 180]
+#   python3 maintenance.py --suffix abc123 rebuild-stats
+#
+# backfill-sort-keys  Adds the derived annualCostCents, timestampMs and nameLower attributes (see
+#                     derived_attributes in estimates_api.py) to estimates saved before the API
+#                     started storing them, so they appear in GET /estimates?sort=... listings.
+#                     Safe to re-run: estimates that are already up to date are not written.
+# collapse-duplicates Leaves one estimate per owner and link (see plan_dedup in estimates_api.py),
+#                     stored under the key that saves now write to. The others are replaced by
+#                     tombstones, so syncing clients drop them, and expire with the tombstone TTL.
+# archive             Moves estimates saved more than --older-than-days ago out of the table into
+#                     one compressed archive blob per owner in the deployment's S3 bucket. Users
+#                     list them with GET /estimates?archived=true and bring them back with
+#                     POST /estimates:restore.
+# rebuild-stats       Recounts the per-owner stats behind GET /estimates/stats from the estimates
+#                     themselves. Writes keep the stats up to date, but a failed or racing write can
+#                     leave them off; run this when they drift, ideally while few people are saving.
+#
+# Needs estimates_api.py, dynamodb_store.py and request_metrics.py next to it.
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from dynamodb_store import backoff, call, DynamoDBStore, LIVE_ESTIMATES_FILTER, projection
+from estimates_api import (ARCHIVE_AFTER_DAYS, archive_estimates, compute_stats, derived_attributes, estimate_key, now_ms,
+                           plan_dedup, S3BlobStore, saved_at_ms, SORT_ATTRIBUTES)
+
+# ======================================================================================
+# SCRIPT CONFIGURATION
+# ======================================================================================
+# Must match the deployment script's naming
+BASE_NAME = "CalcLinkSaverMultiUser"
+
+# Parallel Scan segments, each read (and its writes issued) by its own thread
+SCAN_SEGMENTS = 4
+# Items per Scan page
+SCAN_PAGE_SIZE = 500
+# Items per BatchWriteItem-backed put_items call, and how many such calls run at once
+WRITE_CHUNK_SIZE = 100
+WRITE_WORKERS = 4
+MAX_ATTEMPTS = 8
+THROTTLING_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+def with_retry(kind, operation, **kwargs):
+    """Runs one DynamoDB call through dynamodb_store.call, backing off while DynamoDB is throttling."""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return call(kind, operation, **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+            backoff(attempt)
+
+def scan_segments(client, table_name, fields, handle_items, **scan_kwargs):
+    """Scans live estimates in SCAN_SEGMENTS parallel segments, passing each page to handle_items.
+
+    fields=None reads whole items.
+    """
+    def scan_segment(segment):
+        kwargs = dict(scan_kwargs, TableName=table_name, Segment=segment, TotalSegments=SCAN_SEGMENTS,
+                      FilterExpression=LIVE_ESTIMATES_FILTER, Limit=SCAN_PAGE_SIZE, **(projection(fields) if fields else {}))
+        while True:
+            response = with_retry('read', client.scan, **kwargs)
+            handle_items(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with ThreadPoolExecutor(max_workers=SCAN_SEGMENTS) as pool:
+        for future in [pool.submit(scan_segment, segment) for segment in range(SCAN_SEGMENTS)]:
+            future.result()
+
+# ======================================================================================
+# BACKFILL SORT KEYS
+# ======================================================================================
+
+def backfill_sort_keys(client, table_name, dry_run):
+    """Brings every live estimate's derived attributes up to date; returns counts of what it did."""
+    derived_names = list(SORT_ATTRIBUTES.values())
+    counts = {'scanned': 0, 'updated': 0, 'unchanged': 0, 'deleted_meanwhile': 0}
+    counts_lock = threading.Lock()
+
+    def update(item):
+        wanted = derived_attributes(item)
+        if all(item.get(name) == wanted.get(name) for name in derived_names):
+            return 'unchanged'
+        if dry_run:
+            return 'updated'
+        stale = [name for name in derived_names if name in item and name not in wanted]
+        expression = 'SET ' + ', '.join(f'{name} = :{name}' for name in wanted) if wanted else ''
+        if stale:
+            expression += ' REMOVE ' + ', '.join(stale)
+        try:
+            # lastModified is left alone: the values are derived, so delta-sync clients needn't re-download
+            with_retry('write', client.update_item, TableName=table_name, Key={'estimateId': item['estimateId']},
+                       UpdateExpression=expression.strip(), ConditionExpression=LIVE_ESTIMATES_FILTER,
+                       **({'ExpressionAttributeValues': {f':{name}': value for name, value in wanted.items()}}
+                          if wanted else {}))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return 'deleted_meanwhile'
+        return 'updated'
+
+    def handle_items(items):
+        outcomes = [update(item) for item in items]
+        with counts_lock:
+            counts['scanned'] += len(items)
+            for outcome in outcomes:
+                counts[outcome] += 1
+            print(f"  ⏳ {counts['scanned']} scanned, {counts['updated']} updated...")
+
+    scan_segments(client, table_name, ['estimateId', 'name', 'annualCost', 'timestamp'] + derived_names, handle_items)
+    return counts
+
+# ======================================================================================
+# COLLAPSE DUPLICATES
+# ======================================================================================
+
+def write_in_chunks(store, items):
+    """Writes items with the store's batched put_items, WRITE_WORKERS chunks at a time; returns unwritten ids."""
+    chunks = [items[start:start + WRITE_CHUNK_SIZE] for start in range(0, len(items), WRITE_CHUNK_SIZE)]
+    failed = set()
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as pool:
+        for chunk_failed in pool.map(store.put_items, chunks):
+            failed |= chunk_failed
+    return failed
+
+def collapse_duplicates(store, dry_run):
+    """Scans every live estimate, then writes the survivors before tombstoning what they replace."""
+    items = []
+    items_lock = threading.Lock()
+
+    def handle_items(page):
+        with items_lock:
+            items.extend(page)
+            print(f"  ⏳ {len(items)} estimates scanned...")
+
+    scan_segments(store.client, store.estimates_table_name, None, handle_items)
+    writes, tombstones = plan_dedup(items)
+    counts = {'scanned': len(items), 'rewritten': len(writes), 'tombstoned': len(tombstones), 'failed': 0}
+    if dry_run or not (writes or tombstones):
+        return counts
+    failed = write_in_chunks(store, writes)
+    # A survivor that failed to write keeps its duplicates, so nothing is lost
+    items_by_id = {item['estimateId']: item for item in items}
+    tombstones = [tombstone for tombstone in tombstones
+                  if estimate_key(tombstone['ownerId'], items_by_id[tombstone['estimateId']]['url']) not in failed]
+    failed |= write_in_chunks(store, tombstones)
+    counts['failed'] = len(failed)
+    # Listings changed, so cached ETags must stop matching
+    store.bump_collection_version()
+    return counts
+
+# ======================================================================================
+# ARCHIVE
+# ======================================================================================
+
+def archive_old(store, older_than_days, blob_store):
+    """Scans for estimates saved before the cutoff and archives them owner by owner; returns (scanned, moved)."""
+    cutoff_ms = now_ms() - older_than_days * 24 * 3600 * 1000
+    candidates = []
+    scanned = [0]
+    lock = threading.Lock()
+
+    def handle_items(page):
+        with lock:
+            scanned[0] += len(page)
+            candidates.extend(item for item in page if saved_at_ms(item) < cutoff_ms)
+            print(f"  ⏳ {scanned[0]} estimates scanned, {len(candidates)} to archive...")
+
+    scan_segments(store.client, store.estimates_table_name, None, handle_items)
+    return scanned[0], archive_estimates(store, candidates, older_than_days, blob_store, workers=WRITE_WORKERS)
+
+# ======================================================================================
+# REBUILD STATS
+# ======================================================================================
+
+def rebuild_stats(store):
+    """Recomputes every owner's stats from a parallel scan and overwrites the per-owner stats items; returns (scanned, stats)."""
+    items = []
+    items_lock = threading.Lock()
+
+    def handle_items(page):
+        with items_lock:
+            items.extend(page)
+            print(f"  ⏳ {len(items)} estimates scanned...")
+
+    scan_segments(store.client, store.estimates_table_name, ['ownerId', 'ownerName', 'annualCostCents', 'lastModified'],
+                  handle_items)
+    owner_stats = compute_stats(items)
+    store.replace_stats(owner_stats)
+    return len(items), owner_stats
+
+# ======================================================================================
+# MAIN
+# ======================================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance jobs for a CalcLinkSaver backend deployment.")
+    parser.add_argument('--suffix', required=True, help="Deployment suffix, e.g. abc123 from CalcLinkSaverMultiUserAPI-abc123")
+    parser.add_argument('--estimates-table', help="Estimates table name, if migrate.py has moved it away from the suffix's default")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill-sort-keys', help="Add sort attributes to estimates saved before they existed")
+    backfill_parser.add_argument('--dry-run', action='store_true', help="Only count the estimates that need updating")
+    collapse_parser = subparsers.add_parser('collapse-duplicates', help="Keep one estimate per owner and link")
+    collapse_parser.add_argument('--dry-run', action='store_true', help="Only count what would be collapsed")
+    archive_parser = subparsers.add_parser('archive', help="Move old estimates to per-owner archive blobs in S3")
+    archive_parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                                help=f"Archive estimates saved more than this many days ago (default: {ARCHIVE_AFTER_DAYS})")
+    subparsers.add_parser('rebuild-stats', help="Recount the per-owner stats behind GET /estimates/stats")
+    args = parser.parse_args()
+
+    estimates_table_name = args.estimates_table or f"{BASE_NAME}Estimates-{args.suffix}"
+    users_table_name = f"{BASE_NAME}Users-{args.suffix}"
+    dynamodb_client = boto3.client('dynamodb')
+    started = time.monotonic()
+
+    if args.command == 'backfill-sort-keys':
+        print(f"🔧 Backfilling sort attributes in '{estimates_table_name}'{' (dry run)' if args.dry_run else ''}...")
+        counts = backfill_sort_keys(dynamodb_client, estimates_table_name, args.dry_run)
+        if counts['updated'] and not args.dry_run:
+            # Listings now include the new attributes, so cached ETags must stop matching
+            DynamoDBStore(estimates_table_name, users_table_name, client=dynamodb_client).bump_collection_version()
+        verb = 'need updating' if args.dry_run else 'updated'
+        print(f"✅ {counts['scanned']} estimates scanned: {counts['updated']} {verb}, {counts['unchanged']} already "
+              f"up to date, {counts['deleted_meanwhile']} deleted during the run ({time.monotonic() - started:.0f}s).")
+    elif args.command == 'collapse-duplicates':
+        print(f"🔧 Collapsing duplicate estimates in '{estimates_table_name}'{' (dry run)' if args.dry_run else ''}...")
+        store = DynamoDBStore(estimates_table_name, users_table_name, client=dynamodb_client)
+        counts = collapse_duplicates(store, args.dry_run)
+        verb = 'would be' if args.dry_run else 'were'
+        print(f"✅ {counts['scanned']} estimates scanned: {counts['tombstoned']} {verb} replaced by tombstones and "
+              f"{counts['rewritten']} {verb} rewritten under their link's key ({time.monotonic() - started:.0f}s).")
+        if counts['failed']:
+            print(f"⚠️  {counts['failed']} writes were throttled out; run the command again to finish.")
+    elif args.command == 'archive':
+        account_id = boto3.client('sts').get_caller_identity()['Account']
+        bucket_name = f"{BASE_NAME.lower()}-data-{args.suffix}-{account_id}"
+        print(f"🗄️  Archiving estimates older than {args.older_than_days} days from '{estimates_table_name}' to s3://{bucket_name}/...")
+        store = DynamoDBStore(estimates_table_name, users_table_name, client=dynamodb_client)
+        scanned, moved = archive_old(store, args.older_than_days, S3BlobStore(bucket_name))
+        print(f"✅ {scanned} estimates scanned, {moved} archived ({time.monotonic() - started:.0f}s).")
+    elif args.command == 'rebuild-stats':
+        print(f"📊 Recounting per-owner stats in '{estimates_table_name}'...")
+        store = DynamoDBStore(estimates_table_name, users_table_name, client=dynamodb_client)
+        scanned, owner_stats = rebuild_stats(store)
+        # Stats responses carry the collection version's ETag
+        store.bump_collection_version()
+        print(f"✅ {scanned} estimates scanned, stats rebuilt for {len(owner_stats)} owner(s) "
+              f"({time.monotonic() - started:.0f}s).")
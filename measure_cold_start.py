@@ -0,0 +1,182 @@
+# filename: measure_cold_start.py
+# description: Measures Lambda cold-start cost. `local` times module init in fresh interpreters,
+#              comparing the DynamoDB resource the function used to build with the low-level
+#              client it builds now. `deployed` forces cold starts of a live function (optionally
+#              at several memory sizes) and reports the Init Duration from its REPORT log lines.
+#
+# Examples:
+#   python3 measure_cold_start.py local --runs 20
+#   python3 measure_cold_start.py deployed --function CalcLinkSaverMultiUserFunction-abc123 --memory 256,512,1024
+#
+# `deployed` invokes $LATEST, so it measures on-demand cold starts even when WARM_POOL is set, and
+# it restores the function's memory size and environment when it finishes.
+
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+# ======================================================================================
+# SCRIPT CONFIGURATION
+# ======================================================================================
+DEFAULT_RUNS = 10
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Module init measured by `local`, each in a fresh interpreter. Both import the shared router.
+LOCAL_VARIANTS = {
+    # What lambda_function.py initialized before it switched to the low-level client
+    'resource': (
+        "import estimates_api, request_metrics\n"
+        "dynamodb = boto3.resource('dynamodb')\n"
+        "dynamodb.Table('Estimates'), dynamodb.Table('Users')\n"
+    ),
+    'client': "import lambda_function\n"
+}
+LOCAL_PROBE = """import json, sys, time
+started = time.perf_counter()
+import boto3
+imported = time.perf_counter()
+{init}
+finished = time.perf_counter()
+print(json.dumps({{'boto3_import_ms': (imported - started) * 1000, 'init_ms': (finished - imported) * 1000,
+                  'module_init_ms': (finished - started) * 1000}}))
+"""
+
+# A preflight request: the handler answers it without touching DynamoDB, so the
+# measured invocation is dominated by init
+PROBE_EVENT = {'httpMethod': 'OPTIONS', 'path': '/estimates', 'headers': {}, 'requestContext': {}}
+
+def log(message):
+    """Progress goes to stderr so stdout carries only the JSON report."""
+    print(message, file=sys.stderr)
+
+def describe(samples):
+    """Median, p90 and extremes of a list of milliseconds."""
+    ordered = sorted(samples)
+    return {
+        'median': round(statistics.median(ordered), 3),
+        'p90': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))], 3),
+        'min': round(ordered[0], 3),
+        'max': round(ordered[-1], 3)
+    }
+
+# ======================================================================================
+# LOCAL
+# ======================================================================================
+
+def measure_local(runs):
+    """Runs each variant's init `runs` times in new processes, interleaved so drift affects both alike."""
+    environment = dict(os.environ, PYTHONPATH=SOURCE_DIR, METRICS_SINK='none')
+    # Creating clients needs a region but no credentials or network access
+    environment.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    environment.setdefault('ESTIMATES_TABLE_NAME', 'Estimates')
+    environment.setdefault('USERS_TABLE_NAME', 'Users')
+    samples = {name: [] for name in LOCAL_VARIANTS}
+    for run in range(runs):
+        for name, init in LOCAL_VARIANTS.items():
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', LOCAL_PROBE.format(init=init)], env=environment,
+                                    cwd=SOURCE_DIR, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output)
+            result['process_ms'] = (time.perf_counter() - started) * 1000
+            samples[name].append(result)
+        log(f"  ⏱️  Run {run + 1}/{runs}")
+    return {name: {metric: describe([result[metric] for result in results]) for metric in results[0]}
+            for name, results in samples.items()}
+
+# ======================================================================================
+# DEPLOYED
+# ======================================================================================
+
+def parse_report(log_tail):
+    """Reads the tab-separated REPORT line, e.g. 'Init Duration: 301.2 ms', into {name: number}."""
+    for line in log_tail.splitlines():
+        if line.startswith('REPORT'):
+            fields = {}
+            for field in line.split('\t')[1:]:
+                name, _, value = field.partition(': ')
+                if value:
+                    fields[name.strip()] = float(value.split()[0])
+            return fields
+    return {}
+
+def measure_deployed(function_name, runs, memory_sizes):
+    import boto3
+    lambda_client = boto3.client('lambda')
+    original = lambda_client.get_function_configuration(FunctionName=function_name)
+    variables = original.get('Environment', {}).get('Variables', {})
+    results = {}
+    try:
+        for memory in memory_sizes or [original['MemorySize']]:
+            reports = []
+            for run in range(runs):
+                # Any configuration change retires the warm environments, so the next invoke is a cold start
+                lambda_client.update_function_configuration(
+                    FunctionName=function_name,
+                    MemorySize=memory,
+                    Environment={'Variables': dict(variables, COLD_START_NONCE=uuid.uuid4().hex)}
+                )
+                lambda_client.get_waiter('function_updated_v2').wait(FunctionName=function_name)
+                response = lambda_client.invoke(FunctionName=function_name, LogType='Tail',
+                                                Payload=json.dumps(PROBE_EVENT).encode('utf-8'))
+                reports.append(parse_report(base64.b64decode(response['LogResult']).decode('utf-8')))
+                log(f"  ⏱️  {memory} MB: cold start {run + 1}/{runs}")
+            cold = [report for report in reports if 'Init Duration' in report]
+            results[str(memory)] = {
+                'cold_starts': len(cold),
+                'init_duration_ms': describe([report['Init Duration'] for report in cold]) if cold else None,
+                'duration_ms': describe([report['Duration'] for report in reports if 'Duration' in report]),
+                'max_memory_used_mb': max(report.get('Max Memory Used', 0) for report in reports)
+            }
+    finally:
+        lambda_client.update_function_configuration(
+            FunctionName=function_name,
+            MemorySize=original['MemorySize'],
+            Environment={'Variables': variables}
+        )
+        log(f"🔁  Restored {function_name} to {original['MemorySize']} MB and its original environment.")
+    return {
+        'function': function_name,
+        'runtime': original.get('Runtime'),
+        'architecture': (original.get('Architectures') or ['x86_64'])[0],
+        'memory_sizes': results
+    }
+
+# ======================================================================================
+# MAIN
+# ======================================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure CalcLinkSaver Lambda import and init times.")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    local_parser = subparsers.add_parser('local', help="Time module init in fresh local interpreters")
+    local_parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    deployed_parser = subparsers.add_parser('deployed', help="Force cold starts of a deployed function")
+    deployed_parser.add_argument('--function', required=True, help="Lambda function name")
+    deployed_parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help="Cold starts per memory size")
+    deployed_parser.add_argument('--memory', type=lambda value: [int(size) for size in value.split(',')],
+                                 help="Comma-separated memory sizes in MB (default: the current one)")
+    args = parser.parse_args()
+
+    if args.command == 'local':
+        log(f"🧪  Timing module init over {args.runs} fresh interpreters per variant...")
+        report = {'measurement': 'local', 'python': platform.python_version(), 'machine': platform.machine(),
+                  'runs': args.runs, 'variants': measure_local(args.runs)}
+    else:
+        log(f"🧪  Forcing {args.runs} cold starts of {args.function} per memory size...")
+        report = dict({'measurement': 'deployed', 'runs': args.runs}, **measure_deployed(args.function, args.runs, args.memory))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"📄  Report written to {args.output}")
+    else:
+        print(output)
@@ -0,0 +1,286 @@
+# filename: migrate.py
+# description: Copies a deployment's estimates table into a new one (for example one created with
+#              a newer schema by deploy_backend_multiuser.py), passing every item through a
+#              transform, while the function keeps serving from the old table.
+#
+# Usage:
+#   python3 migrate.py --source CalcLinkSaverMultiUserEstimates-abc123 --target CalcLinkSaverMultiUserEstimates-abc123-v2
+#                      [--transform copy|derive-sort-keys|module:function] [--segments 8] [--write-capacity 100]
+#
+# A migration without downtime:
+#   1. Set MIGRATION_TARGET_TABLE (and MIGRATION_TRANSFORM) in deploy_backend_multiuser.py and run it
+#      with --update. That creates the target table and starts the dual-write window: the function
+#      keeps reading the source but mirrors every write into the target (see DynamoDBStore.mirror_items).
+#   2. Run this script with the same transform. Each Scan segment copies its share of the table with
+#      BatchWriteItem, recording its position in the checkpoint file after every page, so an
+#      interrupted run resumes where it stopped. A catch-up pass then recopies, from the
+#      LastModifiedIndex, everything changed since the copy began, because a batch write can't be
+#      conditional and may have overwritten a newer mirrored write.
+#   3. Cut over: point ESTIMATES_TABLE_NAME at the target, clear MIGRATION_TARGET_TABLE and --update.
+#
+# Running the script again after it has finished only repeats the catch-up, which resyncs any
+# mirrored write that failed (the function logs those). The copy runs at up to --write-capacity
+# write units per second in total, so more segments only help until that limit is reached.
+#
+# Needs estimates_api.py, dynamodb_store.py, request_metrics.py and maintenance.py next to it.
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from dynamodb_store import (backoff, BATCH_WRITE_CHUNK_SIZE, deserialize_item, DynamoDBStore, LAST_MODIFIED_INDEX_NAME,
+                            load_transform, serialize_item, STATS_ITEM_KEY, stats_item_id, VERSION_ITEM_KEY)
+from estimates_api import now_ms, SYNC_BUCKET, SYNC_OVERLAP_MS
+from maintenance import with_retry
+
+# ======================================================================================
+# SCRIPT CONFIGURATION
+# ======================================================================================
+# Parallel Scan segments, each copied by its own thread
+DEFAULT_SEGMENTS = 8
+# Write capacity units per second the copy may use across all segments
+DEFAULT_WRITE_CAPACITY = 100
+# Items per Scan page; progress is checkpointed after each page has been written
+SCAN_PAGE_SIZE = 200
+# Attempts at a chunk's unprocessed items before the run stops (it can be resumed)
+BATCH_MAX_ATTEMPTS = 10
+# Catch-up passes over the LastModifiedIndex; each one copies what changed during the one before
+CATCH_UP_PASSES = 3
+# Added to the copied collection version, so no ETag issued from the source can match the target
+VERSION_JUMP = 1000
+
+class WriteLimiter:
+    """A token bucket of write capacity units shared by all segments; writers wait while it's in debt."""
+
+    def __init__(self, units_per_second):
+        self.rate = units_per_second
+        self.tokens = units_per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens > 0:
+                    return
+                delay = -self.tokens / self.rate
+            time.sleep(delay)
+
+    def spend(self, consumed_capacity):
+        """Charges the ConsumedCapacity of a write (a dict, or a list of them for batch writes)."""
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        units = sum(entry.get('CapacityUnits', 0) for entry in consumed_capacity or [])
+        with self.lock:
+            self.tokens -= units
+
+class Checkpoint:
+    """Migration progress in a JSON file, rewritten atomically after every change."""
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+            if self.state['settings'] != settings:
+                raise ValueError(f"{path} belongs to a migration with different settings ({self.state['settings']}); "
+                                 f"delete it to start over.")
+        else:
+            self.state = {'settings': settings, 'startedMs': now_ms(), 'caughtUpMs': None,
+                          'segments': {str(segment): {'lastKey': None, 'done': False, 'copied': 0, 'skipped': 0}
+                                       for segment in range(settings['segments'])}}
+            self.save()
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+    def segment(self, segment):
+        return self.state['segments'][str(segment)]
+
+    def update(self, segment=None, **fields):
+        with self.lock:
+            (self.segment(segment) if segment is not None else self.state).update(fields)
+            self.save()
+
+def write_batch(client, table_name, items, limiter):
+    """Writes items with BatchWriteItem in chunks of 25, retrying unprocessed ones; raises if some never go through."""
+    requests = [{'PutRequest': {'Item': serialize_item(item)}} for item in items]
+    for start in range(0, len(requests), BATCH_WRITE_CHUNK_SIZE):
+        pending = requests[start:start + BATCH_WRITE_CHUNK_SIZE]
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            if attempt:
+                backoff(attempt)
+            limiter.wait()
+            response = with_retry('write', client.batch_write_item, RequestItems={table_name: pending})
+            limiter.spend(response.get('ConsumedCapacity'))
+            pending = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not pending:
+                break
+        else:
+            raise Exception(f"BatchWriteItem left {len(pending)} items unprocessed after {BATCH_MAX_ATTEMPTS} attempts.")
+
+def write_if_newer(client, table_name, item, limiter):
+    """Puts one item unless the target already holds a newer version of it; returns whether it wrote."""
+    limiter.wait()
+    try:
+        response = with_retry('write', client.put_item, TableName=table_name, Item=item,
+                              ConditionExpression='attribute_not_exists(lastModified) OR lastModified <= :modified',
+                              ExpressionAttributeValues={':modified': item['lastModified']})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    limiter.spend(response.get('ConsumedCapacity'))
+    return True
+
+# ======================================================================================
+# COPY
+# ======================================================================================
+
+def copy_table(client, source, target, transform, checkpoint, limiter):
+    """Copies every segment that hasn't finished yet, starting each from its checkpointed position."""
+    segments = checkpoint.state['settings']['segments']
+
+    def copy_segment(segment):
+        progress = checkpoint.segment(segment)
+        if progress['done']:
+            return
+        kwargs = {'TableName': source, 'Segment': segment, 'TotalSegments': segments, 'Limit': SCAN_PAGE_SIZE}
+        if progress['lastKey']:
+            kwargs['ExclusiveStartKey'] = deserialize_item(progress['lastKey'])
+        while True:
+            response = with_retry('read', client.scan, **kwargs)
+            items = response.get('Items', [])
+            transformed = [target_item for target_item in map(transform, items) if target_item is not None]
+            write_batch(client, target, transformed, limiter)
+            last_key = response.get('LastEvaluatedKey')
+            checkpoint.update(segment, lastKey=serialize_item(last_key) if last_key else None, done=last_key is None,
+                              copied=progress['copied'] + len(transformed),
+                              skipped=progress['skipped'] + len(items) - len(transformed))
+            if not last_key:
+                return
+            kwargs['ExclusiveStartKey'] = last_key
+
+    def report():
+        while not finished.wait(10):
+            progress = checkpoint.state['segments'].values()
+            print(f"  ⏳ {sum(entry['copied'] for entry in progress)} items copied, "
+                  f"{sum(entry['done'] for entry in progress)}/{segments} segments done...")
+
+    finished = threading.Event()
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    try:
+        with ThreadPoolExecutor(max_workers=segments) as pool:
+            for future in [pool.submit(copy_segment, segment) for segment in range(segments)]:
+                future.result()
+    finally:
+        finished.set()
+
+# ======================================================================================
+# CATCH UP
+# ======================================================================================
+
+def catch_up(client, source, target, transform, checkpoint, limiter, workers):
+    """Recopies, newest version only, everything changed since the copy (or the previous catch-up) began."""
+    since = checkpoint.state['caughtUpMs'] or checkpoint.state['startedMs']
+    copied = 0
+    for _ in range(CATCH_UP_PASSES):
+        pass_started = now_ms()
+        kwargs = {
+            'TableName': source,
+            'IndexName': LAST_MODIFIED_INDEX_NAME,
+            'KeyConditionExpression': 'syncBucket = :bucket AND lastModified > :since',
+            'ExpressionAttributeValues': {':bucket': SYNC_BUCKET, ':since': since - SYNC_OVERLAP_MS}
+        }
+        changed = []
+        while True:
+            response = with_retry('read', client.query, **kwargs)
+            changed.extend(target_item for target_item in map(transform, response.get('Items', [])) if target_item is not None)
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            copied += sum(pool.map(lambda item: write_if_newer(client, target, item, limiter), changed))
+        checkpoint.update(caughtUpMs=pass_started)
+        print(f"  ⏳ Catch-up pass: {len(changed)} changed items, {copied} copied so far...")
+        if not changed:
+            break
+        since = pass_started
+    return copied
+
+def copy_bookkeeping(client, source, target, transform):
+    """Copies the stats items as they are now and the collection version, jumped ahead by VERSION_JUMP."""
+    store = DynamoDBStore(source, None, client=client)
+    owners = with_retry('read', client.get_item, TableName=source, Key=STATS_ITEM_KEY,
+                        ConsistentRead=True).get('Item', {}).get('owners', ())
+    keys = [STATS_ITEM_KEY, VERSION_ITEM_KEY] + [{'estimateId': stats_item_id(owner_id)} for owner_id in sorted(owners)]
+    items = store.get_items([key['estimateId'] for key in keys], None, consistent=True)
+    for key in keys:
+        target_item = transform(items.get(key['estimateId']) or dict(key))
+        if target_item is None:
+            continue
+        if key == VERSION_ITEM_KEY:
+            target_item['version'] = int(target_item.get('version', 0)) + VERSION_JUMP
+        with_retry('write', client.put_item, TableName=target, Item=target_item)
+
+# ======================================================================================
+# MAIN
+# ======================================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy a CalcLinkSaver estimates table into a new table without downtime.")
+    parser.add_argument('--source', required=True, help="Table the function serves from, e.g. CalcLinkSaverMultiUserEstimates-abc123")
+    parser.add_argument('--target', required=True, help="Table to copy into (MIGRATION_TARGET_TABLE in the deploy script)")
+    parser.add_argument('--transform', default='copy',
+                        help="Per-item transform: copy, derive-sort-keys or module:function (default: copy). "
+                             "Must match MIGRATION_TRANSFORM in the deploy script.")
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS,
+                        help=f"Parallel Scan segments (default: {DEFAULT_SEGMENTS}); fixed once a migration has started")
+    parser.add_argument('--write-capacity', type=float, default=DEFAULT_WRITE_CAPACITY,
+                        help=f"Write capacity units per second to use on the target (default: {DEFAULT_WRITE_CAPACITY})")
+    parser.add_argument('--checkpoint', help="Progress file (default: migrate-<source>-<target>.json)")
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("--source and --target must be different tables.")
+    transform = load_transform(args.transform)
+    checkpoint_path = args.checkpoint or f"migrate-{args.source}-{args.target}.json"
+    try:
+        checkpoint = Checkpoint(checkpoint_path, {'source': args.source, 'target': args.target,
+                                                  'transform': args.transform, 'segments': args.segments})
+    except ValueError as e:
+        print(f"❌ {e}")
+        exit(1)
+    dynamodb_client = boto3.client('dynamodb')
+    limiter = WriteLimiter(args.write_capacity)
+    started = time.monotonic()
+
+    remaining = [segment for segment in range(args.segments) if not checkpoint.segment(segment)['done']]
+    if remaining:
+        resumed = len(remaining) < args.segments or any(checkpoint.segment(segment)['lastKey'] for segment in remaining)
+        print(f"🚚 {'Resuming' if resumed else 'Starting'} copy of '{args.source}' to '{args.target}' "
+              f"({len(remaining)} of {args.segments} segments to go, up to {args.write_capacity:g} WCU/s)...")
+        print("   The function must already be mirroring writes to the target (MIGRATION_TARGET_TABLE).")
+        copy_table(dynamodb_client, args.source, args.target, transform, checkpoint, limiter)
+    segments = checkpoint.state['segments'].values()
+    print(f"✅ Copy complete: {sum(entry['copied'] for entry in segments)} items copied, "
+          f"{sum(entry['skipped'] for entry in segments)} left out by the transform.")
+
+    print("🔁 Catching up with changes made since the copy began...")
+    copied = catch_up(dynamodb_client, args.source, args.target, transform, checkpoint, limiter, args.segments)
+    copy_bookkeeping(dynamodb_client, args.source, args.target, transform)
+    print(f"✅ {copied} changed items recopied and bookkeeping items copied ({time.monotonic() - started:.0f}s).")
+    print(f"   '{args.target}' is ready: set ESTIMATES_TABLE_NAME to it, clear MIGRATION_TARGET_TABLE and --update.")
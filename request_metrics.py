@@ -0,0 +1,152 @@
+# filename: request_metrics.py
+# description: Per-request instrumentation for the /estimates API. Each request gets phase timings
+#              (auth lookup, store calls, serialization), store call counts and consumed DynamoDB
+#              capacity, emitted as one CloudWatch Embedded Metric Format (EMF) log line.
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CalcLinkSaver')
+# 'stdout' prints one EMF line per request (CloudWatch Logs extracts the metrics); 'none' turns emission off
+METRICS_SINK = os.environ.get('METRICS_SINK', 'stdout')
+# Adds a Server-Timing header with the phase breakdown, visible in browser dev tools
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+# Phase name -> (EMF metric name, Server-Timing metric name)
+PHASES = {
+    'auth': ('AuthTime', 'auth'),
+    'store': ('StoreTime', 'store'),
+    'serialize': ('SerializationTime', 'serialize')
+}
+
+class RequestMetrics:
+    """Timings and counters for one request. Safe to update from the export's worker threads."""
+
+    def __init__(self, route, request_id=None):
+        self.route = route
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.timestamp_ms = int(time.time() * 1000)
+        self.phases = {}
+        self.store_calls = 0
+        self.read_units = 0.0
+        self.write_units = 0.0
+        self.status_code = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def add_phase(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_store_call(self, seconds, read_units=0.0, write_units=0.0):
+        with self.lock:
+            self.phases['store'] = self.phases.get('store', 0.0) + seconds
+            self.store_calls += 1
+            self.read_units += read_units
+            self.write_units += write_units
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """Formats the phases as a Server-Timing header value. Parallel store calls are summed."""
+        parts = [f"{header_name};dur={self.phases[phase] * 1000:.2f}"
+                 for phase, (_, header_name) in PHASES.items() if phase in self.phases]
+        parts.append(f"total;dur={self.elapsed_ms():.2f}")
+        return ', '.join(parts)
+
+    def to_emf(self):
+        """Builds the EMF record: metric values as top-level keys, declared under _aws."""
+        values = {'Latency': round(self.elapsed_ms(), 3)}
+        for phase, (metric_name, _) in PHASES.items():
+            values[metric_name] = round(self.phases.get(phase, 0.0) * 1000, 3)
+        values['StoreCalls'] = self.store_calls
+        values['ConsumedReadCapacity'] = self.read_units
+        values['ConsumedWriteCapacity'] = self.write_units
+        units = {'StoreCalls': 'Count', 'ConsumedReadCapacity': 'Count', 'ConsumedWriteCapacity': 'Count'}
+        record = {
+            '_aws': {
+                'Timestamp': self.timestamp_ms,
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['Route']],
+                    'Metrics': [{'Name': name, 'Unit': units.get(name, 'Milliseconds')} for name in values]
+                }]
+            },
+            'Route': self.route,
+            'StatusCode': self.status_code
+        }
+        record.update(values)
+        if self.request_id:
+            record['RequestId'] = self.request_id
+        if self.error:
+            record['Error'] = self.error
+        return record
+
+class CollectingSink:
+    """Keeps emitted records in memory, for tests and benchmarks."""
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+def stdout_sink(record):
+    print(json.dumps(record, separators=(',', ':')), file=sys.stdout, flush=True)
+
+_sink = stdout_sink if METRICS_SINK == 'stdout' else None
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+def set_sink(sink):
+    """Replaces where records go: any callable taking the EMF dict, or None to stop emitting."""
+    global _sink
+    _sink = sink
+
+def current():
+    """The metrics of the request being handled in this context, or None outside a request."""
+    return _current.get()
+
+@contextmanager
+def track(route, request_id=None):
+    """Makes a RequestMetrics current for the block and emits it when the block ends."""
+    metrics = RequestMetrics(route, request_id)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        if _sink is not None:
+            _sink(metrics.to_emf())
+
+@contextmanager
+def timed(phase):
+    """Adds the block's duration to a phase of the current request, if there is one."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_phase(phase, time.perf_counter() - started)
+
+def record_store_call(seconds, consumed_capacity=None, kind='read'):
+    """Counts one store call. consumed_capacity is DynamoDB's ConsumedCapacity (a dict, or a list for batches)."""
+    metrics = _current.get()
+    if metrics is None:
+        return
+    if isinstance(consumed_capacity, dict):
+        consumed_capacity = [consumed_capacity]
+    units = sum(entry.get('CapacityUnits', 0.0) for entry in consumed_capacity or [])
+    metrics.add_store_call(seconds, units if kind == 'read' else 0.0, units if kind == 'write' else 0.0)
+
+def record_error(error):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.error = f"{type(error).__name__}: {error}"
@@ -0,0 +1,108 @@
+# Shared fixtures: the router (estimates_api.handle) in front of each store it runs against, the
+# self-hosted SQLiteStore and the real DynamoDBStore on the in-memory DynamoDB stand-in.
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import estimates_api
+import request_metrics
+from estimates_api import handle, hash_api_key
+
+ESTIMATES_TABLE_NAME = 'TestEstimates'
+USERS_TABLE_NAME = 'TestUsers'
+
+
+class Backend:
+    """A store with two users, Alice and Bob, and a helper that sends requests through the router."""
+
+    def __init__(self, kind, store, users, database=None):
+        self.kind = kind
+        self.store = store
+        self.users = users
+        self.database = database
+
+    def request(self, user, method, path, query=None, body=None, headers=None):
+        """Sends one REST API (payload 1.0) event as `user`; returns (status, headers, parsed body)."""
+        path_parameters = None
+        if path.startswith('/estimates/') and path not in ('/estimates/stats', '/estimates/export'):
+            path_parameters = {'id': path[len('/estimates/'):]}
+        response = handle({
+            'httpMethod': method,
+            'path': path,
+            'headers': headers or {},
+            'queryStringParameters': query,
+            'pathParameters': path_parameters,
+            'body': json.dumps(body) if body is not None else None,
+            'requestContext': {'identity': {'apiKeyId': self.users[user]['apiKeyId']}}
+        }, self.store)
+        try:
+            parsed = json.loads(response['body']) if response['body'] else None
+        except ValueError:
+            parsed = response['body']
+        return response['statusCode'], response.get('headers') or {}, parsed
+
+    def save(self, user, estimate_id, url=None, name=None, cost='$1.00'):
+        body = {'id': estimate_id, 'name': name or estimate_id, 'annualCost': cost, 'timestamp': '2024-01-01T00:00:00.000Z'}
+        if url:
+            body['url'] = url
+        status, _, _ = self.request(user, 'POST', '/estimates', body=body)
+        assert status == 201
+        return estimate_id
+
+    def rebuild_stats(self):
+        if self.kind == 'sqlite':
+            self.store.rebuild_stats()
+        else:
+            import maintenance
+            maintenance.rebuild_stats(self.store)
+
+
+def make_sqlite_backend(directory):
+    from local_server import SQLiteStore
+    store = SQLiteStore(os.path.join(directory, 'estimates.db'), pool_size=2)
+    users = {}
+    for name in ('Alice', 'Bob'):
+        user_id, api_key = store.add_user(name)
+        users[name] = {'userId': user_id, 'apiKeyId': hash_api_key(api_key)}
+    return Backend('sqlite', store, users)
+
+
+def make_dynamodb_backend():
+    import benchmark_handler
+    from dynamodb_store import DynamoDBStore
+    from inmemory_dynamodb import InMemoryDynamoDB
+    database = InMemoryDynamoDB(seed=1)
+    database.create_table(TableName=ESTIMATES_TABLE_NAME, **benchmark_handler.ESTIMATES_TABLE_SCHEMA)
+    users_table = database.create_table(TableName=USERS_TABLE_NAME, KeySchema=[{'AttributeName': 'apiKeyId', 'KeyType': 'HASH'}])
+    users = {}
+    for name in ('Alice', 'Bob'):
+        user = {'apiKeyId': f'key-{name.lower()}', 'userId': name.lower(), 'displayName': name}
+        users_table.put_item(Item=user)
+        users[name] = user
+    store = DynamoDBStore(ESTIMATES_TABLE_NAME, USERS_TABLE_NAME, client=database.client())
+    return Backend('dynamodb', store, users, database)
+
+
+@pytest.fixture(autouse=True)
+def no_metrics_output():
+    request_metrics.set_sink(None)
+    yield
+
+
+@pytest.fixture(params=['sqlite', 'dynamodb'])
+def backend(request, tmp_path, monkeypatch):
+    # Exports go to the test's own directory
+    monkeypatch.setattr(estimates_api, '_blob_store', estimates_api.LocalBlobStore(str(tmp_path / 'blobs')))
+    if request.param == 'sqlite':
+        return make_sqlite_backend(str(tmp_path))
+    return make_dynamodb_backend()
+
+
+@pytest.fixture
+def dynamodb():
+    """Only the in-memory DynamoDB backend, for DynamoDB-specific behaviour such as capacity use."""
+    return make_dynamodb_backend()
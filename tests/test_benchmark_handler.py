@@ -0,0 +1,33 @@
+import argparse
+import json
+import random
+
+import pytest
+
+import benchmark_handler
+from estimates_api import estimate_key
+
+
+def benchmark_args(store, requests=300):
+    # One thread, so every delete runs after the saves scheduled before it have completed
+    return argparse.Namespace(store=store, owners=5, threads=1, requests=requests, event_format='1.0',
+                              accept_encoding=None, unprocessed_rate=0.0, seed=1)
+
+
+def test_completed_save_queues_the_key_it_was_stored_under():
+    user = {'userId': 'u1', 'apiKeyId': 'key-1', 'apiKey': 'key-1'}
+    workload = benchmark_handler.Workload([user], {'u1': []}, None, '1.0')
+    _, event = workload.event('save', random.Random(1))
+    body = json.loads(event['body'])
+    workload.completed('save', user, event, 201)
+    assert workload.owned['u1'] == [estimate_key('u1', body['url'])]
+    assert body['id'] not in workload.owned['u1']
+
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite'])
+def test_deletes_of_saved_estimates_succeed(store, tmp_path):
+    # More deletes than seeded estimates, so many of them target estimates the workload itself saved
+    mix = {'save': 60, 'delete': 40}
+    report = benchmark_handler.benchmark(benchmark_args(store), 50, mix, str(tmp_path))
+    assert report['routes']['delete']['requests'] > 50
+    assert report['errors'] == 0
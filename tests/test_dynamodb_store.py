@@ -0,0 +1,61 @@
+from dynamodb_store import deserialize_item, STATS_ITEM_KEY, stats_item_id
+from conftest import ESTIMATES_TABLE_NAME, USERS_TABLE_NAME
+
+
+def get_item(backend, estimate_id):
+    item = backend.database.client().get_item(TableName=ESTIMATES_TABLE_NAME, Key={'estimateId': {'S': estimate_id}}).get('Item')
+    return deserialize_item(item) if item else None
+
+
+def save_write_units(backend, user, estimate_id):
+    """Write capacity consumed by one POST /estimates."""
+    with backend.database.capture() as usage:
+        backend.save(user, estimate_id)
+    return sum(totals['write_units'] for totals in usage.values())
+
+
+def add_owners(backend, count):
+    """Gives `count` extra owners an estimate each, so they all have stats."""
+    users_table = backend.database.tables[USERS_TABLE_NAME]
+    for index in range(count):
+        name = f'Owner{index}'
+        users_table.put_item(Item={'apiKeyId': f'key-{index}', 'userId': f'owner-{index}', 'displayName': name})
+        backend.users[name] = {'apiKeyId': f'key-{index}', 'userId': f'owner-{index}'}
+        backend.save(name, f'owned-{index}')
+
+
+def test_each_owner_has_their_own_stats_item(dynamodb):
+    dynamodb.save('Alice', 'a1', cost='$4.00')
+    dynamodb.save('Bob', 'b1', cost='$1.00')
+    assert get_item(dynamodb, stats_item_id('alice'))['estimateCount'] == 1
+    assert get_item(dynamodb, stats_item_id('bob'))['annualCostCents'] == 100
+    assert get_item(dynamodb, STATS_ITEM_KEY['estimateId'])['owners'] == {'alice', 'bob'}
+
+
+def test_save_cost_does_not_grow_with_the_number_of_owners(dynamodb):
+    dynamodb.save('Alice', 'warm-up')
+    few_owners = save_write_units(dynamodb, 'Alice', 'first')
+    add_owners(dynamodb, 60)
+    many_owners = save_write_units(dynamodb, 'Alice', 'second')
+    assert many_owners == few_owners
+
+
+def test_stats_items_stay_out_of_listings(dynamodb):
+    dynamodb.save('Alice', 'a1')
+    _, _, body = dynamodb.request('Alice', 'GET', '/estimates')
+    assert [item['estimateId'] for item in body] == ['a1']
+
+
+def test_rebuild_replaces_the_single_stats_item_of_earlier_versions(dynamodb):
+    dynamodb.save('Alice', 'a1', cost='$2.00')
+    # Earlier versions kept every owner's counters as attributes of one item
+    dynamodb.database.client().put_item(TableName=ESTIMATES_TABLE_NAME, Item={
+        'estimateId': {'S': '#stats'}, 'estimateCount#alice': {'N': '9'}, 'estimateCount#gone': {'N': '3'}})
+    dynamodb.store.apply_stats({'gone': {'estimateCount': 3, 'annualCostCents': 0, 'lastSavedMs': None, 'ownerName': 'Gone'}})
+
+    dynamodb.rebuild_stats()
+
+    assert get_item(dynamodb, STATS_ITEM_KEY['estimateId']) == {'estimateId': '#stats', 'owners': {'alice'}}
+    assert get_item(dynamodb, stats_item_id('gone')) is None
+    assert dynamodb.store.get_stats() == [{'ownerId': 'alice', 'ownerName': 'Alice', 'estimateCount': 1,
+                                           'annualCostCents': 200, 'lastSavedMs': get_item(dynamodb, 'a1')['lastModified']}]
@@ -0,0 +1,302 @@
+# Router tests: every case runs against both SQLiteStore and DynamoDBStore (see conftest.py).
+import csv
+import io
+import json
+
+from estimates_api import estimate_key, MAX_BATCH_ITEMS, now_ms, TOMBSTONE_TTL_SECONDS
+
+# The userscript always sends one; the owner index leaves out estimates without it
+TIMESTAMP = '2024-01-01T00:00:00.000Z'
+
+
+def list_ids(backend, user='Alice', **query):
+    status, _, body = backend.request(user, 'GET', '/estimates', query=query or None)
+    assert status == 200
+    items = body['items'] if isinstance(body, dict) else body
+    return [item['estimateId'] for item in items]
+
+
+# ======================================================================================
+# PAGINATION
+# ======================================================================================
+
+def test_cursor_pages_through_every_estimate_once(backend):
+    saved = {backend.save('Alice' if index % 2 else 'Bob', f'e{index:02d}') for index in range(25)}
+    seen = []
+    query = {'limit': '10'}
+    pages = 0
+    while True:
+        status, _, body = backend.request('Alice', 'GET', '/estimates', query=query)
+        assert status == 200
+        assert len(body['items']) <= 10
+        seen.extend(item['estimateId'] for item in body['items'])
+        pages += 1
+        if not body['nextCursor']:
+            break
+        query = {'limit': '10', 'cursor': body['nextCursor']}
+    assert sorted(seen) == sorted(saved)
+    assert pages >= 3
+
+
+def test_owner_pages_hold_only_the_owners_estimates(backend):
+    mine = {backend.save('Alice', f'a{index}') for index in range(7)}
+    backend.save('Bob', 'b0')
+    seen = []
+    query = {'owner': 'me', 'limit': '3'}
+    while True:
+        _, _, body = backend.request('Alice', 'GET', '/estimates', query=query)
+        seen.extend(item['estimateId'] for item in body['items'])
+        if not body['nextCursor']:
+            break
+        query = {'owner': 'me', 'limit': '3', 'cursor': body['nextCursor']}
+    assert sorted(seen) == sorted(mine)
+
+
+def test_invalid_cursor_is_rejected(backend):
+    status, _, _ = backend.request('Alice', 'GET', '/estimates', query={'limit': '10', 'cursor': 'not-a-cursor'})
+    assert status == 400
+
+
+# ======================================================================================
+# CONDITIONAL GET
+# ======================================================================================
+
+def test_unchanged_collection_answers_304(backend):
+    backend.save('Alice', 'e1')
+    status, headers, _ = backend.request('Alice', 'GET', '/estimates')
+    assert status == 200
+    etag = headers['ETag']
+
+    status, headers, body = backend.request('Alice', 'GET', '/estimates', headers={'If-None-Match': etag})
+    assert status == 304
+    assert headers['ETag'] == etag
+    assert body is None
+
+
+def test_write_changes_the_etag(backend):
+    backend.save('Alice', 'e1')
+    _, headers, _ = backend.request('Alice', 'GET', '/estimates')
+    etag = headers['ETag']
+    backend.save('Bob', 'e2')
+    status, headers, body = backend.request('Alice', 'GET', '/estimates', headers={'If-None-Match': etag})
+    assert status == 200
+    assert headers['ETag'] != etag
+    assert {item['estimateId'] for item in body} == {'e1', 'e2'}
+
+
+def test_etag_depends_on_query_and_owner(backend):
+    backend.save('Alice', 'e1')
+    _, all_headers, _ = backend.request('Alice', 'GET', '/estimates')
+    _, mine_headers, _ = backend.request('Alice', 'GET', '/estimates', query={'owner': 'me'})
+    _, bobs_headers, _ = backend.request('Bob', 'GET', '/estimates', query={'owner': 'me'})
+    assert len({all_headers['ETag'], mine_headers['ETag'], bobs_headers['ETag']}) == 3
+    status, _, _ = backend.request('Alice', 'GET', '/estimates', query={'owner': 'me'},
+                                   headers={'If-None-Match': all_headers['ETag']})
+    assert status == 200
+
+
+def test_stats_answer_304_until_a_write(backend):
+    backend.save('Alice', 'e1')
+    _, headers, _ = backend.request('Alice', 'GET', '/estimates/stats')
+    status, _, _ = backend.request('Alice', 'GET', '/estimates/stats', headers={'If-None-Match': headers['ETag']})
+    assert status == 304
+    backend.request('Alice', 'DELETE', '/estimates/e1')
+    status, _, body = backend.request('Alice', 'GET', '/estimates/stats', headers={'If-None-Match': headers['ETag']})
+    assert status == 200
+    assert body['totals']['estimateCount'] == 0
+
+
+# ======================================================================================
+# DELETES AND TOMBSTONES
+# ======================================================================================
+
+def test_delete_leaves_a_tombstone_for_delta_sync(backend):
+    backend.save('Alice', 'keep')
+    backend.save('Alice', 'gone')
+    _, _, body = backend.request('Alice', 'GET', '/estimates', query={'limit': '100'})
+    sync_token = body['syncToken']
+
+    status, _, _ = backend.request('Alice', 'DELETE', '/estimates/gone')
+    assert status == 204
+
+    assert list_ids(backend) == ['keep']
+    _, _, body = backend.request('Alice', 'GET', '/estimates', query={'since': str(sync_token)})
+    changes = {item['estimateId']: item for item in body['items']}
+    assert changes['gone']['deleted'] is True
+    assert not changes.get('keep', {}).get('deleted')
+
+
+def test_delete_checks_ownership_and_existence(backend):
+    backend.save('Alice', 'e1')
+    assert backend.request('Bob', 'DELETE', '/estimates/e1')[0] == 403
+    assert backend.request('Alice', 'DELETE', '/estimates/missing')[0] == 404
+    assert backend.request('Alice', 'DELETE', '/estimates/e1')[0] == 204
+    assert backend.request('Alice', 'DELETE', '/estimates/e1')[0] == 404
+
+
+def test_since_older_than_tombstone_retention_is_gone(backend):
+    since = now_ms() - (TOMBSTONE_TTL_SECONDS + 60) * 1000
+    status, _, _ = backend.request('Alice', 'GET', '/estimates', query={'since': str(since)})
+    assert status == 410
+
+
+def test_saving_over_a_tombstone_revives_the_estimate(backend):
+    backend.save('Alice', 'e1')
+    backend.request('Alice', 'DELETE', '/estimates/e1')
+    backend.save('Alice', 'e1', name='back again')
+    _, _, body = backend.request('Alice', 'GET', '/estimates')
+    assert [(item['estimateId'], item['name']) for item in body] == [('e1', 'back again')]
+
+
+# ======================================================================================
+# BATCH ROUTES
+# ======================================================================================
+
+def test_batch_save_reports_each_item(backend):
+    backend.save('Bob', 'bobs')
+    items = [{'id': 'b1', 'name': 'one', 'annualCost': '$1', 'timestamp': TIMESTAMP},
+             {'id': 'b2', 'name': 'two', 'annualCost': '$2', 'timestamp': TIMESTAMP},
+             {'id': 'bobs', 'name': 'not mine', 'annualCost': '$3', 'timestamp': TIMESTAMP}]
+    status, _, body = backend.request('Alice', 'POST', '/estimates:batchSave', body={'items': items})
+    assert status == 200
+    assert [(result['id'], result['status']) for result in body['results']] == [('b1', 201), ('b2', 201), ('bobs', 403)]
+    assert sorted(list_ids(backend, owner='me')) == ['b1', 'b2']
+
+
+def test_batch_save_rejects_duplicate_ids_and_oversized_batches(backend):
+    duplicate = [{'id': 'x', 'name': 'a'}, {'id': 'x', 'name': 'b'}]
+    assert backend.request('Alice', 'POST', '/estimates:batchSave', body={'items': duplicate})[0] == 400
+    oversized = [{'id': f'e{index}', 'name': 'n'} for index in range(MAX_BATCH_ITEMS + 1)]
+    assert backend.request('Alice', 'POST', '/estimates:batchSave', body={'items': oversized})[0] == 400
+    assert list_ids(backend) == []
+
+
+def test_batch_delete_reports_each_item(backend):
+    backend.save('Alice', 'mine')
+    backend.save('Bob', 'bobs')
+    status, _, body = backend.request('Alice', 'POST', '/estimates:batchDelete',
+                                      body={'ids': ['mine', 'bobs', 'missing', 'mine']})
+    assert status == 200
+    assert [(result['id'], result['status']) for result in body['results']] == [
+        ('mine', 204), ('bobs', 403), ('missing', 404), ('mine', 404)]
+    assert list_ids(backend) == ['bobs']
+
+
+def test_bodies_that_are_not_objects_are_rejected(backend):
+    for path in ('/estimates', '/estimates:batchSave', '/estimates:batchDelete', '/estimates:restore'):
+        for body in (5, ['e1'], 'e1'):
+            assert backend.request('Alice', 'POST', path, body=body)[0] == 400
+
+
+# ======================================================================================
+# EXPORT
+# ======================================================================================
+
+def read_export(body):
+    assert body['url'].startswith('file://')
+    with open(body['url'][len('file://'):], encoding='utf-8') as f:
+        return f.read()
+
+
+def test_export_writes_every_live_estimate(backend):
+    saved = {backend.save('Alice' if index % 2 else 'Bob', f'e{index:02d}') for index in range(12)}
+    backend.request('Alice', 'DELETE', '/estimates/e01')
+    status, _, body = backend.request('Alice', 'GET', '/estimates/export')
+    assert status == 200
+    assert (body['format'], body['itemCount']) == ('csv', 11)
+
+    rows = list(csv.reader(io.StringIO(read_export(body))))
+    assert rows[0] == ['estimateId', 'name', 'url', 'timestamp', 'annualCost', 'ownerId', 'ownerName']
+    assert sorted(row[0] for row in rows[1:]) == sorted(saved - {'e01'})
+
+
+def test_export_as_ndjson(backend):
+    backend.save('Alice', 'e1', name='first', cost='$2.00')
+    status, _, body = backend.request('Alice', 'GET', '/estimates/export', query={'format': 'ndjson'})
+    assert status == 200
+    lines = [json.loads(line) for line in read_export(body).splitlines()]
+    assert [(line['estimateId'], line['name'], line['annualCost'], line['ownerName']) for line in lines] == [
+        ('e1', 'first', '$2.00', 'Alice')]
+
+
+def test_export_rejects_unknown_formats(backend):
+    assert backend.request('Alice', 'GET', '/estimates/export', query={'format': 'xml'})[0] == 400
+
+
+# ======================================================================================
+# DEDUPLICATION
+# ======================================================================================
+
+def test_saving_a_link_again_updates_one_estimate(backend):
+    alice_id = backend.users['Alice']['userId']
+    backend.save('Alice', 'client-1', url='https://calculator.aws/#/estimate?id=abc', name='first')
+    backend.save('Alice', 'client-2', url='HTTPS://Calculator.AWS:443/#/estimate?id=abc', name='second')
+    _, _, body = backend.request('Alice', 'GET', '/estimates')
+    assert [(item['estimateId'], item['name']) for item in body] == [
+        (estimate_key(alice_id, 'https://calculator.aws/#/estimate?id=abc'), 'second')]
+
+
+def test_owners_keep_separate_copies_of_a_link(backend):
+    url = 'https://calculator.aws/#/estimate?id=abc'
+    backend.save('Alice', 'client-1', url=url)
+    backend.save('Bob', 'client-1', url=url)
+    assert len(list_ids(backend)) == 2
+
+
+def test_batch_save_collapses_entries_for_the_same_link(backend):
+    url = 'https://calculator.aws/#/estimate?id=abc'
+    items = [{'id': 'c1', 'url': url, 'name': 'old'}, {'id': 'c2', 'url': url.replace('calculator', 'CALCULATOR'), 'name': 'new'}]
+    _, _, body = backend.request('Alice', 'POST', '/estimates:batchSave', body={'items': items})
+    assert [(result['id'], result['status']) for result in body['results']] == [('c1', 201), ('c2', 201)]
+    _, _, listing = backend.request('Alice', 'GET', '/estimates')
+    assert [item['name'] for item in listing] == ['new']
+
+
+# ======================================================================================
+# STATS
+# ======================================================================================
+
+def stats(backend, user='Alice', **query):
+    status, _, body = backend.request(user, 'GET', '/estimates/stats', query=query or None)
+    assert status == 200
+    return body
+
+
+def test_stats_follow_saves_and_deletes(backend):
+    backend.save('Alice', 'a1', cost='$10.00')
+    backend.save('Alice', 'a2', cost='$2.50')
+    backend.save('Bob', 'b1', cost='$1.00')
+    backend.save('Alice', 'a2', cost='$5.00') # Overwrite: the count stays, the cost changes
+    backend.request('Alice', 'DELETE', '/estimates/a1')
+
+    body = stats(backend)
+    by_owner = {entry['ownerName']: (entry['estimateCount'], entry['annualCostCents']) for entry in body['owners']}
+    assert by_owner == {'Alice': (1, 500), 'Bob': (1, 100)}
+    assert body['totals'] == {'estimateCount': 2, 'annualCostCents': 600}
+
+    mine = stats(backend, owner='me')
+    assert [entry['ownerName'] for entry in mine['owners']] == ['Alice']
+    assert mine['totals'] == {'estimateCount': 1, 'annualCostCents': 500}
+
+
+def test_rebuild_recounts_drifted_stats(backend):
+    for index in range(5):
+        backend.save('Alice', f'a{index}', cost='$3.00')
+    backend.save('Bob', 'b1', cost='$7.00')
+    backend.request('Bob', 'DELETE', '/estimates/b1')
+    expected = stats(backend)
+
+    # A write that failed halfway through leaves the stats off
+    drift = {backend.users['Alice']['userId']: {'estimateCount': 4, 'annualCostCents': -99, 'lastSavedMs': None, 'ownerName': None},
+             'ghost': {'estimateCount': 2, 'annualCostCents': 0, 'lastSavedMs': None, 'ownerName': 'Ghost'}}
+    if backend.kind == 'sqlite':
+        with backend.store.pool.transaction() as conn:
+            backend.store._apply_stats(conn, drift)
+    else:
+        backend.store.apply_stats(drift)
+    backend.store.bump_collection_version()
+    assert stats(backend) != expected
+
+    backend.rebuild_stats()
+    assert stats(backend) == expected
+    assert expected['totals'] == {'estimateCount': 5, 'annualCostCents': 1500}
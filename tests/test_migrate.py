@@ -0,0 +1,106 @@
+import pytest
+
+import benchmark_handler
+import migrate
+from conftest import ESTIMATES_TABLE_NAME, make_dynamodb_backend, USERS_TABLE_NAME
+from dynamodb_store import derive_sort_keys, DynamoDBStore, SORT_ATTRIBUTES
+
+TARGET_TABLE_NAME = 'TestEstimatesV2'
+SETTINGS = {'source': ESTIMATES_TABLE_NAME, 'target': TARGET_TABLE_NAME, 'transform': 'derive-sort-keys', 'segments': 3}
+
+
+@pytest.fixture
+def source():
+    """The DynamoDB backend with some estimates, a tombstone, stale sort keys and an empty target table."""
+    backend = make_dynamodb_backend()
+    backend.database.create_table(TableName=TARGET_TABLE_NAME, **benchmark_handler.ESTIMATES_TABLE_SCHEMA)
+    for index in range(30):
+        backend.save('Alice' if index % 3 else 'Bob', f'e{index:02d}', name=f'Estimate {index}')
+    backend.request('Alice', 'DELETE', '/estimates/e01')
+    client = backend.database.client()
+    for estimate_id in ('e02', 'e03'):
+        client.update_item(TableName=ESTIMATES_TABLE_NAME, Key={'estimateId': {'S': estimate_id}},
+                           UpdateExpression='REMOVE ' + ', '.join(SORT_ATTRIBUTES.values()))
+    return backend
+
+
+def migrate_all(backend, checkpoint_path, transform=derive_sort_keys):
+    client = backend.database.client()
+    checkpoint = migrate.Checkpoint(checkpoint_path, SETTINGS)
+    limiter = migrate.WriteLimiter(10000)
+    migrate.copy_table(client, ESTIMATES_TABLE_NAME, TARGET_TABLE_NAME, transform, checkpoint, limiter)
+    migrate.catch_up(client, ESTIMATES_TABLE_NAME, TARGET_TABLE_NAME, transform, checkpoint, limiter, 2)
+    migrate.copy_bookkeeping(client, ESTIMATES_TABLE_NAME, TARGET_TABLE_NAME, transform)
+    return checkpoint
+
+
+def table_items(backend, table_name):
+    store = DynamoDBStore(table_name, USERS_TABLE_NAME, client=backend.database.client())
+    return {item['estimateId']: item for item in store.read_all(since=0)}
+
+
+def test_copy_passes_every_estimate_and_tombstone_through_the_transform(source, tmp_path):
+    migrate_all(source, str(tmp_path / 'checkpoint.json'))
+    copied = table_items(source, TARGET_TABLE_NAME)
+    assert copied == {estimate_id: derive_sort_keys(item) for estimate_id, item in table_items(source, ESTIMATES_TABLE_NAME).items()}
+    assert copied['e01']['deleted'] is True
+    assert all(name in copied['e02'] for name in SORT_ATTRIBUTES.values())
+
+
+def test_target_serves_the_same_stats_and_a_newer_collection_version(source, tmp_path):
+    migrate_all(source, str(tmp_path / 'checkpoint.json'))
+    target = DynamoDBStore(TARGET_TABLE_NAME, USERS_TABLE_NAME, client=source.database.client())
+    assert target.get_stats() == source.store.get_stats()
+    assert target.get_collection_version() == source.store.get_collection_version() + migrate.VERSION_JUMP
+
+
+def test_interrupted_copy_resumes_from_its_checkpoint(source, tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    calls = []
+
+    def failing_transform(item):
+        calls.append(item['estimateId'])
+        if len(calls) == 15:
+            raise RuntimeError('interrupted')
+        return derive_sort_keys(item)
+
+    with pytest.raises(RuntimeError):
+        migrate.copy_table(source.database.client(), ESTIMATES_TABLE_NAME, TARGET_TABLE_NAME, failing_transform,
+                           migrate.Checkpoint(checkpoint_path, SETTINGS), migrate.WriteLimiter(10000))
+    checkpoint = migrate_all(source, checkpoint_path)
+
+    assert table_items(source, TARGET_TABLE_NAME).keys() == table_items(source, ESTIMATES_TABLE_NAME).keys()
+    assert all(segment['done'] for segment in checkpoint.state['segments'].values())
+
+
+def test_checkpoint_of_another_migration_is_refused(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    migrate.Checkpoint(checkpoint_path, SETTINGS)
+    with pytest.raises(ValueError):
+        migrate.Checkpoint(checkpoint_path, dict(SETTINGS, transform='copy'))
+
+
+def test_catch_up_recopies_changes_made_during_the_copy(source, tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    client = source.database.client()
+    checkpoint = migrate.Checkpoint(checkpoint_path, SETTINGS)
+    limiter = migrate.WriteLimiter(10000)
+    migrate.copy_table(client, ESTIMATES_TABLE_NAME, TARGET_TABLE_NAME, derive_sort_keys, checkpoint, limiter)
+    # Written after the copy passed these items, with no mirroring to carry them across
+    source.save('Alice', 'e04', name='renamed')
+    source.request('Bob', 'DELETE', '/estimates/e00')
+
+    migrate.catch_up(client, ESTIMATES_TABLE_NAME, TARGET_TABLE_NAME, derive_sort_keys, checkpoint, limiter, 2)
+    copied = table_items(source, TARGET_TABLE_NAME)
+    assert copied['e04']['name'] == 'renamed'
+    assert copied['e00']['deleted'] is True
+
+
+def test_mirrored_writes_reach_the_target(source):
+    source.store = DynamoDBStore(ESTIMATES_TABLE_NAME, USERS_TABLE_NAME, client=source.database.client(),
+                                 mirror_table_name=TARGET_TABLE_NAME, mirror_transform='derive-sort-keys')
+    source.save('Bob', 'mirrored', name='Mirrored')
+    source.request('Alice', 'DELETE', '/estimates/e02')
+    copied = table_items(source, TARGET_TABLE_NAME)
+    assert copied['mirrored']['name'] == 'Mirrored'
+    assert copied['e02']['deleted'] is True